@@ -0,0 +1,156 @@
+import math
+from abc import ABC, abstractmethod
+from array import array
+
+# Ratings go from 0 to 5 in steps of half a star
+MIN_RATING = 0
+MAX_RATING = 5
+RATING_STEP = 0.5
+RATING_BINS = int((MAX_RATING - MIN_RATING) / RATING_STEP) + 1
+
+
+def rating_bin(rating: float) -> int:
+    """Finds the histogram bin of a rating, ratings between steps go to the nearest step
+
+    Args:
+        rating (float): The rating
+
+    Returns:
+        int: Index of the bin, ratings outside of the scale go to the first or last bin
+    """
+    index = round((rating - MIN_RATING) / RATING_STEP)
+    return min(max(index, 0), RATING_BINS - 1)
+
+
+def bin_rating(index: int) -> float:
+    """Gets the rating a histogram bin stands for
+
+    Args:
+        index (int): Index of the bin
+
+    Returns:
+        float: The rating
+    """
+    return MIN_RATING + index * RATING_STEP
+
+
+class Aggregator(ABC):
+    """A per-book metric computed in the same pass as the average rating and favorites. Every book gets a state of a
+    fixed size, and ratings can be removed as well as added so superseded ratings can be retracted.
+    Subclasses set `name` and implement the abstract methods below.
+    """
+
+    name = ""
+
+    @abstractmethod
+    def create(self):
+        """Creates the state of a book without ratings
+
+        Returns:
+            Any: A mutable state
+        """
+
+    @abstractmethod
+    def add(self, state, rating: float) -> None:
+        """Adds a rating to the state of a book
+
+        Args:
+            state (Any): The state of the book
+            rating (float): The rating
+        """
+
+    @abstractmethod
+    def remove(self, state, rating: float) -> None:
+        """Removes a rating that was added to the state of a book
+
+        Args:
+            state (Any): The state of the book
+            rating (float): The rating
+        """
+
+    @abstractmethod
+    def result(self, state):
+        """Computes the value of the metric
+
+        Args:
+            state (Any): The state of the book
+
+        Returns:
+            Any: The value stored in the database column
+        """
+
+
+class RatingHistogram(Aggregator):
+    """Number of ratings at every step of the rating scale"""
+
+    name = "histogram"
+
+    def create(self):
+        return array("q", bytes(8 * RATING_BINS))
+
+    def add(self, state, rating: float) -> None:
+        state[rating_bin(rating)] += 1
+
+    def remove(self, state, rating: float) -> None:
+        state[rating_bin(rating)] -= 1
+
+    def result(self, state) -> str:
+        """Formats the steps that have ratings, like "3.5: 2, 5: 7" """
+        return ", ".join(
+            f"{bin_rating(index):g}: {count}"
+            for index, count in enumerate(state)
+            if count
+        )
+
+
+class RatingMedian(RatingHistogram):
+    """Median rating, read off the fixed histogram so it is exact for ratings on the scale"""
+
+    name = "median"
+
+    def result(self, state):
+        count = sum(state)
+        if count == 0:
+            return None
+
+        # The median is the mean of the two middle ratings, which are the same rating when the count is odd
+        lower_rank = (count - 1) // 2
+        upper_rank = count // 2
+        lower = None
+        seen = 0
+        for index, bin_count in enumerate(state):
+            seen += bin_count
+            if lower is None and seen > lower_rank:
+                lower = bin_rating(index)
+            if seen > upper_rank:
+                return (lower + bin_rating(index)) / 2
+
+
+class RatingStandardDeviation(Aggregator):
+    """Population standard deviation of the ratings, from exact count, sum and sum of squares accumulators. Half star
+    ratings and their squares are exact binary fractions, so the sums have no rounding error.
+    """
+
+    name = "standard deviation"
+
+    def create(self):
+        return array("d", [0, 0, 0])
+
+    def add(self, state, rating: float) -> None:
+        state[0] += 1
+        state[1] += rating
+        state[2] += rating * rating
+
+    def remove(self, state, rating: float) -> None:
+        state[0] -= 1
+        state[1] -= rating
+        state[2] -= rating * rating
+
+    def result(self, state):
+        count, rating_sum, square_sum = state
+        if count == 0:
+            return None
+
+        mean = rating_sum / count
+        # Rounding can push the variance of identical ratings slightly below zero
+        return math.sqrt(max(square_sum / count - mean * mean, 0))
@@ -0,0 +1,206 @@
+import asyncio
+import os
+
+from dotenv import load_dotenv
+from notion_client import AsyncClient
+
+from notion_types import (
+    DatabaseColumn,
+    NotionResponseObject,
+    RowEncoder,
+)
+from rate_limiting import RequestExecutor, TokenBucket
+
+# Most requests we allow to wait on Notion at the same time, the rate limiter decides how fast they are sent
+DEFAULT_MAX_IN_FLIGHT = 8
+
+
+class AsyncDatabaseClient:
+    """An asynchronous database client that sends many row requests concurrently while staying under Notion's rate limit"""
+
+    def __init__(
+        self,
+        database_id: str,
+        columns: "list[DatabaseColumn]",
+        max_in_flight: int = DEFAULT_MAX_IN_FLIGHT,
+        rate_limiter=None,
+        client=None,
+        executor=None,
+    ) -> None:
+        """Initializes an asynchronous database client. Unlike DatabaseClient, it does not modify the database schema.
+
+        Args:
+            database_id (str): Id of database to interact with
+            columns (list[DatabaseColumn]): List of columns in the database
+            max_in_flight (int, optional): Most requests waiting on a response at once. Defaults to DEFAULT_MAX_IN_FLIGHT.
+            rate_limiter (TokenBucket, optional): Limiter to share with other clients using the same integration. Defaults to a new TokenBucket at Notion's rate limit.
+            client (AsyncClient, optional): Notion client to send requests with. Defaults to a new AsyncClient using NOTION_TOKEN.
+            executor (RequestExecutor, optional): Sends every request with retries, backoff and adaptive concurrency. Defaults to a new RequestExecutor built from max_in_flight and rate_limiter.
+        """
+        if client is None:
+            load_dotenv()
+            client = AsyncClient(auth=os.environ["NOTION_TOKEN"])
+
+        self.client = client
+        self.database_id = database_id
+        self.columns = columns
+        self.row_encoder = RowEncoder(columns)
+        self.executor = executor or RequestExecutor(
+            max_concurrency=max_in_flight, rate_limiter=rate_limiter or TokenBucket()
+        )
+
+    async def aclose(self) -> None:
+        """Closes the connection pool of the underlying notion client"""
+        await self.client.aclose()
+
+    async def __request(self, endpoint, *args, error_message: str, **kwargs):
+        """Sends a request through the executor, which waits for a concurrency slot and a rate limit token and retries failures
+
+        Args:
+            endpoint (Callable): The notion client method to call
+            error_message (str): Message of the exception raised when Notion returns an error
+
+        Raises:
+            Exception: Notion returned an error object
+
+        Returns:
+            Object: The response from Notion
+        """
+        response = await self.executor.call_async(endpoint, *args, **kwargs)
+
+        if response["object"] == NotionResponseObject.ERROR:
+            raise Exception(f"{error_message} for database: {self.database_id}")
+
+        return response
+
+    async def notion_get_all_column_keys(self) -> "set[str]":
+        """Gets all column keys that have been added into the notion database.
+
+        Raises:
+            Exception: Failure to retrieve column keys for a specified database based on the database id
+
+        Returns:
+            set[str]: Set of strings indicating all column database keys
+        """
+        response = await self.__request(
+            self.client.databases.retrieve,
+            self.database_id,
+            idempotent=True,
+            error_message="Failed to retrieve column keys",
+        )
+        return set(response["properties"])
+
+    async def notion_add_row(self, data: type(dict)) -> None:
+        """Creates a database row based on an object
+
+        Args:
+            data (type): Object with all the row information (key = column, value = column value for that row)
+
+        Raises:
+            Exception: Failure to create a database row
+        """
+        await self.__request(
+            self.client.pages.create,
+            properties=self.row_encoder.encode(data),
+            parent={"type": "database_id", "database_id": self.database_id},
+            error_message="Failed to create database row",
+        )
+
+    async def notion_update_row(self, page_id: str, data: type(dict)) -> None:
+        """Updates the properties of an existing database row
+
+        Args:
+            page_id (str): Id of the page representing the row
+            data (type): Object with all the row information (key = column, value = column value for that row)
+
+        Raises:
+            Exception: Failure to update a database row
+        """
+        await self.__request(
+            self.client.pages.update,
+            page_id,
+            properties=self.row_encoder.encode(data),
+            idempotent=True,
+            error_message="Failed to update database row",
+        )
+
+    async def notion_archive_row(self, page_id: str) -> None:
+        """Archives a database row
+
+        Args:
+            page_id (str): Id of the page representing the row
+
+        Raises:
+            Exception: Failure to archive a database row
+        """
+        await self.__request(
+            self.client.pages.update,
+            page_id,
+            archived=True,
+            idempotent=True,
+            error_message="Failed to archive page",
+        )
+
+    async def notion_add_rows(self, rows: "list[dict]") -> None:
+        """Creates many database rows concurrently
+
+        Args:
+            rows (list[dict]): Objects with all the row information (key = column, value = column value for that row)
+
+        Raises:
+            Exception: Failure to create a database row
+        """
+        await asyncio.gather(*[self.notion_add_row(row) for row in rows])
+
+    async def notion_archive_rows(self, page_ids: "list[str]") -> None:
+        """Archives many database rows concurrently
+
+        Args:
+            page_ids (list[str]): Ids of the pages representing the rows
+
+        Raises:
+            Exception: Failure to archive a database row
+        """
+        await asyncio.gather(
+            *[self.notion_archive_row(page_id) for page_id in page_ids]
+        )
+
+    async def notion_get_rows(self):
+        """Gets all rows in the notion database
+
+        Raises:
+            Exception: Failure to get all rows in the database
+
+        Returns:
+            Page[]: Array of notion page objects with each object representing a row in the database
+        """
+        cursor = None
+        page_size = 100
+        all_pages = []
+        while True:
+            pages = await self.__request(
+                self.client.databases.query,
+                self.database_id,
+                start_cursor=cursor,
+                page_size=page_size,
+                idempotent=True,
+                error_message="Failed to get rows",
+            )
+
+            all_pages.extend(pages["results"])
+
+            if "has_more" not in pages or not pages["has_more"]:
+                break
+
+            cursor = pages["next_cursor"]
+
+        return all_pages
+
+    async def notion_clear_database(self) -> None:
+        """Clears all rows in the notion database
+
+        Raises:
+            Exception: Failure to clear the database
+        """
+        all_pages = await self.notion_get_rows()
+        await self.notion_archive_rows([page["id"] for page in all_pages])
@@ -0,0 +1,47 @@
+import argparse
+import os
+import tempfile
+import time
+
+from benchmarks.synthetic import write_synthetic_ratings
+from csv_processor import AggregationBackend, CSVProcessor
+
+
+def time_backend(csv_path: str, backend: AggregationBackend, repeat: int) -> float:
+    """Runs a backend several times and returns the fastest run in seconds"""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        CSVProcessor(csv_path, backend=backend)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compares rows/sec of the pure Python and NumPy aggregation backends"
+    )
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--books", type=int, default=1000)
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        csv_path = os.path.join(directory, "ratings.csv")
+        write_synthetic_ratings(csv_path, args.rows, args.books, args.users)
+
+        python_processor = CSVProcessor(csv_path)
+        numpy_processor = CSVProcessor(csv_path, backend=AggregationBackend.NUMPY)
+        assert python_processor.name_to_count == numpy_processor.name_to_count
+        assert python_processor.name_to_favorites == numpy_processor.name_to_favorites
+        assert (
+            python_processor.name_to_average_rating
+            == numpy_processor.name_to_average_rating
+        )
+
+        for backend in AggregationBackend:
+            seconds = time_backend(csv_path, backend, args.repeat)
+            print(
+                f"{backend.value:>8}: {seconds:.3f}s, {args.rows / seconds:,.0f} rows/sec"
+            )
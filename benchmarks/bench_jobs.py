@@ -0,0 +1,82 @@
+import argparse
+import os
+import tempfile
+import time
+
+from benchmarks.synthetic import write_synthetic_ratings
+from config import DATABASE_COLUMNS
+from fake_notion import FakeNotion
+from job_runner import SyncJob, run_jobs
+from main import sync
+from notion_types import DatabaseClient
+from rate_limiting import RequestExecutor, TokenBucket
+
+
+def make_jobs(fake_notion: FakeNotion, csv_paths: "list[str]") -> "list[SyncJob]":
+    """Creates a job with a fresh fake database for every CSV file"""
+    return [
+        SyncJob(
+            f"job {index}",
+            csv_path,
+            fake_notion.create_database(title_name=DATABASE_COLUMNS[0].column_name),
+        )
+        for index, csv_path in enumerate(csv_paths)
+    ]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compares syncing many CSV files one after another with the job runner, against FakeNotion"
+    )
+    parser.add_argument("--jobs", type=int, default=10)
+    parser.add_argument("--rows", type=int, default=200_000)
+    parser.add_argument("--books", type=int, default=200)
+    parser.add_argument(
+        "--latency", type=float, default=0.02, help="Seconds per request"
+    )
+    parser.add_argument("--rate-limit", type=float, default=100)
+    parser.add_argument("--global-limit", type=int, default=8)
+    parser.add_argument("--database-limit", type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        csv_paths = []
+        for index in range(args.jobs):
+            csv_path = os.path.join(directory, f"ratings_{index}.csv")
+            write_synthetic_ratings(csv_path, args.rows, args.books, seed=index)
+            csv_paths.append(csv_path)
+
+        fake_notion = FakeNotion(latency=args.latency)
+        rate_limiter = TokenBucket(args.rate_limit)
+        start = time.perf_counter()
+        for job in make_jobs(fake_notion, csv_paths):
+            database_client = DatabaseClient(
+                job.database_id,
+                job.columns(),
+                executor=RequestExecutor(rate_limiter=rate_limiter),
+                client=fake_notion.client(),
+            )
+            sync(database_client, job.csv_path, job.columns())
+        sequential = time.perf_counter() - start
+        rows = args.jobs * args.books
+        print(
+            f"one after another: {sequential:8.2f}s, {rows / sequential:10,.1f} rows/sec, "
+            f"{fake_notion.max_in_flight} requests in flight at most"
+        )
+
+        fake_notion = FakeNotion(latency=args.latency)
+        start = time.perf_counter()
+        summaries = run_jobs(
+            make_jobs(fake_notion, csv_paths),
+            client=fake_notion.client(),
+            global_limit=args.global_limit,
+            database_limit=args.database_limit,
+            rate_limiter=TokenBucket(args.rate_limit),
+        )
+        seconds = time.perf_counter() - start
+        for summary in summaries:
+            print(f"  {summary.describe()}")
+        print(
+            f"       job runner: {seconds:8.2f}s, {rows / seconds:10,.1f} rows/sec, "
+            f"{fake_notion.max_in_flight} requests in flight at most, speedup {sequential / seconds:.2f}x"
+        )
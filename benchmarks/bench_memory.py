@@ -0,0 +1,90 @@
+import argparse
+import os
+import tempfile
+import tracemalloc
+from collections import defaultdict
+
+from benchmarks.synthetic import write_synthetic_ratings
+from csv_processor import BookUsers, SeenPairs, read_lines_reversed
+from notion_types import Sanitizers
+
+
+def read_pairs(csv_path: str):
+    """Yields the sanitized (book, user) pair of every row, newest first"""
+    for row in read_lines_reversed(csv_path):
+        if not row:
+            continue
+
+        book_name, user, _ = row.split(",")
+        book_name = Sanitizers.clear_white_space(
+            Sanitizers.clear_capitalization(book_name)
+        )
+        user = Sanitizers.clear_white_space(Sanitizers.clear_capitalization(user))
+        yield book_name, user
+
+
+def measure(csv_path: str, build) -> "tuple[int, int]":
+    """Builds a dedup index from the file and returns (bytes still allocated, number of pairs)"""
+    tracemalloc.start()
+    index, pairs = build(csv_path)
+    allocated, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del index
+    return allocated, pairs
+
+
+def build_nested_defaultdict(csv_path: str):
+    """The dedup index CSVProcessor used before SeenPairs"""
+    name_to_book_to_has_read = defaultdict(lambda: defaultdict(bool))
+    pairs = 0
+    for book_name, user in read_pairs(csv_path):
+        if name_to_book_to_has_read[book_name][user]:
+            continue
+        name_to_book_to_has_read[book_name][user] = True
+        pairs += 1
+    return name_to_book_to_has_read, pairs
+
+
+def build_book_users(csv_path: str):
+    book_users = BookUsers()
+    for book_name, user in read_pairs(csv_path):
+        book_users.add(book_name, user)
+    return book_users, len(book_users)
+
+
+def build_seen_pairs(csv_path: str):
+    seen_pairs = SeenPairs()
+    for book_name, user in read_pairs(csv_path):
+        seen_pairs.add(book_name, user)
+    return seen_pairs, len(seen_pairs)
+
+
+def report(label: str, csv_path: str) -> None:
+    """Prints the bytes per (book, user) pair of every dedup index"""
+    print(f"{label}:")
+    for name, build in [
+        ("nested defaultdict", build_nested_defaultdict),
+        ("BookUsers", build_book_users),
+        ("SeenPairs", build_seen_pairs),
+    ]:
+        allocated, pairs = measure(csv_path, build)
+        print(
+            f"  {name + ':':<19} {allocated:>14,} bytes, {allocated / pairs:6.1f} bytes/pair, {pairs:,} pairs"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Reports the memory used per (book, user) pair by the dedup index"
+    )
+    parser.add_argument("--rows", type=int, default=10_000_000)
+    parser.add_argument("--books", type=int, default=10000)
+    parser.add_argument("--users", type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    report("data/ratings.csv", "data/ratings.csv")
+
+    with tempfile.TemporaryDirectory() as directory:
+        csv_path = os.path.join(directory, "ratings.csv")
+        write_synthetic_ratings(csv_path, args.rows, args.books, args.users)
+        report(f"synthetic {args.rows:,} rows", csv_path)
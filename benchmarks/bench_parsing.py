@@ -0,0 +1,77 @@
+import argparse
+import os
+import tempfile
+import time
+
+from benchmarks.synthetic import write_synthetic_ratings
+from csv_processor import (
+    CSVProcessor,
+    iter_line_chunks_reversed,
+    parse_rating_chunk,
+    read_lines_reversed,
+)
+
+
+def parse_split(csv_path: str) -> int:
+    """Parses every row the way CSVProcessor did before parse_rating_chunk, splitting every line on commas"""
+    rows = 0
+    for row in read_lines_reversed(csv_path):
+        if not row:
+            continue
+
+        book_name, user, rating = row.split(",")
+        rating = float(rating)
+        rows += 1
+    return rows
+
+
+def parse_chunks(csv_path: str) -> int:
+    """Parses every row with parse_rating_chunk, newest first like the Python backend"""
+    rows = 0
+    for _, chunk in iter_line_chunks_reversed(csv_path):
+        (book_names, users, ratings), _ = parse_rating_chunk(chunk)
+        for book_name, user, rating in zip(
+            reversed(book_names), reversed(users), reversed(ratings)
+        ):
+            rows += 1
+    return rows
+
+
+def measure(cases: "dict[str, object]", rows: int, repeat: int) -> None:
+    """Runs every case once per round, so a noisy machine slows all of them alike, and prints the fastest run of each"""
+    best = {label: float("inf") for label in cases}
+    for _ in range(repeat):
+        for label, parse in cases.items():
+            start = time.perf_counter()
+            parse()
+            best[label] = min(best[label], time.perf_counter() - start)
+
+    for label, seconds in best.items():
+        print(f"{label:>36}: {seconds:6.3f}s, {rows / seconds:12,.0f} rows/sec")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compares the csv module parser with quarantine against splitting lines on commas, on clean data"
+    )
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--books", type=int, default=1000)
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        csv_path = os.path.join(directory, "ratings.csv")
+        write_synthetic_ratings(csv_path, args.rows, args.books, args.users)
+
+        assert parse_split(csv_path) == parse_chunks(csv_path) == args.rows
+
+        measure(
+            {
+                "split (before)": lambda: parse_split(csv_path),
+                "parse_rating_chunk": lambda: parse_chunks(csv_path),
+                "python backend": lambda: CSVProcessor(csv_path),
+            },
+            args.rows,
+            args.repeat,
+        )
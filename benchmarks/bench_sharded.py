@@ -0,0 +1,40 @@
+import argparse
+import os
+import tempfile
+import time
+
+from benchmarks.synthetic import write_synthetic_ratings
+from csv_processor import AggregationBackend, CSVProcessor
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Measures the speedup of the sharded backend over a single process"
+    )
+    parser.add_argument("--rows", type=int, default=4_000_000)
+    parser.add_argument("--books", type=int, default=1000)
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    args = parser.parse_args()
+
+    print(f"CPUs available: {os.cpu_count()}")
+    with tempfile.TemporaryDirectory() as directory:
+        csv_path = os.path.join(directory, "ratings.csv")
+        write_synthetic_ratings(csv_path, args.rows, args.books, args.users)
+
+        start = time.perf_counter()
+        expected = CSVProcessor(csv_path)
+        baseline = time.perf_counter() - start
+        print(f"  python: {baseline:.3f}s, {args.rows / baseline:,.0f} rows/sec")
+
+        for workers in args.workers:
+            start = time.perf_counter()
+            processor = CSVProcessor(
+                csv_path, backend=AggregationBackend.SHARDED, workers=workers
+            )
+            seconds = time.perf_counter() - start
+            assert processor.name_to_average_rating == expected.name_to_average_rating
+            assert processor.name_to_favorites == expected.name_to_favorites
+            print(
+                f"{workers:>2} workers: {seconds:.3f}s, {args.rows / seconds:,.0f} rows/sec, "
+                f"speedup {baseline / seconds:.2f}x"
+            )
@@ -0,0 +1,54 @@
+import argparse
+import os
+import tempfile
+import time
+
+from benchmarks.synthetic import write_synthetic_ratings
+from csv_processor import CSVProcessor
+from rating_snapshot import RatingSnapshot
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compares the time to the first lookup of processing the CSV file with loading a snapshot"
+    )
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--books", type=int, default=100_000)
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        csv_path = os.path.join(directory, "ratings.csv")
+        snapshot_path = os.path.join(directory, "ratings.snapshot")
+        write_synthetic_ratings(csv_path, args.rows, args.books, args.users)
+
+        start = time.perf_counter()
+        csv_processor = CSVProcessor(csv_path)
+        csv_processor.get_average_rating_by_book_name("Book 1")
+        processing = time.perf_counter() - start
+        csv_processor.write_snapshot(snapshot_path)
+        print(
+            f"{len(csv_processor.book_stats):,} books, snapshot of {os.path.getsize(snapshot_path):,} bytes"
+        )
+        print(f"      CSVProcessor: {processing * 1000:10.3f}ms to the first lookup")
+
+        loading = float("inf")
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            snapshot = RatingSnapshot.load(snapshot_path, csv_path)
+            average_rating = snapshot.get_average_rating_by_book_name("Book 1")
+            loading = min(loading, time.perf_counter() - start)
+            snapshot.close()
+            assert average_rating == csv_processor.get_average_rating_by_book_name(
+                "Book 1"
+            )
+        print(f"    RatingSnapshot: {loading * 1000:10.3f}ms to the first lookup")
+
+        snapshot = RatingSnapshot.load(snapshot_path, csv_path)
+        book_names = list(csv_processor.book_stats)
+        start = time.perf_counter()
+        for book_name in book_names:
+            snapshot.get_average_rating_by_book_name(book_name)
+        lookup = (time.perf_counter() - start) / len(book_names)
+        snapshot.close()
+        print(f"    RatingSnapshot: {lookup * 1e6:10.3f}us per lookup")
@@ -0,0 +1,54 @@
+import argparse
+import os
+import resource
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from benchmarks.synthetic import write_synthetic_ratings
+from csv_processor import AggregationBackend, CSVProcessor
+
+
+def run(csv_path: str, backend: AggregationBackend, memory_budget: int):
+    """Processes the file in a fresh process and returns (seconds, MiB of peak RSS over the baseline, books)"""
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    csv_processor = CSVProcessor(csv_path, backend=backend, memory_budget=memory_budget)
+    seconds = time.perf_counter() - start
+    # ru_maxrss is in KiB on Linux
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - baseline
+    return seconds, peak / 1024, len(csv_processor.book_stats)
+
+
+def measure(csv_path: str, backend: AggregationBackend, memory_budget: int):
+    """Runs a backend in a new process, so the peak RSS of one run does not hide the next one's"""
+    with ProcessPoolExecutor(max_workers=1) as executor:
+        return executor.submit(run, csv_path, backend, memory_budget).result()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compares the peak memory and time of the external backend under several budgets with the Python backend"
+    )
+    parser.add_argument("--rows", type=int, default=3_000_000)
+    parser.add_argument("--books", type=int, default=10000)
+    parser.add_argument("--users", type=int, default=3_000_000)
+    parser.add_argument(
+        "--budgets", type=int, nargs="+", default=[256, 64, 16], help="In MiB"
+    )
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        csv_path = os.path.join(directory, "ratings.csv")
+        write_synthetic_ratings(csv_path, args.rows, args.books, args.users)
+
+        seconds, peak, books = measure(csv_path, AggregationBackend.PYTHON, 0)
+        print(f"{'python':>16}: {seconds:7.3f}s, peak RSS +{peak:7.1f} MiB")
+        for budget in args.budgets:
+            seconds, peak, external_books = measure(
+                csv_path, AggregationBackend.EXTERNAL, budget << 20
+            )
+            assert external_books == books
+            print(
+                f"{f'external {budget} MiB':>16}: {seconds:7.3f}s, peak RSS +{peak:7.1f} MiB"
+            )
@@ -0,0 +1,103 @@
+import argparse
+import os
+import statistics
+import tempfile
+import time
+
+from benchmarks.synthetic import write_synthetic_ratings
+from config import DATABASE_COLUMNS
+from fake_notion import FakeNotion
+from main import sync
+from notion_types import DatabaseClient
+from pipeline import pipelined_sync
+from rate_limiting import RequestExecutor, TokenBucket
+
+
+def percentile(values: "list[float]", fraction: float) -> float:
+    """Gets a percentile of the values, by nearest rank"""
+    if not values:
+        return 0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def run(label: str, csv_path: str, args, reconcile: bool) -> None:
+    """Runs the main.py flow against a fresh fake database (twice for reconcile) and prints its throughput"""
+    fake_notion = FakeNotion(
+        latency=args.latency,
+        requests_per_second=args.server_rate_limit,
+        error_rate=args.error_rate,
+    )
+    database_id = fake_notion.create_database(
+        title_name=DATABASE_COLUMNS[0].column_name
+    )
+    rate_limiter = (
+        TokenBucket(args.client_rate_limit) if args.client_rate_limit else None
+    )
+    request_executor = RequestExecutor(rate_limiter=rate_limiter)
+    database_client = DatabaseClient(
+        database_id,
+        DATABASE_COLUMNS,
+        executor=request_executor,
+        client=fake_notion.client(),
+    )
+
+    if reconcile:
+        # Start from a populated database so the reconcile run measures a sync where nothing changed
+        sync(database_client, csv_path, DATABASE_COLUMNS)
+    fake_notion.request_log.clear()
+    retries = request_executor.retries
+
+    start = time.perf_counter()
+    if args.upload_workers:
+        counts = pipelined_sync(
+            database_client,
+            csv_path,
+            DATABASE_COLUMNS,
+            reconcile=reconcile,
+            upload_workers=args.upload_workers,
+        )
+    else:
+        counts = sync(database_client, csv_path, DATABASE_COLUMNS, reconcile=reconcile)
+    seconds = time.perf_counter() - start
+
+    latencies = [seconds for _, seconds, _ in fake_notion.request_log]
+    rows = sum(counts.values()) - counts["archived"]
+    print(
+        f"{label:>18} {'reconcile' if reconcile else 'clear':>9}: "
+        f"{rows:>7,} rows in {seconds:8.2f}s, {rows / seconds:10,.0f} rows/sec, "
+        f"{fake_notion.requests():>7,} requests, {request_executor.retries - retries:>5,} retries, "
+        f"p50 {percentile(latencies, 0.5) * 1000:7.2f}ms, p99 {percentile(latencies, 0.99) * 1000:7.2f}ms"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmarks the main.py sync flow against an in-process fake of the Notion API"
+    )
+    parser.add_argument("--books", type=int, nargs="+", default=[10_000, 100_000])
+    parser.add_argument("--ratings-per-book", type=int, default=5)
+    parser.add_argument("--latency", type=float, default=0, help="Seconds per request")
+    parser.add_argument("--server-rate-limit", type=float, default=None)
+    parser.add_argument("--client-rate-limit", type=float, default=None)
+    parser.add_argument("--error-rate", type=float, default=0)
+    parser.add_argument(
+        "--upload-workers",
+        type=int,
+        default=0,
+        help="Measure the pipelined sync with this many upload threads instead of the sequential sync",
+    )
+    args = parser.parse_args()
+
+    datasets = [("data/ratings.csv", "data/ratings.csv")]
+    with tempfile.TemporaryDirectory() as directory:
+        for books in args.books:
+            csv_path = os.path.join(directory, f"{books}.csv")
+            write_synthetic_ratings(
+                csv_path, books * args.ratings_per_book, books, books * 10
+            )
+            datasets.append((f"{books:,} books", csv_path))
+
+        for label, csv_path in datasets:
+            for reconcile in [False, True]:
+                run(label, csv_path, args, reconcile)
@@ -0,0 +1,29 @@
+import random
+
+
+def write_synthetic_ratings(
+    csv_path: str, rows: int, books: int = 1000, users: int = 10000, seed: int = 0
+) -> None:
+    """Writes a ratings CSV in the same format as data/ratings.csv with random books, users and ratings
+
+    Args:
+        csv_path (str): The path to write the CSV file to
+        rows (int): Number of rating rows to write
+        books (int, optional): Number of distinct books. Defaults to 1000.
+        users (int, optional): Number of distinct users. Defaults to 10000.
+        seed (int, optional): Seed for the random generator so runs are repeatable. Defaults to 0.
+    """
+    generator = random.Random(seed)
+    ratings = [str(value / 2) for value in range(11)]
+    with open(csv_path, "w") as file:
+        lines = []
+        for _ in range(rows):
+            book = generator.randrange(books)
+            user = generator.randrange(users)
+            # Mix casing and padding so sanitation is exercised like the real data
+            book_name = f"Book {book}" if book % 2 else f" book {book} "
+            lines.append(f"{book_name},User {user},{generator.choice(ratings)}\n")
+            if len(lines) == 10000:
+                file.writelines(lines)
+                lines = []
+        file.writelines(lines)
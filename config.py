@@ -1,3 +1,4 @@
+from aggregators import RatingHistogram, RatingMedian, RatingStandardDeviation
 from notion_types import DatabaseColumn, NotionType, Sanitizers
 from csv_processor import CSVProcessor
 
@@ -20,3 +21,33 @@ DATABASE_COLUMNS = [
         csv_processor_function=CSVProcessor.get_favorites_by_book_name,
     ),
 ]
+
+# Extra per-book statistics, only computed when these columns are synced (python3 main.py --statistics)
+STATISTICS_COLUMNS = [
+    DatabaseColumn(
+        "Median Rating",
+        NotionType.NUMBER,
+        aggregator=RatingMedian(),
+    ),
+    DatabaseColumn(
+        "Rating Standard Deviation",
+        NotionType.NUMBER,
+        aggregator=RatingStandardDeviation(),
+    ),
+    DatabaseColumn(
+        "Rating Histogram",
+        NotionType.TEXT,
+        aggregator=RatingHistogram(),
+    ),
+    DatabaseColumn(
+        "Readers",
+        NotionType.NUMBER,
+        csv_processor_function=CSVProcessor.get_readers_by_book_name,
+    ),
+]
+
+# Column sets a job of a job runner manifest can name, see job_runner.py
+COLUMN_SETS = {
+    "database": DATABASE_COLUMNS,
+    "statistics": STATISTICS_COLUMNS,
+}
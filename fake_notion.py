@@ -0,0 +1,504 @@
+import asyncio
+import datetime
+import json
+import random
+import threading
+import time
+import uuid
+from collections import defaultdict
+
+import httpx
+from notion_client.errors import APIErrorCode, APIResponseError
+
+from rate_limiting import TokenBucket
+
+# Property types whose values are arrays of rich text objects
+RICH_TEXT_TYPES = {"title", "rich_text"}
+PROPERTY_TYPES = {
+    "title",
+    "rich_text",
+    "number",
+    "select",
+    "multi_select",
+    "checkbox",
+    "date",
+    "url",
+}
+
+
+class FakeNotion:
+    """An in-memory stand-in for the parts of the Notion API that DatabaseClient uses. It keeps databases and pages,
+    can add latency to every request, enforces a rate limit with 429 responses and can inject errors. Clients are made
+    with `client()` and `async_client()` and share the state of the fake.
+    """
+
+    def __init__(
+        self,
+        latency: float = 0,
+        requests_per_second=None,
+        error_rate: float = 0,
+        seed: int = 0,
+    ) -> None:
+        """Creates an empty fake Notion workspace
+
+        Args:
+            latency (float, optional): Seconds every request takes. Defaults to 0.
+            requests_per_second (float, optional): Rate limit enforced with 429 responses. Defaults to no limit.
+            error_rate (float, optional): Probability of a request failing with a 503 before it is applied. Defaults to 0.
+            seed (int, optional): Seed for the error injection so runs are repeatable. Defaults to 0.
+        """
+        self.latency = latency
+        self.rate_limiter = (
+            TokenBucket(requests_per_second) if requests_per_second else None
+        )
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.databases = {}
+        self.pages = {}
+        # Ids of the pages of every database in creation order, and the position of every page in that order
+        self.database_page_ids = defaultdict(list)
+        self.page_positions = {}
+        # Every request handled as (endpoint, seconds taken, status)
+        self.request_log = []
+        self.injected_errors = []
+        # Requests being handled right now, and the most handled at the same time
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.__lock = threading.RLock()
+
+    def create_database(self, database_id=None, title_name: str = "Name") -> str:
+        """Creates a database that only has a title property, like a new database in Notion
+
+        Args:
+            database_id (str, optional): Id of the database. Defaults to a random id.
+            title_name (str, optional): Name of the title property. Defaults to "Name".
+
+        Returns:
+            str: Id of the database
+        """
+        database_id = database_id or str(uuid.uuid4())
+        self.databases[database_id] = {
+            title_name: {
+                "id": "title",
+                "name": title_name,
+                "type": "title",
+                "title": {},
+            }
+        }
+        return database_id
+
+    def fail_next(self, status: int, code: APIErrorCode, count: int = 1, headers=None):
+        """Makes the next requests fail with an error
+
+        Args:
+            status (int): HTTP status of the error
+            code (APIErrorCode): Notion error code of the error
+            count (int, optional): Number of requests to fail. Defaults to 1.
+            headers (dict, optional): Headers of the error response. Defaults to None.
+        """
+        with self.__lock:
+            self.injected_errors.extend([(status, code, headers)] * count)
+
+    def client(self) -> "FakeNotionClient":
+        """Creates a synchronous client with the same interface as notion_client.Client"""
+        return FakeNotionClient(self)
+
+    def async_client(self) -> "FakeAsyncNotionClient":
+        """Creates an asynchronous client with the same interface as notion_client.AsyncClient"""
+        return FakeAsyncNotionClient(self)
+
+    def requests(self, endpoint=None) -> int:
+        """Counts the requests handled
+
+        Args:
+            endpoint (str, optional): Only count requests to this endpoint, like "pages.create". Defaults to all endpoints.
+
+        Returns:
+            int: Number of requests
+        """
+        return sum(1 for logged, _, _ in self.request_log if endpoint in [None, logged])
+
+    @staticmethod
+    def error(status: int, code: APIErrorCode, message: str, headers=None):
+        """Builds the exception the notion client raises for an error response"""
+        response = httpx.Response(
+            status,
+            headers=headers,
+            content=json.dumps({"object": "error", "code": code, "message": message}),
+        )
+        return APIResponseError(response, message, code)
+
+    def admit(self) -> None:
+        """Decides whether a request is rate limited or fails, before it is handled
+
+        Raises:
+            APIResponseError: The request is rate limited or an error was injected
+        """
+        with self.__lock:
+            if self.injected_errors:
+                status, code, headers = self.injected_errors.pop(0)
+                raise self.error(status, code, "Injected error", headers)
+
+            if self.rate_limiter is not None:
+                retry_after = self.rate_limiter.try_acquire()
+                if retry_after:
+                    raise self.error(
+                        429,
+                        APIErrorCode.RateLimited,
+                        "Rate limited",
+                        {"Retry-After": f"{retry_after:.3f}"},
+                    )
+
+            if self.error_rate and self.random.random() < self.error_rate:
+                raise self.error(
+                    503, APIErrorCode.ServiceUnavailable, "Injected unavailability"
+                )
+
+    def handle(self, endpoint: str, *args, **kwargs):
+        """Handles a request to an endpoint once its latency has passed
+
+        Args:
+            endpoint (str): Name of the endpoint, like "pages.create"
+
+        Raises:
+            APIResponseError: The request is rate limited, an error was injected or the request is invalid
+
+        Returns:
+            Object: The response body
+        """
+        handlers = {
+            "databases.retrieve": self.__databases_retrieve,
+            "databases.update": self.__databases_update,
+            "databases.query": self.__databases_query,
+            "pages.create": self.__pages_create,
+            "pages.update": self.__pages_update,
+        }
+        with self.__lock:
+            return handlers[endpoint](*args, **kwargs)
+
+    def enter(self) -> None:
+        """Counts a request that started being handled"""
+        with self.__lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+
+    def leave(self) -> None:
+        """Counts a request that was answered"""
+        with self.__lock:
+            self.in_flight -= 1
+
+    def log(self, endpoint: str, seconds: float, status: int) -> None:
+        with self.__lock:
+            self.request_log.append((endpoint, seconds, status))
+
+    def __database(self, database_id: str) -> dict:
+        if database_id not in self.databases:
+            raise self.error(
+                404,
+                APIErrorCode.ObjectNotFound,
+                f"Could not find database with ID: {database_id}",
+            )
+        return self.databases[database_id]
+
+    def __page(self, page_id: str) -> dict:
+        if page_id not in self.pages:
+            raise self.error(
+                404,
+                APIErrorCode.ObjectNotFound,
+                f"Could not find page with ID: {page_id}",
+            )
+        return self.pages[page_id]
+
+    @staticmethod
+    def __now() -> str:
+        return datetime.datetime.now(datetime.timezone.utc).isoformat(
+            timespec="milliseconds"
+        )
+
+    def __databases_retrieve(self, database_id: str, **kwargs):
+        return {
+            "object": "database",
+            "id": database_id,
+            "properties": json.loads(json.dumps(self.__database(database_id))),
+        }
+
+    def __databases_update(self, database_id: str, properties=None, **kwargs):
+        schema = self.__database(database_id)
+        for key, value in (properties or {}).items():
+            if value is None:
+                if schema.get(key, {}).get("type") == "title":
+                    raise self.error(
+                        400,
+                        APIErrorCode.ValidationError,
+                        "Cannot delete the title property",
+                    )
+                schema.pop(key, None)
+                continue
+
+            if key == "title" and "title" not in schema:
+                # Renames the title property
+                title_key = next(
+                    name for name, value in schema.items() if value["type"] == "title"
+                )
+                title_property = schema.pop(title_key)
+                title_property["name"] = value["name"]
+                schema[value["name"]] = title_property
+                continue
+
+            property_type = next(
+                (name for name in value if name in PROPERTY_TYPES), None
+            )
+            if property_type is None:
+                raise self.error(
+                    400, APIErrorCode.ValidationError, f"Invalid property: {key}"
+                )
+
+            name = value.get("name", key)
+            schema.pop(key, None)
+            schema[name] = {
+                "id": value.get("id", name.lower()),
+                "name": name,
+                "type": property_type,
+                property_type: value[property_type],
+            }
+
+        return self.__databases_retrieve(database_id)
+
+    def __matches(self, page: dict, filter) -> bool:
+        """Evaluates the subset of Notion query filters we use"""
+        if filter is None:
+            return True
+        if "and" in filter:
+            return all(self.__matches(page, inner) for inner in filter["and"])
+        if "or" in filter:
+            return any(self.__matches(page, inner) for inner in filter["or"])
+
+        if filter.get("timestamp") in ["last_edited_time", "created_time"]:
+            condition = filter[filter["timestamp"]]
+            value = page[filter["timestamp"]]
+            if "on_or_after" in condition:
+                return value >= condition["on_or_after"]
+            if "after" in condition:
+                return value > condition["after"]
+            if "before" in condition:
+                return value < condition["before"]
+            raise self.error(400, APIErrorCode.ValidationError, "Invalid filter")
+
+        property_value = page["properties"].get(filter["property"])
+        if property_value is None:
+            return False
+
+        property_type = property_value["type"]
+        condition = filter.get(property_type)
+        if condition is None:
+            raise self.error(400, APIErrorCode.ValidationError, "Invalid filter")
+
+        value = property_value[property_type]
+        if property_type in RICH_TEXT_TYPES:
+            value = "".join(text["plain_text"] for text in value)
+        if "equals" in condition:
+            return value == condition["equals"]
+        raise self.error(400, APIErrorCode.ValidationError, "Invalid filter")
+
+    def __databases_query(
+        self,
+        database_id: str,
+        start_cursor=None,
+        page_size: int = 100,
+        filter=None,
+        **kwargs,
+    ):
+        self.__database(database_id)
+        # Pages are returned in creation order, the cursor is the id of the first page of the next batch
+        page_ids = self.database_page_ids[database_id]
+        start = 0
+        if start_cursor is not None:
+            if start_cursor not in self.page_positions:
+                raise self.error(
+                    400, APIErrorCode.ValidationError, "Invalid start_cursor"
+                )
+            start = self.page_positions[start_cursor]
+
+        results = []
+        next_cursor = None
+        for position in range(start, len(page_ids)):
+            page_id = page_ids[position]
+            page = self.pages[page_id]
+            if page["archived"] or not self.__matches(page, filter):
+                continue
+            if len(results) == page_size:
+                next_cursor = page_id
+                break
+            results.append(page)
+
+        return {
+            "object": "list",
+            "results": json.loads(json.dumps(results)),
+            "has_more": next_cursor is not None,
+            "next_cursor": next_cursor,
+        }
+
+    def __property_value(self, schema: dict, key: str, value: dict) -> dict:
+        """Converts a property value from a request into the form Notion returns it in"""
+        if key not in schema:
+            raise self.error(
+                400,
+                APIErrorCode.ValidationError,
+                f"{key} is not a property that exists.",
+            )
+
+        property_type = schema[key]["type"]
+        if property_type not in value:
+            raise self.error(
+                400,
+                APIErrorCode.ValidationError,
+                f"{key} is expected to be {property_type}.",
+            )
+
+        property_value = value[property_type]
+        if property_type in RICH_TEXT_TYPES:
+            property_value = [
+                {
+                    "type": "text",
+                    "text": text["text"],
+                    "plain_text": text["text"]["content"],
+                }
+                for text in property_value
+            ]
+
+        return {
+            "id": schema[key]["id"],
+            "type": property_type,
+            property_type: property_value,
+        }
+
+    def __pages_create(self, parent=None, properties=None, **kwargs):
+        schema = self.__database(parent["database_id"])
+        now = self.__now()
+        page = {
+            "object": "page",
+            "id": str(uuid.uuid4()),
+            "created_time": now,
+            "last_edited_time": now,
+            "archived": False,
+            "parent": {"type": "database_id", "database_id": parent["database_id"]},
+            "properties": {},
+        }
+
+        # Properties that are not given are empty, like in Notion
+        for key, schema_property in schema.items():
+            empty = [] if schema_property["type"] in RICH_TEXT_TYPES else None
+            page["properties"][key] = {
+                "id": schema_property["id"],
+                "type": schema_property["type"],
+                schema_property["type"]: empty,
+            }
+        for key, value in (properties or {}).items():
+            page["properties"][key] = self.__property_value(schema, key, value)
+
+        self.pages[page["id"]] = page
+        self.page_positions[page["id"]] = len(
+            self.database_page_ids[page["parent"]["database_id"]]
+        )
+        self.database_page_ids[page["parent"]["database_id"]].append(page["id"])
+        return json.loads(json.dumps(page))
+
+    def __pages_update(self, page_id: str, properties=None, archived=None, **kwargs):
+        page = self.__page(page_id)
+        schema = self.__database(page["parent"]["database_id"])
+        for key, value in (properties or {}).items():
+            page["properties"][key] = self.__property_value(schema, key, value)
+
+        if archived is not None:
+            page["archived"] = archived
+
+        page["last_edited_time"] = self.__now()
+        return json.loads(json.dumps(page))
+
+
+class FakeEndpoint:
+    """Forwards calls of one notion client endpoint to the fake, after the fake's latency"""
+
+    def __init__(self, fake_notion: FakeNotion, endpoint: str) -> None:
+        self.fake_notion = fake_notion
+        self.endpoint = endpoint
+
+    def __call__(self, *args, **kwargs):
+        start = time.perf_counter()
+        self.fake_notion.enter()
+        try:
+            self.fake_notion.admit()
+            if self.fake_notion.latency:
+                time.sleep(self.fake_notion.latency)
+            response = self.fake_notion.handle(self.endpoint, *args, **kwargs)
+        except APIResponseError as error:
+            self.fake_notion.log(
+                self.endpoint, time.perf_counter() - start, error.status
+            )
+            raise
+        finally:
+            self.fake_notion.leave()
+
+        self.fake_notion.log(self.endpoint, time.perf_counter() - start, 200)
+        return response
+
+
+class FakeAsyncEndpoint(FakeEndpoint):
+    """Forwards calls of one async notion client endpoint to the fake, after the fake's latency"""
+
+    async def __call__(self, *args, **kwargs):
+        start = time.perf_counter()
+        self.fake_notion.enter()
+        try:
+            self.fake_notion.admit()
+            if self.fake_notion.latency:
+                await asyncio.sleep(self.fake_notion.latency)
+            response = self.fake_notion.handle(self.endpoint, *args, **kwargs)
+        except APIResponseError as error:
+            self.fake_notion.log(
+                self.endpoint, time.perf_counter() - start, error.status
+            )
+            raise
+        finally:
+            self.fake_notion.leave()
+
+        self.fake_notion.log(self.endpoint, time.perf_counter() - start, 200)
+        return response
+
+
+class FakeEndpointGroup:
+    """A group of endpoints, like `client.pages`"""
+
+    def __init__(self, fake_notion: FakeNotion, group: str, names, endpoint_type):
+        for name in names:
+            setattr(self, name, endpoint_type(fake_notion, f"{group}.{name}"))
+
+
+class FakeNotionClient:
+    """A synchronous client for a FakeNotion with the interface of notion_client.Client"""
+
+    endpoint_type = FakeEndpoint
+
+    def __init__(self, fake_notion: FakeNotion) -> None:
+        self.fake_notion = fake_notion
+        self.databases = FakeEndpointGroup(
+            fake_notion,
+            "databases",
+            ["retrieve", "update", "query"],
+            self.endpoint_type,
+        )
+        self.pages = FakeEndpointGroup(
+            fake_notion, "pages", ["create", "update"], self.endpoint_type
+        )
+
+    def close(self) -> None:
+        pass
+
+
+class FakeAsyncNotionClient(FakeNotionClient):
+    """An asynchronous client for a FakeNotion with the interface of notion_client.AsyncClient"""
+
+    endpoint_type = FakeAsyncEndpoint
+
+    async def aclose(self) -> None:
+        pass
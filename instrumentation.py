@@ -0,0 +1,252 @@
+import bisect
+import cProfile
+import functools
+import json
+import math
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+# Upper bounds of the histogram buckets in seconds, the same defaults Prometheus client libraries use
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, math.inf)
+
+
+def series_name(name: str, labels: tuple) -> str:
+    """Formats a metric and its labels the way Prometheus writes them, like name{endpoint="pages.create"}"""
+    if not labels:
+        return name
+    return (
+        name
+        + "{"
+        + ",".join(f"{key}={json.dumps(value)}" for key, value in labels)
+        + "}"
+    )
+
+
+def label_pairs(labels: dict) -> tuple:
+    """Orders the labels of a series, with every value as a string so series always compare"""
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+class Histogram:
+    """Count, sum, largest value and per-bucket counts of the values observed for one series"""
+
+    __slots__ = ("count", "sum", "max", "buckets")
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self.buckets = [0] * len(LATENCY_BUCKETS)
+
+    def observe(self, value: float) -> None:
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+        self.buckets[bisect.bisect_left(LATENCY_BUCKETS, value)] += 1
+
+    def cumulative_buckets(self) -> "list[tuple[float, int]]":
+        """Gets the number of values at or below every bucket bound, like Prometheus histograms"""
+        total = 0
+        cumulative = []
+        for bound, count in zip(LATENCY_BUCKETS, self.buckets):
+            total += count
+            cumulative.append((bound, total))
+        return cumulative
+
+
+class Instrumentation:
+    """Named counters and timers of a run, shared by the CSV processor, database client and request executor. Every
+    metric can carry labels (like the endpoint of a request). Components take an optional instrumentation and skip all
+    measuring when they have none, so a disabled instrumentation costs a None check per measured call.
+    """
+
+    def __init__(self, parse_profile_path=None) -> None:
+        """Creates an instrumentation without any metrics
+
+        Args:
+            parse_profile_path (str, optional): Where to dump cProfile stats of the CSV parse phase. Defaults to None.
+        """
+        self.parse_profile_path = parse_profile_path
+        self.counters = {}
+        self.histograms = {}
+        # Pipelined syncs record metrics from several threads
+        self.__lock = threading.Lock()
+
+    def count(self, name: str, amount: float = 1, **labels) -> None:
+        """Adds to a counter
+
+        Args:
+            name (str): Name of the counter
+            amount (float, optional): Amount to add. Defaults to 1.
+        """
+        key = (name, label_pairs(labels))
+        with self.__lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        """Adds a value to a histogram
+
+        Args:
+            name (str): Name of the histogram
+            value (float): The value, usually seconds
+        """
+        key = (name, label_pairs(labels))
+        with self.__lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(value)
+
+    @contextmanager
+    def timer(self, name: str, **labels):
+        """Observes the seconds spent in a with block, also when the block raises
+
+        Args:
+            name (str): Name of the histogram
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    @contextmanager
+    def parse_profile(self):
+        """Profiles a with block with cProfile when a parse profile path was given"""
+        if self.parse_profile_path is None:
+            yield
+            return
+
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            profile.dump_stats(self.parse_profile_path)
+
+    def summary(self) -> dict:
+        """Summarizes every metric
+
+        Returns:
+            dict: Counter values and histogram statistics, keyed by series name
+        """
+        with self.__lock:
+            return {
+                "counters": {
+                    series_name(name, labels): value
+                    for (name, labels), value in sorted(self.counters.items())
+                },
+                "timers": {
+                    series_name(name, labels): {
+                        "count": histogram.count,
+                        "sum": histogram.sum,
+                        "mean": histogram.sum / histogram.count,
+                        "max": histogram.max,
+                        "buckets": {
+                            str(bound): count
+                            for bound, count in histogram.cumulative_buckets()
+                        },
+                    }
+                    for (name, labels), histogram in sorted(self.histograms.items())
+                },
+            }
+
+    def write_json(self, path: str) -> None:
+        """Writes the summary as JSON
+
+        Args:
+            path (str): Path of the JSON file
+        """
+        with open(path, "w") as file:
+            json.dump(self.summary(), file, indent=2)
+
+    def write_prometheus(self, path: str) -> None:
+        """Writes every metric in the Prometheus text exposition format, for the node exporter's textfile collector
+
+        Args:
+            path (str): Path of the text file
+        """
+        lines = []
+        with self.__lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted(self.histograms.items())
+
+            typed = set()
+            for (name, labels), value in counters:
+                if name not in typed:
+                    typed.add(name)
+                    lines.append(f"# TYPE {name} counter")
+                lines.append(f"{series_name(name, labels)} {value}")
+
+            for (name, labels), histogram in histograms:
+                if name not in typed:
+                    typed.add(name)
+                    lines.append(f"# TYPE {name} histogram")
+                for bound, count in histogram.cumulative_buckets():
+                    le = "+Inf" if bound == math.inf else str(bound)
+                    lines.append(
+                        f"{series_name(name + '_bucket', labels + (('le', le),))} {count}"
+                    )
+                lines.append(f"{series_name(name + '_sum', labels)} {histogram.sum}")
+                lines.append(
+                    f"{series_name(name + '_count', labels)} {histogram.count}"
+                )
+
+        with open(path, "w") as file:
+            file.write("\n".join(lines) + "\n")
+
+
+def timed(instrumentation, name: str, **labels):
+    """Times a with block when there is an instrumentation
+
+    Args:
+        instrumentation (Instrumentation): The instrumentation, None to not measure anything
+        name (str): Name of the histogram
+
+    Returns:
+        ContextManager: The timer, or a context manager that does nothing
+    """
+    if instrumentation is None:
+        return nullcontext()
+    return instrumentation.timer(name, **labels)
+
+
+def instrumented(method):
+    """Times every call of a method of an object with an `instrumentation` attribute, as notion_method_seconds
+    labelled with the method name
+    """
+
+    @functools.wraps(method)
+    def timed_method(self, *args, **kwargs):
+        if self.instrumentation is None:
+            return method(self, *args, **kwargs)
+        with self.instrumentation.timer(
+            "notion_method_seconds", method=method.__name__
+        ):
+            return method(self, *args, **kwargs)
+
+    return timed_method
+
+
+def endpoint_name(endpoint) -> str:
+    """Names the notion client method a request is sent with, like "pages.create"
+
+    Args:
+        endpoint (Callable): The notion client method
+
+    Returns:
+        str: The name of the endpoint
+    """
+    # FakeNotion endpoints know their name
+    name = getattr(endpoint, "endpoint", None)
+    if isinstance(name, str):
+        return name
+
+    owner = getattr(endpoint, "__self__", None)
+    method_name = getattr(endpoint, "__name__", "request")
+    if owner is None:
+        return method_name
+    # notion_client methods belong to endpoint objects like PagesEndpoint
+    return f"{type(owner).__name__.replace('Endpoint', '').lower()}.{method_name}"
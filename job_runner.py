@@ -0,0 +1,378 @@
+import argparse
+import json
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import httpx
+from dotenv import load_dotenv
+from notion_client import Client
+
+from config import COLUMN_SETS
+from csv_processor import CSVProcessor, column_aggregators
+from notion_types import DatabaseClient, DatabaseColumn
+from pipeline import iter_rows, pipelined_upload
+from rate_limiting import RequestExecutor, TokenBucket
+
+# Requests in flight across every database, which is also the size of the shared connection pool
+DEFAULT_GLOBAL_LIMIT = 8
+# Requests in flight for a single database
+DEFAULT_DATABASE_LIMIT = 3
+# Jobs writing to Notion at the same time
+DEFAULT_JOB_WORKERS = 4
+# Seconds an idle connection of the shared pool is kept open for the next request
+KEEPALIVE_EXPIRY = 30
+
+
+class SyncJob:
+    """One ratings CSV file to sync into one database"""
+
+    def __init__(
+        self,
+        name: str,
+        csv_path: str,
+        database_id: str,
+        column_sets=None,
+        reconcile: bool = False,
+    ) -> None:
+        """Creates a job
+
+        Args:
+            name (str): Name of the job in the summary
+            csv_path (str): The path of the ratings CSV file
+            database_id (str): Id of the database to sync into
+            column_sets (list[str], optional): Names of the column sets in COLUMN_SETS to fill in. Defaults to ["database"].
+            reconcile (bool, optional): Only create, update and archive the rows that differ. Defaults to False.
+
+        Raises:
+            Exception: A column set is not in COLUMN_SETS
+        """
+        self.name = name
+        self.csv_path = csv_path
+        self.database_id = database_id
+        self.column_sets = column_sets or ["database"]
+        self.reconcile = reconcile
+
+        for column_set in self.column_sets:
+            if column_set not in COLUMN_SETS:
+                raise Exception(
+                    f"Job, {name}'s column set {column_set} is not one of {', '.join(COLUMN_SETS)}"
+                )
+
+    def columns(self) -> "list[DatabaseColumn]":
+        """Gets the columns of every column set of the job
+
+        Returns:
+            list[DatabaseColumn]: The columns, in the order of the column sets
+        """
+        return [
+            column
+            for column_set in self.column_sets
+            for column in COLUMN_SETS[column_set]
+        ]
+
+
+class JobSummary:
+    """What a job did and how long it took"""
+
+    def __init__(
+        self,
+        name: str,
+        books: int = 0,
+        counts=None,
+        requests: int = 0,
+        retries: int = 0,
+        aggregate_seconds: float = 0,
+        sync_seconds: float = 0,
+        error=None,
+    ) -> None:
+        """Creates the summary of a job
+
+        Args:
+            name (str): Name of the job
+            books (int, optional): Number of books in the CSV file. Defaults to 0.
+            counts (dict[str, int], optional): Number of rows "created", "updated", "archived" and left "unchanged". Defaults to None.
+            requests (int, optional): Requests sent to Notion, retries included. Defaults to 0.
+            retries (int, optional): Requests that were retried. Defaults to 0.
+            aggregate_seconds (float, optional): Seconds a worker process spent building the rows. Defaults to 0.
+            sync_seconds (float, optional): Seconds from the start of the job to its last request. Defaults to 0.
+            error (str, optional): Why the job failed, None if it succeeded. Defaults to None.
+        """
+        self.name = name
+        self.books = books
+        self.counts = counts or {
+            "created": 0,
+            "updated": 0,
+            "archived": 0,
+            "unchanged": 0,
+        }
+        self.requests = requests
+        self.retries = retries
+        self.aggregate_seconds = aggregate_seconds
+        self.sync_seconds = sync_seconds
+        self.error = error
+
+    def rows_per_second(self) -> float:
+        """Gets the rows synced per second of the job
+
+        Returns:
+            float: Rows (one per book) created, updated or left unchanged per second
+        """
+        if not self.sync_seconds:
+            return 0
+        return self.books / self.sync_seconds
+
+    def describe(self) -> str:
+        """Describes the job in one line
+
+        Returns:
+            str: The summary line
+        """
+        if self.error is not None:
+            return f"{self.name}: failed after {self.sync_seconds:.2f}s, {self.error}"
+
+        return (
+            f"{self.name}: {self.books:,} books, created {self.counts['created']:,}, "
+            f"updated {self.counts['updated']:,}, archived {self.counts['archived']:,}, "
+            f"unchanged {self.counts['unchanged']:,}, {self.requests:,} requests "
+            f"({self.retries:,} retried), aggregated in {self.aggregate_seconds:.2f}s, "
+            f"synced in {self.sync_seconds:.2f}s, {self.rows_per_second():,.1f} rows/sec"
+        )
+
+
+def load_manifest(manifest_path: str) -> "list[SyncJob]":
+    """Reads the jobs of a manifest, a JSON object with a "jobs" list. Every job has a "csv_path" and a "database_id",
+    and optionally a "name", the "columns" sets to fill in and whether to "reconcile".
+
+    Args:
+        manifest_path (str): The path of the manifest
+
+    Raises:
+        Exception: A job is missing its CSV path or database id, or names an unknown column set
+
+    Returns:
+        list[SyncJob]: The jobs, in the order of the manifest
+    """
+    with open(manifest_path, "r") as file:
+        manifest = json.load(file)
+
+    jobs = []
+    for index, job in enumerate(manifest["jobs"]):
+        if "csv_path" not in job or "database_id" not in job:
+            raise Exception(
+                f"Job {index} of {manifest_path} needs a csv_path and a database_id"
+            )
+
+        jobs.append(
+            SyncJob(
+                job.get("name", f"{job['csv_path']} -> {job['database_id']}"),
+                job["csv_path"],
+                job["database_id"],
+                column_sets=job.get("columns"),
+                reconcile=job.get("reconcile", False),
+            )
+        )
+    return jobs
+
+
+def shared_notion_client(global_limit: int = DEFAULT_GLOBAL_LIMIT) -> Client:
+    """Creates one notion client for every job. All of its requests go through a single httpx connection pool, so
+    connections are set up once and kept alive between the requests of different databases.
+
+    Args:
+        global_limit (int, optional): Most connections the pool opens. Defaults to DEFAULT_GLOBAL_LIMIT.
+
+    Returns:
+        Client: The notion client, authenticated with NOTION_TOKEN
+    """
+    load_dotenv()
+    http_client = httpx.Client(
+        limits=httpx.Limits(
+            max_connections=global_limit,
+            max_keepalive_connections=global_limit,
+            keepalive_expiry=KEEPALIVE_EXPIRY,
+        )
+    )
+    return Client(auth=os.environ["NOTION_TOKEN"], client=http_client)
+
+
+def aggregate_job(job: SyncJob) -> "tuple[list[dict], float]":
+    """Builds the rows of a job, in a worker process
+
+    Args:
+        job (SyncJob): The job
+
+    Returns:
+        tuple[list[dict], float]: The rows in the order the sequential sync sends them, and the seconds it took
+    """
+    start = time.perf_counter()
+    columns = job.columns()
+    csv_processor = CSVProcessor(job.csv_path, aggregators=column_aggregators(columns))
+    rows = list(iter_rows(csv_processor, columns))
+    return rows, time.perf_counter() - start
+
+
+def run_job(
+    job: SyncJob,
+    aggregation,
+    client,
+    rate_limiter: TokenBucket,
+    shared_limit: threading.Semaphore,
+    database_limit: int,
+) -> JobSummary:
+    """Syncs the rows of a job into its database. The existing rows are read while the job waits for its rows.
+
+    Args:
+        job (SyncJob): The job
+        aggregation (Future): Result of aggregate_job for the job
+        client (Client): The notion client shared by every job
+        rate_limiter (TokenBucket): The rate limiter shared by every job
+        shared_limit (threading.Semaphore): Bounds the requests in flight of every job together
+        database_limit (int): Most requests in flight for the database of the job
+
+    Returns:
+        JobSummary: What the job did, with the error if it failed
+    """
+    summary = JobSummary(job.name)
+    executor = RequestExecutor(
+        max_concurrency=database_limit,
+        rate_limiter=rate_limiter,
+        shared_limit=shared_limit,
+    )
+    start = time.perf_counter()
+
+    def build_rows():
+        rows, summary.aggregate_seconds = aggregation.result()
+        summary.books = len(rows)
+        return rows
+
+    try:
+        columns = job.columns()
+        database_client = DatabaseClient(
+            job.database_id, columns, executor=executor, client=client
+        )
+        summary.counts = pipelined_upload(
+            database_client,
+            columns,
+            build_rows,
+            reconcile=job.reconcile,
+            upload_workers=database_limit,
+        )
+    except Exception as error:
+        # One failing job does not stop the others, the summary reports it
+        summary.error = f"{type(error).__name__}: {error}"
+
+    summary.sync_seconds = time.perf_counter() - start
+    summary.requests = executor.requests
+    summary.retries = executor.retries
+    return summary
+
+
+def run_jobs(
+    jobs: "list[SyncJob]",
+    client=None,
+    global_limit: int = DEFAULT_GLOBAL_LIMIT,
+    database_limit: int = DEFAULT_DATABASE_LIMIT,
+    job_workers: int = DEFAULT_JOB_WORKERS,
+    aggregation_workers=None,
+    rate_limiter=None,
+) -> "list[JobSummary]":
+    """Syncs many CSV files into many databases. Every CSV file is aggregated in a process pool while the jobs whose
+    rows are ready write to Notion. Every job sends its requests through the same notion client and rate limiter, with
+    at most `database_limit` requests in flight per database and `global_limit` across all of them.
+
+    Args:
+        jobs (list[SyncJob]): The jobs to run
+        client (Client, optional): Notion client shared by every job. Defaults to shared_notion_client(global_limit).
+        global_limit (int, optional): Most requests in flight across every database. Defaults to DEFAULT_GLOBAL_LIMIT.
+        database_limit (int, optional): Most requests in flight for one database. Defaults to DEFAULT_DATABASE_LIMIT.
+        job_workers (int, optional): Most jobs writing to Notion at the same time. Defaults to DEFAULT_JOB_WORKERS.
+        aggregation_workers (int, optional): Number of processes aggregating CSV files. Defaults to the number of CPUs.
+        rate_limiter (TokenBucket, optional): Limiter every request takes a token from. Defaults to a new TokenBucket
+            at Notion's rate limit, which applies to the integration and not to a single database.
+
+    Returns:
+        list[JobSummary]: What every job did, in the order of the jobs
+    """
+    owns_client = client is None
+    if owns_client:
+        client = shared_notion_client(global_limit)
+    rate_limiter = rate_limiter or TokenBucket()
+    shared_limit = threading.BoundedSemaphore(global_limit)
+
+    try:
+        with ProcessPoolExecutor(
+            max_workers=aggregation_workers
+        ) as aggregation_pool, ThreadPoolExecutor(max_workers=job_workers) as job_pool:
+            aggregations = [aggregation_pool.submit(aggregate_job, job) for job in jobs]
+            summaries = [
+                job_pool.submit(
+                    run_job,
+                    job,
+                    aggregation,
+                    client,
+                    rate_limiter,
+                    shared_limit,
+                    database_limit,
+                )
+                for job, aggregation in zip(jobs, aggregations)
+            ]
+            return [summary.result() for summary in summaries]
+    finally:
+        if owns_client:
+            client.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Syncs every ratings CSV of a manifest into its notion database"
+    )
+    parser.add_argument("manifest", help="Path of the JSON manifest of the jobs")
+    parser.add_argument(
+        "--global-limit",
+        type=int,
+        default=DEFAULT_GLOBAL_LIMIT,
+        help="Most requests in flight across every database, and the size of the connection pool",
+    )
+    parser.add_argument(
+        "--database-limit",
+        type=int,
+        default=DEFAULT_DATABASE_LIMIT,
+        help="Most requests in flight for one database",
+    )
+    parser.add_argument(
+        "--job-workers",
+        type=int,
+        default=DEFAULT_JOB_WORKERS,
+        help="Most jobs writing to Notion at the same time",
+    )
+    parser.add_argument(
+        "--aggregation-workers",
+        type=int,
+        default=None,
+        help="Number of processes aggregating the CSV files, defaults to the number of CPUs",
+    )
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    summaries = run_jobs(
+        load_manifest(args.manifest),
+        global_limit=args.global_limit,
+        database_limit=args.database_limit,
+        job_workers=args.job_workers,
+        aggregation_workers=args.aggregation_workers,
+    )
+    seconds = time.perf_counter() - start
+
+    for summary in summaries:
+        print(summary.describe())
+    books = sum(summary.books for summary in summaries)
+    failed = sum(summary.error is not None for summary in summaries)
+    print(
+        f"{len(summaries)} jobs ({failed} failed), {books:,} books and "
+        f"{sum(summary.requests for summary in summaries):,} requests in {seconds:.2f}s, "
+        f"{books / seconds:,.1f} rows/sec"
+    )
+    if failed:
+        raise SystemExit(1)
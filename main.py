@@ -1,27 +1,241 @@
+import argparse
 import os
 
-from config import DATABASE_COLUMNS
+from config import DATABASE_COLUMNS, STATISTICS_COLUMNS
 from dotenv import load_dotenv
-from notion_types import DatabaseClient
-from csv_processor import CSVProcessor
+from instrumentation import Instrumentation, timed
+from notion_mirror import NotionMirror
+from notion_types import DatabaseClient, DatabaseColumn
+from csv_processor import CSVProcessor, column_aggregators
+from pipeline import iter_rows, pipelined_sync
+from sync_journal import SyncJournal, journaled_sync
+
+
+def build_rows(
+    csv_processor: CSVProcessor, columns: "list[DatabaseColumn]"
+) -> "list[dict]":
+    """Builds the database rows for every book found by the CSV processor
+
+    Args:
+        csv_processor (CSVProcessor): The processed ratings
+        columns (list[DatabaseColumn]): The columns we want to fill in for every book
+
+    Returns:
+        list[dict]: Objects with all the row information (key = column, value = column value for that row)
+    """
+    return list(iter_rows(csv_processor, columns))
+
+
+def sync_rows(
+    database_client: DatabaseClient,
+    csv_processor: CSVProcessor,
+    columns: "list[DatabaseColumn]",
+    reconcile: bool,
+) -> "dict[str, int]":
+    """Adds the rows of the processed ratings to the database, or reconciles them with its pages
+
+    Args:
+        database_client (DatabaseClient): Client of the database to sync into
+        csv_processor (CSVProcessor): The processed ratings
+        columns (list[DatabaseColumn]): The columns we want to fill in for every book
+        reconcile (bool): Only create, update and archive the rows that differ
+
+    Returns:
+        dict[str, int]: Number of rows "created", "updated", "archived" and left "unchanged"
+    """
+    if not reconcile:
+        rows = build_rows(csv_processor, columns)
+        for row in rows:
+            database_client.notion_add_row(row)
+        return {"created": len(rows), "updated": 0, "archived": 0, "unchanged": 0}
+
+    if not csv_processor.resumed_checkpoint:
+        return database_client.notion_reconcile_rows(build_rows(csv_processor, columns))
+
+    # The checkpoint is only committed once a sync succeeded, so the books outside of changed_books have the same rows
+    # as when they were last synced and their pages are left alone. Pages edited in Notion since then are only repaired
+    # by a run without the checkpoint.
+    book_names = sorted(csv_processor.changed_books, reverse=True)
+    return database_client.notion_reconcile_rows(
+        csv_processor.get_rows(columns, book_names), archive_missing=False
+    )
+
+
+def sync(
+    database_client: DatabaseClient,
+    csv_path: str,
+    columns: "list[DatabaseColumn]",
+    reconcile: bool = False,
+    quarantine_path=None,
+    checkpoint_path=None,
+):
+    """Syncs the ratings of a CSV file into the database of a client
+
+    Args:
+        database_client (DatabaseClient): Client of the database to sync into
+        csv_path (str): The path of the ratings CSV file
+        columns (list[DatabaseColumn]): The columns we want to fill in for every book
+        reconcile (bool, optional): Only create, update and archive the rows that differ. Defaults to False.
+        quarantine_path (str, optional): CSV file to write the malformed rows of the ratings to. Defaults to None.
+        checkpoint_path (str, optional): Where to keep the aggregation state of an append-only CSV file, so only the
+        rows appended since the last successful sync are read and, with reconcile, only their books are reconciled.
+        Defaults to None.
+
+    Returns:
+        dict[str, int]: Number of rows "created", "updated", "archived" and left "unchanged"
+    """
+    archived = 0
+    if not reconcile:
+        archived = database_client.notion_clear_database()
+
+    csv_processor = CSVProcessor(
+        csv_path,
+        checkpoint_path=checkpoint_path,
+        aggregators=column_aggregators(columns),
+        instrumentation=database_client.instrumentation,
+        quarantine_path=quarantine_path,
+        defer_checkpoint=checkpoint_path is not None,
+    )
+    try:
+        counts = sync_rows(database_client, csv_processor, columns, reconcile)
+    except BaseException:
+        # The next run reads the same rows again
+        if checkpoint_path is not None:
+            csv_processor.discard_checkpoint()
+        raise
+
+    if checkpoint_path is not None:
+        csv_processor.commit_checkpoint()
+    counts["archived"] += archived
+    return counts
+
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Syncs the book ratings CSV into a notion database"
+    )
+    parser.add_argument(
+        "--reconcile",
+        action="store_true",
+        help="Only create, update and archive the rows that differ instead of clearing and re-adding every row",
+    )
+    parser.add_argument(
+        "--upload-workers",
+        type=int,
+        default=0,
+        help="Upload rows from this many threads while the CSV is still being processed, instead of one after another",
+    )
+    parser.add_argument(
+        "--mirror",
+        default=None,
+        help="Path of a SQLite file that mirrors the database rows, so later runs only read the rows that changed",
+    )
+    parser.add_argument(
+        "--schema-cache",
+        default=None,
+        help="Path of a JSON file remembering the reconciled schema, so later runs skip the schema requests",
+    )
+    parser.add_argument(
+        "--statistics",
+        action="store_true",
+        help="Also sync the median, standard deviation, histogram and readers of every book",
+    )
+    parser.add_argument(
+        "--journal",
+        default=None,
+        help="Path of a SQLite file journaling every request, so a run that stopped partway continues where it left off",
+    )
+    parser.add_argument(
+        "--metrics",
+        default=None,
+        help="Path of a JSON file to write the timers and counters of the run to",
+    )
+    parser.add_argument(
+        "--prometheus",
+        default=None,
+        help="Path of a text file to write the timers and counters of the run to, in the Prometheus text format",
+    )
+    parser.add_argument(
+        "--profile-parse",
+        default=None,
+        help="Path of a cProfile stats file for the CSV parse phase, readable with python -m pstats",
+    )
+    parser.add_argument(
+        "--quarantine",
+        default=None,
+        help="Path of a CSV file to write the malformed rows of the ratings to, with their line number and reason",
+    )
+    parser.add_argument(
+        "--checkpoint",
+        default=None,
+        help="Path of a SQLite file keeping the aggregated ratings, so later runs only read the rows appended since "
+        "the last successful run and, with --reconcile, only update the books they rate",
+    )
+    args = parser.parse_args()
+    if args.journal and args.upload_workers:
+        parser.error(
+            "--journal sends the requests in order and cannot be combined with --upload-workers"
+        )
+    if args.checkpoint and (args.journal or args.upload_workers):
+        parser.error(
+            "--checkpoint is only saved once a sync succeeded and cannot be combined with --journal or --upload-workers"
+        )
+    columns = DATABASE_COLUMNS + (STATISTICS_COLUMNS if args.statistics else [])
+
+    instrumentation = None
+    if args.metrics or args.prometheus or args.profile_parse:
+        instrumentation = Instrumentation(parse_profile_path=args.profile_parse)
+
     load_dotenv()
     database_client = DatabaseClient(
         os.environ["DATABASE_ID"],
-        DATABASE_COLUMNS,
+        columns,
+        mirror=(
+            NotionMirror(args.mirror, os.environ["DATABASE_ID"])
+            if args.mirror
+            else None
+        ),
+        schema_cache_path=args.schema_cache,
+        instrumentation=instrumentation,
     )
 
-    database_client.notion_clear_database()
-
-    csv_processor = CSVProcessor("data/ratings.csv")
+    with timed(instrumentation, "sync_seconds"):
+        if args.journal:
+            counts = journaled_sync(
+                database_client,
+                "data/ratings.csv",
+                columns,
+                SyncJournal(args.journal),
+                reconcile=args.reconcile,
+                quarantine_path=args.quarantine,
+            )
+        elif args.upload_workers:
+            counts = pipelined_sync(
+                database_client,
+                "data/ratings.csv",
+                columns,
+                reconcile=args.reconcile,
+                quarantine_path=args.quarantine,
+                upload_workers=args.upload_workers,
+            )
+        else:
+            counts = sync(
+                database_client,
+                "data/ratings.csv",
+                columns,
+                reconcile=args.reconcile,
+                quarantine_path=args.quarantine,
+                checkpoint_path=args.checkpoint,
+            )
+    print(
+        f"Created {counts['created']}, updated {counts['updated']}, "
+        f"archived {counts['archived']} and left {counts['unchanged']} rows unchanged"
+    )
 
-    # Reverse sorting for deterministic outputs
-    for key in sorted(
-        [str(dict_key) for dict_key in csv_processor.name_to_count.keys()], reverse=True
-    ):
-        row = {
-            column.column_name: column.csv_processor_function(csv_processor, key)
-            for column in DATABASE_COLUMNS
-        }
-        database_client.notion_add_row(row)
+    if instrumentation is not None:
+        for outcome, count in counts.items():
+            instrumentation.count("sync_rows_total", count, outcome=outcome)
+        if args.metrics:
+            instrumentation.write_json(args.metrics)
+        if args.prometheus:
+            instrumentation.write_prometheus(args.prometheus)
@@ -0,0 +1,156 @@
+import json
+import sqlite3
+import threading
+
+
+class NotionMirror:
+    """A local SQLite copy of the rows of a notion database. Rows are stored as the page objects Notion returned,
+    keyed by page id and by the value of the primary column, along with the newest last_edited_time seen by a refresh.
+    The mirror only stores rows, DatabaseClient decides when to refresh it and keeps it up to date with its own writes.
+    """
+
+    def __init__(self, mirror_path: str, database_id: str) -> None:
+        """Opens (or creates) the mirror of a database. A mirror file of another database is emptied.
+
+        Args:
+            mirror_path (str): Path of the SQLite file, ":memory:" keeps the mirror in memory
+            database_id (str): Id of the database being mirrored
+        """
+        self.mirror_path = mirror_path
+        self.database_id = database_id
+        # Pipelined syncs read and write the mirror from several threads
+        self.__lock = threading.Lock()
+        self.__connection = sqlite3.connect(mirror_path, check_same_thread=False)
+        with self.__lock, self.__connection:
+            self.__connection.execute(
+                "CREATE TABLE IF NOT EXISTS rows ("
+                "page_id TEXT PRIMARY KEY, row_key TEXT, created_time TEXT, "
+                "last_edited_time TEXT, page TEXT)"
+            )
+            self.__connection.execute(
+                "CREATE INDEX IF NOT EXISTS rows_by_key ON rows (row_key)"
+            )
+            self.__connection.execute(
+                "CREATE TABLE IF NOT EXISTS state (name TEXT PRIMARY KEY, value TEXT)"
+            )
+
+        if self.__state("database_id") != database_id:
+            self.clear()
+
+    def close(self) -> None:
+        """Closes the SQLite file"""
+        with self.__lock:
+            self.__connection.close()
+
+    def watermark(self):
+        """Gets the newest last_edited_time seen by a refresh
+
+        Returns:
+            str: The timestamp, None if the mirror was never refreshed
+        """
+        return self.__state("watermark")
+
+    def set_watermark(self, watermark: str) -> None:
+        """Stores the newest last_edited_time seen by a refresh
+
+        Args:
+            watermark (str): The timestamp
+        """
+        with self.__lock, self.__connection:
+            self.__connection.execute(
+                "INSERT OR REPLACE INTO state VALUES ('watermark', ?)", (watermark,)
+            )
+
+    def clear(self) -> None:
+        """Removes every row and the watermark, so the next refresh reads the whole database"""
+        with self.__lock, self.__connection:
+            self.__connection.execute("DELETE FROM rows")
+            self.__connection.execute("DELETE FROM state")
+            self.__connection.execute(
+                "INSERT INTO state VALUES ('database_id', ?)", (self.database_id,)
+            )
+
+    def upsert_pages(self, keyed_pages: "list[tuple]") -> None:
+        """Adds pages to the mirror, replacing the stored copies of pages it already has
+
+        Args:
+            keyed_pages (list[tuple[str, Page]]): The primary value and notion page object of every page
+        """
+        with self.__lock, self.__connection:
+            self.__connection.executemany(
+                "INSERT INTO rows VALUES (?, ?, ?, ?, ?) ON CONFLICT (page_id) DO UPDATE SET "
+                "row_key = excluded.row_key, last_edited_time = excluded.last_edited_time, page = excluded.page",
+                [
+                    (
+                        page["id"],
+                        row_key,
+                        page.get("created_time"),
+                        page.get("last_edited_time"),
+                        json.dumps(page),
+                    )
+                    for row_key, page in keyed_pages
+                ],
+            )
+
+    def remove_pages(self, page_ids: "list[str]") -> None:
+        """Removes pages from the mirror
+
+        Args:
+            page_ids (list[str]): Ids of the pages to remove
+        """
+        with self.__lock, self.__connection:
+            self.__connection.executemany(
+                "DELETE FROM rows WHERE page_id = ?",
+                [(page_id,) for page_id in page_ids],
+            )
+
+    def pages(self):
+        """Gets every mirrored page, in the order Notion returns them in
+
+        Returns:
+            Page[]: Array of notion page objects with each object representing a row in the database
+        """
+        with self.__lock:
+            return [
+                json.loads(page)
+                for (page,) in self.__connection.execute(
+                    "SELECT page FROM rows ORDER BY created_time, rowid"
+                )
+            ]
+
+    def find(self, row_key: str):
+        """Looks up the first page with a primary value
+
+        Args:
+            row_key (str): The sanitized value of the primary column
+
+        Returns:
+            Page: The notion page object, None if no page has the value
+        """
+        with self.__lock:
+            row = self.__connection.execute(
+                "SELECT page FROM rows WHERE row_key = ? ORDER BY created_time, rowid LIMIT 1",
+                (row_key,),
+            ).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def __contains__(self, row_key: str) -> bool:
+        with self.__lock:
+            return (
+                self.__connection.execute(
+                    "SELECT 1 FROM rows WHERE row_key = ? LIMIT 1", (row_key,)
+                ).fetchone()
+                is not None
+            )
+
+    def __len__(self) -> int:
+        with self.__lock:
+            return self.__connection.execute("SELECT COUNT(*) FROM rows").fetchone()[0]
+
+    def __state(self, name: str):
+        """Reads a value of the state table, None if it is not set"""
+        with self.__lock:
+            row = self.__connection.execute(
+                "SELECT value FROM state WHERE name = ?", (name,)
+            ).fetchone()
+        return None if row is None else row[0]
@@ -1,6 +1,13 @@
+import datetime
 import enum
+import hashlib
+import json
+from concurrent.futures import ThreadPoolExecutor
+from json.encoder import encode_basestring_ascii
 from notion_client import Client
 from dotenv import load_dotenv
+from instrumentation import instrumented, timed
+from rate_limiting import RequestExecutor, TokenBucket
 import os
 
 
@@ -12,6 +19,11 @@ class NotionType(str, enum.Enum):
     TEXT = "rich_text"
     NUMBER = "number"
     TITLE = "title"
+    SELECT = "select"
+    MULTI_SELECT = "multi_select"
+    CHECKBOX = "checkbox"
+    DATE = "date"
+    URL = "url"
 
 
 class NotionResponseObject(str, enum.Enum):
@@ -30,6 +42,7 @@ class DatabaseColumn:
         csv_processor_function=None,
         sanitizers=[],
         is_primary=False,
+        aggregator=None,
     ) -> None:
         """Initializes a new database column that can be used in the notion database
 
@@ -39,12 +52,14 @@ class DatabaseColumn:
             csv_processor_function ((str) => None, optional): A value processor function that gives us a value for a given book. Defaults to None.
             sanitizers (list, optional): Input sanitation functions. Defaults to [].
             is_primary (bool, optional): Primary key of the database schema. Defaults to False.
+            aggregator (Aggregator, optional): Per-book metric the CSV processor computes for this column, its result becomes the value of the column. Defaults to None.
         """
         self.column_name = column_name
         self.column_type = column_type
         self.sanitizers = sanitizers
         self.is_primary = is_primary
         self.csv_processor_function = csv_processor_function
+        self.aggregator = aggregator
 
 
 class Sanitizers:
@@ -74,12 +89,257 @@ class Sanitizers:
         return input_value.lower()
 
 
+# Fields of a page object kept when the rows are projected to a subset of their properties
+PROJECTED_PAGE_FIELDS = ["object", "id", "created_time", "last_edited_time", "archived"]
+
+
+def date_start(value) -> str:
+    """Formats a date, datetime or ISO 8601 string as the start of a Notion date"""
+    return value.isoformat() if hasattr(value, "isoformat") else value
+
+
+def comparable_date_start(value):
+    """Gets the start of a date in one form, whether it was written from Python or read back from Notion, which returns
+    datetimes with milliseconds and a UTC offset. Datetimes without an offset are in UTC, like Notion reads them.
+    """
+    start = date_start(value)
+    if start is None or "T" not in start:
+        return start
+
+    try:
+        moment = datetime.datetime.fromisoformat(start.replace("Z", "+00:00"))
+    except ValueError:
+        return start
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=datetime.timezone.utc)
+    return moment.astimezone(datetime.timezone.utc).isoformat()
+
+
+def number_json(value) -> str:
+    """Writes a number the way json.dumps does, also for numpy floats (which subclass float) and numpy integers"""
+    if value is None:
+        return "null"
+    if isinstance(value, float):
+        return float.__repr__(value)
+    return int.__repr__(int(value))
+
+
+# Builds the property value of a row for every column type, from the sanitized value
+PROPERTY_VALUE_BUILDERS = {
+    NotionType.TITLE: lambda value: {"title": [{"text": {"content": value}}]},
+    NotionType.TEXT: lambda value: {"rich_text": [{"text": {"content": value}}]},
+    NotionType.NUMBER: lambda value: {"number": value},
+    NotionType.SELECT: lambda value: {
+        "select": None if value is None else {"name": value}
+    },
+    NotionType.MULTI_SELECT: lambda value: {
+        "multi_select": [{"name": name} for name in value or []]
+    },
+    NotionType.CHECKBOX: lambda value: {"checkbox": bool(value)},
+    NotionType.DATE: lambda value: {
+        "date": None if value is None else {"start": date_start(value)}
+    },
+    NotionType.URL: lambda value: {"url": value},
+}
+
+# The same property values as PROPERTY_VALUE_BUILDERS, written straight to JSON text
+PROPERTY_JSON_BUILDERS = {
+    NotionType.TITLE: lambda value: '{"title":[{"text":{"content":'
+    + encode_basestring_ascii(value)
+    + "}}]}",
+    NotionType.TEXT: lambda value: '{"rich_text":[{"text":{"content":'
+    + encode_basestring_ascii(value)
+    + "}}]}",
+    NotionType.NUMBER: lambda value: '{"number":' + number_json(value) + "}",
+    NotionType.SELECT: lambda value: (
+        '{"select":null}'
+        if value is None
+        else '{"select":{"name":' + encode_basestring_ascii(value) + "}}"
+    ),
+    NotionType.MULTI_SELECT: lambda value: '{"multi_select":['
+    + ",".join('{"name":' + encode_basestring_ascii(name) + "}" for name in value or [])
+    + "]}",
+    NotionType.CHECKBOX: lambda value: (
+        '{"checkbox":true}' if value else '{"checkbox":false}'
+    ),
+    NotionType.DATE: lambda value: (
+        '{"date":null}'
+        if value is None
+        else '{"date":{"start":' + encode_basestring_ascii(date_start(value)) + "}}"
+    ),
+    NotionType.URL: lambda value: (
+        '{"url":null}'
+        if value is None
+        else '{"url":' + encode_basestring_ascii(value) + "}"
+    ),
+}
+
+
 class DatabaseActions(enum.Enum):
     ADD_COLUMN = "add column"
     INSERT_ROW = "insert row"
     REMOVE_COLUMN = "remove column"
 
 
+def construct_action_payload(
+    columns: "list[DatabaseColumn]", action: DatabaseActions, payload
+):
+    """Constructs the notion API payload based on the database action
+
+    Args:
+        columns (list[DatabaseColumn]): The columns of the database
+        action (DatabaseActions): The action we want to take with Notion API
+        payload (_type_): Additional payload information that we use to construct our payload
+
+    Returns:
+        Object: An object representing the request payload
+    """
+    if action == DatabaseActions.ADD_COLUMN:
+        assert isinstance(payload, DatabaseColumn)
+
+        if payload.is_primary:
+            return {"title": {"name": payload.column_name}}
+
+        return {
+            payload.column_name: {
+                "id": payload.column_name.lower(),
+                "name": payload.column_name,
+                payload.column_type: {},
+            }
+        }
+
+    if action == DatabaseActions.REMOVE_COLUMN:
+        assert isinstance(payload, str)
+        return {payload: None}
+
+    if action == DatabaseActions.INSERT_ROW:
+        input_payload = {}
+        sanitized_payload = sanitize_row(columns, payload)
+        for column in columns:
+            input_value = sanitized_payload[column.column_name]
+            input_payload[column.column_name] = PROPERTY_VALUE_BUILDERS[
+                column.column_type
+            ](input_value)
+
+        return input_payload
+
+
+def sanitize_row(columns: "list[DatabaseColumn]", data: dict) -> dict:
+    """Applies the sanitizers of every column to a row
+
+    Args:
+        columns (list[DatabaseColumn]): The columns of the database
+        data (dict): Object with all the row information (key = column, value = column value for that row)
+
+    Returns:
+        dict: Object with the sanitized row information
+    """
+    sanitized_row = {}
+    for column in columns:
+        input_value = data[column.column_name]
+        # Apply Sanitation
+        for sanitizer in column.sanitizers:
+            input_value = sanitizer(input_value)
+        sanitized_row[column.column_name] = input_value
+
+    return sanitized_row
+
+
+def schema_fingerprint(database_id: str, columns: "list[DatabaseColumn]") -> str:
+    """Hashes the schema we want a database to have
+
+    Args:
+        database_id (str): Id of the database
+        columns (list[DatabaseColumn]): The columns of the database
+
+    Returns:
+        str: Hex digest that changes whenever a column is added, removed, renamed or changes type
+    """
+    schema = [database_id] + [
+        [column.column_name, column.column_type, column.is_primary]
+        for column in columns
+    ]
+    return hashlib.sha1(json.dumps(schema).encode()).hexdigest()
+
+
+class RowEncoder:
+    """Builds the properties payload of rows for a fixed list of columns. Everything that only depends on the columns,
+    like the sanitizers to chain and the shape of each property type, is worked out once when the encoder is created
+    instead of for every row.
+    """
+
+    def __init__(self, columns: "list[DatabaseColumn]") -> None:
+        """Compiles an encoder for the columns
+
+        Args:
+            columns (list[DatabaseColumn]): The columns of the database
+        """
+        self.columns = columns
+        self.__encoders = [
+            (
+                column.column_name,
+                self.__compile(column, PROPERTY_VALUE_BUILDERS[column.column_type]),
+            )
+            for column in columns
+        ]
+        self.__json_encoders = [
+            (
+                column.column_name,
+                encode_basestring_ascii(column.column_name) + ":",
+                self.__compile(column, PROPERTY_JSON_BUILDERS[column.column_type]),
+            )
+            for column in columns
+        ]
+
+    @staticmethod
+    def __compile(column: DatabaseColumn, build):
+        """Chains the sanitizers of a column in front of a property builder"""
+        sanitizers = list(column.sanitizers)
+        if not sanitizers:
+            return build
+        if len(sanitizers) == 1:
+            sanitizer = sanitizers[0]
+            return lambda value: build(sanitizer(value))
+        if len(sanitizers) == 2:
+            first, second = sanitizers
+            return lambda value: build(second(first(value)))
+
+        def encode(value):
+            for sanitizer in sanitizers:
+                value = sanitizer(value)
+            return build(value)
+
+        return encode
+
+    def encode(self, data: dict) -> dict:
+        """Builds the properties payload of a row, the same payload construct_action_payload builds for INSERT_ROW
+
+        Args:
+            data (dict): Object with all the row information (key = column, value = column value for that row)
+
+        Returns:
+            dict: Column name to notion property value
+        """
+        return {name: encode(data[name]) for name, encode in self.__encoders}
+
+    def encode_json(self, data: dict) -> bytes:
+        """Builds the properties payload of a row as JSON, without building the payload objects first
+
+        Args:
+            data (dict): Object with all the row information (key = column, value = column value for that row)
+
+        Returns:
+            bytes: The properties payload serialized as JSON
+        """
+        return (
+            "{"
+            + ",".join(
+                [key + encode(data[name]) for name, key, encode in self.__json_encoders]
+            )
+            + "}"
+        ).encode()
+
+
 class DatabaseClient:
     """A database client to easily interact with a specified notion database"""
 
@@ -91,33 +351,79 @@ class DatabaseClient:
         database_id: str,
         columns: "list[DatabaseColumn]",
         test_mode=False,
+        executor=None,
+        client=None,
+        mirror=None,
+        schema_cache_path=None,
+        instrumentation=None,
     ) -> None:
         """Initializes a database client based on the database id and columns.
         Will add columns to the notion database if they do not exist already.
         Will remove columns that are not intended to be in the database.
+        Every change to the schema is sent in a single request.
 
         Args:
             database_id (str): Id of database to interact with
             columns (list[DatabaseColumn]): List of columns we want to
             test_mode (bool): Whether or not we want to use the database in testing mode
+            executor (RequestExecutor, optional): Sends every request with retries and backoff. Defaults to a new RequestExecutor at Notion's rate limit.
+            client (Client, optional): Notion client to send requests with. Defaults to a new Client using NOTION_TOKEN.
+            mirror (NotionMirror, optional): Local copy of the rows that reads are served from, refreshed before the first read. Defaults to None.
+            schema_cache_path (str, optional): JSON file remembering the schemas already reconciled, startup sends no request when the columns did not change since. Defaults to None.
+            instrumentation (Instrumentation, optional): Times every API method and payload, also handed to the default executor. Defaults to None.
         """
-        load_dotenv()
-        self.client = Client(auth=os.environ["NOTION_TOKEN"])
+        if client is None:
+            load_dotenv()
+            client = Client(auth=os.environ["NOTION_TOKEN"])
+
+        self.client = client
+        self.instrumentation = instrumentation
+        self.executor = executor or RequestExecutor(
+            rate_limiter=TokenBucket(), instrumentation=instrumentation
+        )
         self.database_id = database_id
         self.columns = columns
-        self.notion_column_keys = self.notion_get_all_column_keys()
+        self.mirror = mirror
+        # The mirror the last refresh brought up to date, writes through this client keep it up to date after that
+        self.__refreshed_mirror = None
+        self.row_encoder = RowEncoder(columns)
+        self.schema_cache_path = schema_cache_path
         self.test_mode = test_mode
 
-        if not test_mode:
-            intended_column_keys = set([column.column_name for column in self.columns])
-            for key in self.notion_column_keys:
-                if key not in intended_column_keys:
-                    self.notion_create_database_column(key)
+        # Edge Case Consideration: A cached schema is trusted without asking Notion, so columns changed by hand in
+        # Notion are only fixed once the cache file is deleted or our columns change
+        if test_mode:
+            self.notion_column_keys = self.notion_get_all_column_keys()
+        elif self.__schema_is_cached():
+            self.notion_column_keys = set(
+                [column.column_name for column in self.columns]
+            )
+        else:
+            self.notion_column_keys = self.notion_reconcile_schema()
+            self.__cache_schema()
 
-            for column in self.columns:
-                if column.column_name not in self.notion_column_keys:
-                    self.notion_create_database_column(column)
+    @instrumented
+    def notion_get_schema(self) -> dict:
+        """Gets the properties object of the notion database
 
+        Raises:
+            Exception: Failure to retrieve column keys for a specified database based on the database id
+
+        Returns:
+            dict: Column key to the notion property object of the column
+        """
+        response = self.executor.call(
+            self.client.databases.retrieve, self.database_id, idempotent=True
+        )
+
+        if response["object"] == NotionResponseObject.ERROR:
+            raise Exception(
+                f"Failed to retrieve column keys for database: {self.database_id}"
+            )
+
+        return response["properties"]
+
+    @instrumented
     def notion_get_all_column_keys(self) -> "set[str]":
         """
         Gets all column keys that have been added into the notion database.
@@ -128,22 +434,68 @@ class DatabaseClient:
         Returns:
             set[str]: Set of strings indicating all column database keys
         """
-        response = self.client.databases.retrieve(self.database_id)
-        properties = set()
+        return set(self.notion_get_schema())
+
+    def notion_schema_changes(self, schema: dict) -> dict:
+        """Computes the properties payload that turns a database schema into our columns
+
+        Args:
+            schema (dict): The properties object of the database
+
+        Returns:
+            dict: Properties payload adding missing columns, fixing column types and removing columns we do not want,
+            empty when the schema already matches
+        """
+        intended_column_keys = set([column.column_name for column in self.columns])
+        properties = {}
+        for key, value in schema.items():
+            # The title property cannot be removed, the primary column renames it instead
+            if key not in intended_column_keys and value["type"] != NotionType.TITLE:
+                properties.update(
+                    self.__construct_action_payload(DatabaseActions.REMOVE_COLUMN, key)
+                )
+
+        for column in self.columns:
+            current = schema.get(column.column_name)
+            if current is None or current["type"] != column.column_type:
+                properties.update(
+                    self.__construct_action_payload(DatabaseActions.ADD_COLUMN, column)
+                )
+
+        return properties
+
+    @instrumented
+    def notion_reconcile_schema(self) -> "set[str]":
+        """Makes the database schema match our columns, with one request to read it and at most one to change it
+
+        Raises:
+            Exception: Failure to retrieve or update the database schema
+
+        Returns:
+            set[str]: Set of strings indicating all column database keys after the update
+        """
+        schema = self.notion_get_schema()
+        properties = self.notion_schema_changes(schema)
+        if not properties:
+            return set(schema)
+
+        response = self.executor.call(
+            self.client.databases.update,
+            self.database_id,
+            properties=properties,
+            idempotent=True,
+        )
 
         if response["object"] == NotionResponseObject.ERROR:
             raise Exception(
-                f"Failed to retrieve column keys for database: {self.database_id}"
+                f"Failed to update the schema of database: {self.database_id}"
             )
 
-        properties_object = response["properties"]
-        for key in properties_object:
-            properties.add(key)
-
-        return properties
+        return set(response["properties"])
 
     # Edge Case Consideration: Additional sanitation for the database column names may be useful - for example if the
     # column name is too long Notion API may error out from a body size that is too large.
+    @instrumented
     def notion_create_database_column(self, column: DatabaseColumn) -> None:
         """Creates a database column based on a database column object
 
@@ -153,11 +505,13 @@ class DatabaseClient:
         Raises:
             Exception: Failure to create a database column
         """
-        response = self.client.databases.update(
+        response = self.executor.call(
+            self.client.databases.update,
             self.database_id,
             properties=self.__construct_action_payload(
                 DatabaseActions.ADD_COLUMN, column
             ),
+            idempotent=True,
         )
 
         if response["object"] == NotionResponseObject.ERROR:
@@ -169,7 +523,8 @@ class DatabaseClient:
     # However it is possible in a more realisitc setting that someone passes incomplete data to the CSV
     # We will want to add additional checks to ensure that we either add an incomplete row correctly or
     # warn the user that an incomplete row is being added
-    def notion_add_row(self, data: type(dict)) -> None:
+    @instrumented
+    def notion_add_row(self, data: type(dict)) -> str:
         """Creates a database row based on an object
 
         Args:
@@ -177,11 +532,16 @@ class DatabaseClient:
 
         Raises:
             Exception: Failure to create a database row
+
+        Returns:
+            str: Id of the page created for the row
         """
-        response = self.client.pages.create(
-            properties=self.__construct_action_payload(
-                DatabaseActions.INSERT_ROW, data
-            ),
+        with timed(self.instrumentation, "notion_encode_seconds"):
+            properties = self.row_encoder.encode(data)
+        # Not idempotent, so failures after which Notion may have created the page are not retried
+        response = self.executor.call(
+            self.client.pages.create,
+            properties=properties,
             parent={"type": "database_id", "database_id": self.database_id},
         )
 
@@ -190,6 +550,60 @@ class DatabaseClient:
                 f"Failed to create database row for database: {self.database_id}"
             )
 
+        if self.mirror is not None:
+            self.mirror.upsert_pages([(self.__page_key(response), response)])
+
+        return response["id"]
+
+    @instrumented
+    def notion_update_row(self, page_id: str, data: type(dict)) -> None:
+        """Updates the properties of an existing database row
+
+        Args:
+            page_id (str): Id of the page representing the row
+            data (type): Object with all the row information (key = column, value = column value for that row)
+
+        Raises:
+            Exception: Failure to update a database row
+        """
+        with timed(self.instrumentation, "notion_encode_seconds"):
+            properties = self.row_encoder.encode(data)
+        response = self.executor.call(
+            self.client.pages.update,
+            page_id,
+            properties=properties,
+            idempotent=True,
+        )
+
+        if response["object"] == NotionResponseObject.ERROR:
+            raise Exception(
+                f"Failed to update database row for database: {self.database_id}"
+            )
+
+        if self.mirror is not None:
+            self.mirror.upsert_pages([(self.__page_key(response), response)])
+
+    @instrumented
+    def notion_archive_row(self, page_id: str) -> None:
+        """Archives a database row
+
+        Args:
+            page_id (str): Id of the page representing the row
+
+        Raises:
+            Exception: Failure to archive a database row
+        """
+        response = self.executor.call(
+            self.client.pages.update, page_id, archived=True, idempotent=True
+        )
+
+        if response["object"] == NotionResponseObject.ERROR:
+            raise Exception(f"Failed to archive page for database: {self.database_id}")
+
+        if self.mirror is not None:
+            self.mirror.remove_pages([page_id])
+
+    @instrumented
     def notion_remove_database_column(self, column_key: str) -> None:
         """Removes a database column
 
@@ -199,11 +613,13 @@ class DatabaseClient:
         Raises:
             Exception: Failure to remove a database column
         """
-        response = self.client.databases.update(
+        response = self.executor.call(
+            self.client.databases.update,
             self.database_id,
             properties=self.__construct_action_payload(
                 DatabaseActions.REMOVE_COLUMN, column_key
             ),
+            idempotent=True,
         )
 
         if response["object"] == NotionResponseObject.ERROR:
@@ -211,26 +627,280 @@ class DatabaseClient:
                 f"Failed to remove database column for database: {self.database_id}"
             )
 
-    def notion_clear_database(self) -> None:
+    @instrumented
+    def notion_clear_database(self) -> int:
         """Clears all rows in the notion database
 
         Raises:
             Exception: Failure to clear the database
+
+        Returns:
+            int: Number of rows archived
+        """
+        # Archiving starts with the first page of results instead of after the last one, only page ids are kept
+        archived = 0
+        for page in self.notion_iter_rows(properties=[]):
+            self.notion_archive_row(page["id"])
+            archived += 1
+
+        return archived
+
+    @instrumented
+    def notion_reconcile_rows(
+        self, rows: "list[dict]", archive_missing: bool = True
+    ) -> "dict[str, int]":
+        """Makes the database rows match the given rows with as few requests as possible. Rows are matched to pages
+        by the primary column, new rows are created, changed rows are updated and pages without a row are archived.
+
+        Args:
+            rows (list[dict]): Objects with all the row information (key = column, value = column value for that row)
+            archive_missing (bool, optional): Archive the pages without a row, pass False when the rows are only the
+            ones that changed. Duplicate pages are archived either way. Defaults to True.
+
+        Raises:
+            Exception: The columns have no primary column to match rows by
+
+        Returns:
+            dict[str, int]: Number of rows "created", "updated", "archived" and left "unchanged"
+        """
+        # When several rows share a primary value the last one wins
+        desired_rows = {self.notion_row_key(row): row for row in rows}
+        indexed_rows, duplicate_page_ids = self.notion_index_rows(
+            self.notion_iter_rows(
+                properties=[column.column_name for column in self.columns]
+            )
+        )
+
+        counts = {"created": 0, "updated": 0, "archived": 0, "unchanged": 0}
+        for key, row in desired_rows.items():
+            counts[self.notion_apply_row(row, indexed_rows.pop(key, None))] += 1
+
+        # Pages that are not wanted anymore, or duplicates of a row we already matched, get archived
+        page_ids = list(duplicate_page_ids)
+        if archive_missing:
+            page_ids.extend(page_id for page_id, _ in indexed_rows.values())
+        for page_id in page_ids:
+            self.notion_archive_row(page_id)
+            counts["archived"] += 1
+
+        return counts
+
+    def notion_row_key(self, data: dict):
+        """Gets the value of the primary column of a row, the way it is stored in Notion
+
+        Args:
+            data (dict): Object with all the row information (key = column, value = column value for that row)
+
+        Raises:
+            Exception: The columns have no primary column
+
+        Returns:
+            Any: The sanitized value of the primary column
         """
-        all_pages = self.notion_get_rows()
-        for page in all_pages:
-            response = self.client.pages.update(page["id"], archived=True)
+        primary_column = self.__primary_column()
+        input_value = data[primary_column.column_name]
+        for sanitizer in primary_column.sanitizers:
+            input_value = sanitizer(input_value)
+        return input_value
+
+    def notion_index_rows(self, pages) -> "tuple[dict, list[str]]":
+        """Indexes pages by the value of their primary column
+
+        Args:
+            pages (Page[]): Notion page objects representing rows in the database
+
+        Raises:
+            Exception: The columns have no primary column
 
-            if response["object"] == NotionResponseObject.ERROR:
-                raise Exception(
-                    f"Failed to archive page for database: {self.database_id}"
+        Returns:
+            tuple[dict, list[str]]: Primary value to (page id, row information) of the first page with that value, and
+            the ids of the pages that repeat a primary value
+        """
+        primary_column = self.__primary_column()
+        indexed_rows = {}
+        duplicate_page_ids = []
+        for page in pages:
+            current_row = self.notion_read_row(page)
+            key = current_row[primary_column.column_name]
+            if key in indexed_rows:
+                duplicate_page_ids.append(page["id"])
+            else:
+                indexed_rows[key] = (page["id"], current_row)
+
+        return indexed_rows, duplicate_page_ids
+
+    def notion_apply_row(self, data: dict, indexed_row=None) -> str:
+        """Creates a row, or updates its page if the values stored in Notion differ
+
+        Args:
+            data (dict): Object with all the row information (key = column, value = column value for that row)
+            indexed_row (tuple[str, dict], optional): (page id, row information) of the page with the same primary value, from notion_index_rows. Defaults to None.
+
+        Returns:
+            str: Whether the row was "created", "updated" or left "unchanged"
+        """
+        action = self.notion_plan_row(data, indexed_row)
+        if action == "created":
+            self.notion_add_row(data)
+        elif action == "updated":
+            self.notion_update_row(indexed_row[0], data)
+        return action
+
+    def notion_plan_row(self, data: dict, indexed_row=None) -> str:
+        """Decides what notion_apply_row would do with a row, without sending any request
+
+        Args:
+            data (dict): Object with all the row information (key = column, value = column value for that row)
+            indexed_row (tuple[str, dict], optional): (page id, row information) of the page with the same primary value, from notion_index_rows. Defaults to None.
+
+        Returns:
+            str: Whether the row needs to be "created", "updated" or is left "unchanged"
+        """
+        if indexed_row is None:
+            return "created"
+
+        _, current_row = indexed_row
+        # Compare the property values built from the sanitized row since that is what ends up stored in Notion
+        if self.__comparable_row(current_row) == self.__comparable_row(
+            self.__sanitize_row(data)
+        ):
+            return "unchanged"
+
+        return "updated"
+
+    def notion_read_row(self, page) -> dict:
+        """Reads the values of our columns out of a notion page object
+
+        Args:
+            page (Page): Notion page object representing a row in the database
+
+        Returns:
+            dict: Object with the row information (key = column, value = column value for that row)
+        """
+        row = {}
+        for column in self.columns:
+            property_value = page["properties"].get(column.column_name)
+            if property_value is None:
+                row[column.column_name] = None
+            elif column.column_type in [
+                NotionType.NUMBER,
+                NotionType.CHECKBOX,
+                NotionType.URL,
+            ]:
+                row[column.column_name] = property_value[column.column_type.value]
+            elif column.column_type == NotionType.SELECT:
+                option = property_value[column.column_type.value]
+                row[column.column_name] = None if option is None else option["name"]
+            elif column.column_type == NotionType.MULTI_SELECT:
+                row[column.column_name] = [
+                    option["name"]
+                    for option in property_value[column.column_type.value]
+                ]
+            elif column.column_type == NotionType.DATE:
+                date = property_value[column.column_type.value]
+                row[column.column_name] = None if date is None else date["start"]
+            elif (
+                column.column_type == NotionType.TEXT
+                or column.column_type == NotionType.TITLE
+            ):
+                row[column.column_name] = "".join(
+                    text["plain_text"]
+                    for text in property_value[column.column_type.value]
                 )
 
-    # Additional Edge Case Consideration: Because obtains all the database rows in a paginated manner via multiple requests
-    # it may be smart to have additional retry logic in case one of the requests fails. Else, we would just end up with an
-    # incomplete list of rows.
-    def notion_get_rows(self):
-        """Gets all rows in the notion database
+        return row
+
+    @instrumented
+    def notion_find_row(self, key: str):
+        """Finds the page of a row by the value of its primary column. With a mirror the page is looked up in the
+        mirror, so only the first read of the client sends a request.
+
+        Args:
+            key (str): The value of the primary column, it is sanitized before the lookup
+
+        Raises:
+            Exception: The columns have no primary column or failure to query the database
+
+        Returns:
+            Page: The first notion page object with that primary value, None if there is no such row
+        """
+        primary_column = self.__primary_column()
+        key = self.notion_row_key({primary_column.column_name: key})
+
+        if self.mirror is not None:
+            self.__refresh_mirror_once()
+            return self.mirror.find(key)
+
+        pages = self.notion_get_rows(
+            filter={
+                "property": primary_column.column_name,
+                primary_column.column_type.value: {"equals": key},
+            }
+        )
+        return pages[0] if pages else None
+
+    def __refresh_mirror_once(self) -> None:
+        """Refreshes the mirror unless this client already did, so a sync sends one query however many rows it reads"""
+        if self.__refreshed_mirror is not self.mirror:
+            self.notion_refresh_mirror()
+
+    # Notion's query results do not include archived pages, so pages archived by someone else stay in the mirror until
+    # a full refresh. Pages archived through this client are removed from the mirror right away.
+    @instrumented
+    def notion_refresh_mirror(self, full: bool = False) -> int:
+        """Brings the mirror up to date. Only the pages edited since the last refresh are read, unless the mirror is
+        empty or a full refresh is asked for. Reads only refresh the mirror the first time, call this to see pages
+        edited elsewhere since.
+
+        Args:
+            full (bool, optional): Read every page and drop mirrored pages that no longer exist. Defaults to False.
+
+        Raises:
+            Exception: The client has no mirror or failure to query the database
+
+        Returns:
+            int: Number of pages read from Notion
+        """
+        if self.mirror is None:
+            raise Exception(f"No mirror to refresh for database: {self.database_id}")
+
+        watermark = None if full else self.mirror.watermark()
+        if watermark is None:
+            self.mirror.clear()
+            batches = self.__query_row_batches()
+        else:
+            # Notion rounds last_edited_time down to the minute, so edits from the same minute as the watermark are
+            # read again rather than missed
+            batches = self.__query_row_batches(
+                {
+                    "timestamp": "last_edited_time",
+                    "last_edited_time": {"on_or_after": watermark},
+                }
+            )
+
+        # Only pages read here move the watermark, our own writes could be newer than edits we have not seen yet
+        newest_edit = watermark
+        read = 0
+        for pages in batches:
+            self.mirror.upsert_pages([(self.__page_key(page), page) for page in pages])
+            for page in pages:
+                if newest_edit is None or page["last_edited_time"] > newest_edit:
+                    newest_edit = page["last_edited_time"]
+            read += len(pages)
+
+        if newest_edit is not None:
+            self.mirror.set_watermark(newest_edit)
+        self.__refreshed_mirror = self.mirror
+
+        return read
+
+    @instrumented
+    def notion_get_rows(self, filter=None):
+        """Gets all rows in the notion database. With a mirror and no filter, the rows come from the mirror, which
+        is refreshed before the first read.
+
+        Args:
+            filter (dict, optional): Notion query filter the rows have to match. Defaults to None.
 
         Raises:
             Exception: Failure to get all rows in the database
@@ -238,25 +908,89 @@ class DatabaseClient:
         Returns:
             Page[]: Array of notion page objects with each object representing a row in the database
         """
-        cursor = None
+        return list(self.notion_iter_rows(filter))
+
+    def notion_iter_rows(self, filter=None, properties=None):
+        """Yields the rows of the notion database as the pages of results arrive, while the next page is fetched in
+        the background. With a mirror and no filter, the rows come from the mirror, which is refreshed before the
+        first read.
+
+        Args:
+            filter (dict, optional): Notion query filter the rows have to match. Defaults to None.
+            properties (list[str], optional): Names of the properties to keep on every row, the other properties and
+            page fields are dropped as soon as a page of results arrives. Defaults to None, which keeps everything.
+
+        Raises:
+            Exception: Failure to get all rows in the database
+
+        Yields:
+            Page: Notion page object representing a row in the database
+        """
+        if self.mirror is not None and filter is None:
+            self.__refresh_mirror_once()
+            batches = [self.mirror.pages()]
+        else:
+            batches = self.__query_row_batches(filter)
+
+        for pages in batches:
+            for page in pages:
+                if properties is not None:
+                    page = {
+                        **{
+                            field: page[field]
+                            for field in PROJECTED_PAGE_FIELDS
+                            if field in page
+                        },
+                        "properties": {
+                            name: page["properties"][name]
+                            for name in properties
+                            if name in page["properties"]
+                        },
+                    }
+                yield page
+
+    # Every page request goes through the executor, which retries failed requests, so a single failure in the middle of
+    # pagination no longer leaves us with an incomplete list of rows
+    def __query_row_batches(self, filter=None):
+        """Pages through the rows of the notion database. The request for the next page is sent as soon as a page
+        arrives, so it is in flight while the caller handles the current one.
+
+        Args:
+            filter (dict, optional): Notion query filter the rows have to match. Defaults to None.
+
+        Raises:
+            Exception: Failure to get all rows in the database
+
+        Yields:
+            Page[]: Array of notion page objects from one response
+        """
         page_size = 100
-        all_pages = []
-        while True:
-            pages = self.client.databases.query(
-                self.database_id, start_cursor=cursor, page_size=page_size
-            )
+        # The filter is left out of the request entirely when there is none
+        filter_kwargs = {} if filter is None else {"filter": filter}
 
+        def query(cursor):
+            pages = self.executor.call(
+                self.client.databases.query,
+                self.database_id,
+                start_cursor=cursor,
+                page_size=page_size,
+                idempotent=True,
+                **filter_kwargs,
+            )
             if pages["object"] == NotionResponseObject.ERROR:
                 raise Exception(f"Failed to get rows for database: {self.database_id}")
+            return pages
 
-            all_pages.extend(pages["results"])
-
-            if "has_more" not in pages or not pages["has_more"]:
-                break
+        # Closing the generator early waits for the one prefetched request instead of abandoning it
+        with ThreadPoolExecutor(max_workers=1) as prefetcher:
+            next_pages = prefetcher.submit(query, None)
+            while next_pages is not None:
+                pages = next_pages.result()
+                next_pages = None
+                if pages.get("has_more"):
+                    next_pages = prefetcher.submit(query, pages["next_cursor"])
 
-            cursor = pages["next_cursor"]
-
-        return all_pages
+                yield pages["results"]
 
     def __construct_action_payload(self, action: DatabaseActions, payload):
         """Constructs the notion API payload based on the database action
@@ -268,43 +1002,96 @@ class DatabaseClient:
         Returns:
             Object: An object representing the request payload
         """
-        if action == DatabaseActions.ADD_COLUMN:
-            assert isinstance(payload, DatabaseColumn)
+        return construct_action_payload(self.columns, action, payload)
 
-            if payload.is_primary:
-                return {"title": {"name": payload.column_name}}
+    def __primary_column(self) -> DatabaseColumn:
+        """Finds the primary column that rows are matched by
 
-            return {
-                payload.column_name: {
-                    "id": payload.column_name.lower(),
-                    "name": payload.column_name,
-                    payload.column_type: {},
-                }
-            }
+        Raises:
+            Exception: The columns have no primary column
 
-        if action == DatabaseActions.REMOVE_COLUMN:
-            assert isinstance(payload, str)
-            return {payload: None}
-
-        if action == DatabaseActions.INSERT_ROW:
-            input_payload = {}
-            for column in self.columns:
-                input_value = payload[column.column_name]
-                # Apply Sanitation
-                for sanitizer in column.sanitizers:
-                    input_value = sanitizer(input_value)
-
-                # Handle numbers and text/title differently
-                if column.column_type == NotionType.NUMBER:
-                    input_payload[column.column_name] = {
-                        column.column_type.value: input_value
-                    }
-                elif (
-                    column.column_type == NotionType.TEXT
-                    or column.column_type == NotionType.TITLE
-                ):
-                    input_payload[column.column_name] = {
-                        column.column_type.value: [{"text": {"content": input_value}}]
-                    }
+        Returns:
+            DatabaseColumn: The primary column
+        """
+        primary_column = next(
+            (column for column in self.columns if column.is_primary), None
+        )
+        if primary_column is None:
+            raise Exception(
+                f"Cannot match rows without a primary column for database: {self.database_id}"
+            )
+        return primary_column
+
+    def __read_schema_cache(self) -> dict:
+        """Reads the schema cache, a missing or unreadable cache is empty and only costs us a reconciliation
+
+        Returns:
+            dict: Database id to the fingerprint of the schema last reconciled for it
+        """
+        if self.schema_cache_path is None or not os.path.exists(self.schema_cache_path):
+            return {}
 
-            return input_payload
+        try:
+            with open(self.schema_cache_path) as cache_file:
+                return json.load(cache_file)
+        except (OSError, ValueError):
+            return {}
+
+    def __schema_is_cached(self) -> bool:
+        """Checks whether the schema cache says our columns were already reconciled for this database"""
+        return self.__read_schema_cache().get(self.database_id) == schema_fingerprint(
+            self.database_id, self.columns
+        )
+
+    def __cache_schema(self) -> None:
+        """Records in the schema cache that our columns were reconciled for this database"""
+        if self.schema_cache_path is None:
+            return
+
+        cache = self.__read_schema_cache()
+        cache[self.database_id] = schema_fingerprint(self.database_id, self.columns)
+        # Write to a temporary file first so an interrupted write never leaves a corrupt cache
+        temporary_path = f"{self.schema_cache_path}.tmp"
+        with open(temporary_path, "w") as cache_file:
+            json.dump(cache, cache_file)
+        os.replace(temporary_path, self.schema_cache_path)
+
+    def __page_key(self, page):
+        """Gets the value of the primary column of a page, None when the columns have no primary column"""
+        primary_column = next(
+            (column for column in self.columns if column.is_primary), None
+        )
+        if primary_column is None:
+            return None
+        return self.notion_read_row(page)[primary_column.column_name]
+
+    def __sanitize_row(self, data: dict) -> dict:
+        """Applies the sanitizers of every column to a row
+
+        Args:
+            data (dict): Object with all the row information (key = column, value = column value for that row)
+
+        Returns:
+            dict: Object with the sanitized row information
+        """
+        return sanitize_row(self.columns, data)
+
+    def __comparable_row(self, row: dict) -> dict:
+        """Builds the property values of a row so a row read from Notion and one about to be written compare equal
+        when Notion would store the same values, e.g. a date and the ISO 8601 string Notion returns for it
+
+        Args:
+            row (dict): Object with the sanitized row information, or the row information read from Notion
+
+        Returns:
+            dict: The property value of every column
+        """
+        comparable = {}
+        for column in self.columns:
+            value = row.get(column.column_name)
+            if column.column_type == NotionType.DATE:
+                value = comparable_date_start(value)
+            comparable[column.column_name] = PROPERTY_VALUE_BUILDERS[
+                column.column_type
+            ](value)
+        return comparable
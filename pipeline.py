@@ -0,0 +1,247 @@
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from csv_processor import CSVProcessor, column_aggregators
+from notion_types import DatabaseClient, DatabaseColumn
+
+DEFAULT_UPLOAD_WORKERS = 4
+# Rows waiting for an upload worker, the row builder blocks once this many are queued
+DEFAULT_QUEUE_SIZE = 256
+# Put into the queue once per upload worker to tell it that no more rows are coming
+END_OF_ROWS = None
+
+
+def iter_rows(csv_processor: CSVProcessor, columns: "list[DatabaseColumn]"):
+    """Builds the database rows for every book found by the CSV processor, one at a time
+
+    Args:
+        csv_processor (CSVProcessor): The processed ratings
+        columns (list[DatabaseColumn]): The columns we want to fill in for every book
+
+    Yields:
+        dict: Object with all the row information (key = column, value = column value for that row)
+    """
+    # Reverse sorting for deterministic outputs
+    book_names = sorted(
+        [str(dict_key) for dict_key in csv_processor.book_stats.keys()],
+        reverse=True,
+    )
+    yield from csv_processor.get_rows(columns, book_names)
+
+
+def put_with_backpressure(
+    rows_queue: queue.Queue, item, cancelled: threading.Event
+) -> bool:
+    """Blocks until the queue has room for the item, giving up once the upload is cancelled
+
+    Args:
+        rows_queue (queue.Queue): The queue feeding the workers
+        item (Any): The item to queue
+        cancelled (threading.Event): Set on the first failure of the upload
+
+    Returns:
+        bool: Whether the item was queued
+    """
+    while not cancelled.is_set():
+        try:
+            rows_queue.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+def stop_workers(rows_queue: queue.Queue, workers) -> None:
+    """Queues one END_OF_ROWS per worker. Never raises the error of a worker, so every worker still running gets its
+    marker even after another one failed.
+
+    Args:
+        rows_queue (queue.Queue): The queue feeding the workers
+        workers (list[Future]): Futures of the workers consuming the queue
+    """
+    for _ in workers:
+        while True:
+            try:
+                rows_queue.put(END_OF_ROWS, timeout=0.1)
+                break
+            except queue.Full:
+                # Workers that failed take no marker, the ones left over are not needed
+                if all(worker.done() for worker in workers):
+                    return
+
+
+def drain(rows_queue: queue.Queue) -> None:
+    """Drops every row still waiting in the queue"""
+    while True:
+        try:
+            rows_queue.get_nowait()
+        except queue.Empty:
+            return
+
+
+def pipelined_sync(
+    database_client: DatabaseClient,
+    csv_path: str,
+    columns: "list[DatabaseColumn]",
+    reconcile: bool = False,
+    upload_workers: int = DEFAULT_UPLOAD_WORKERS,
+    queue_size: int = DEFAULT_QUEUE_SIZE,
+    quarantine_path=None,
+) -> "dict[str, int]":
+    """Syncs the ratings of a CSV file into a database, overlapping the CSV processing with the requests to Notion.
+    The existing rows are read (and archived when not reconciling) while the CSV file is aggregated, and finished rows
+    flow through a bounded queue to upload workers. Rows are queued in the same order as the sequential sync, so with
+    one upload worker the requests are sent in exactly that order.
+
+    Args:
+        database_client (DatabaseClient): Client of the database to sync into
+        csv_path (str): The path of the ratings CSV file
+        columns (list[DatabaseColumn]): The columns we want to fill in for every book
+        reconcile (bool, optional): Only create, update and archive the rows that differ. Defaults to False.
+        upload_workers (int, optional): Number of threads sending row requests. Defaults to DEFAULT_UPLOAD_WORKERS.
+        queue_size (int, optional): Most rows waiting to be uploaded. Defaults to DEFAULT_QUEUE_SIZE.
+        quarantine_path (str, optional): CSV file to write the malformed rows of the ratings to. Defaults to None.
+
+    Returns:
+        dict[str, int]: Number of rows "created", "updated", "archived" and left "unchanged"
+    """
+
+    def build_rows():
+        csv_processor = CSVProcessor(
+            csv_path,
+            aggregators=column_aggregators(columns),
+            instrumentation=database_client.instrumentation,
+            quarantine_path=quarantine_path,
+        )
+        return iter_rows(csv_processor, columns)
+
+    return pipelined_upload(
+        database_client, columns, build_rows, reconcile, upload_workers, queue_size
+    )
+
+
+def pipelined_upload(
+    database_client: DatabaseClient,
+    columns: "list[DatabaseColumn]",
+    build_rows,
+    reconcile: bool = False,
+    upload_workers: int = DEFAULT_UPLOAD_WORKERS,
+    queue_size: int = DEFAULT_QUEUE_SIZE,
+) -> "dict[str, int]":
+    """Syncs rows into a database, reading the existing rows while the rows are built, see pipelined_sync
+
+    Args:
+        database_client (DatabaseClient): Client of the database to sync into
+        columns (list[DatabaseColumn]): The columns of the rows
+        build_rows (Callable[[], Iterable[dict]]): Builds the rows, called on this thread once the existing rows are
+            being read
+        reconcile (bool, optional): Only create, update and archive the rows that differ. Defaults to False.
+        upload_workers (int, optional): Number of threads sending row requests. Defaults to DEFAULT_UPLOAD_WORKERS.
+        queue_size (int, optional): Most rows waiting to be uploaded. Defaults to DEFAULT_QUEUE_SIZE.
+
+    Returns:
+        dict[str, int]: Number of rows "created", "updated", "archived" and left "unchanged"
+    """
+    rows_queue = queue.Queue(maxsize=queue_size)
+    counts = {"created": 0, "updated": 0, "archived": 0, "unchanged": 0}
+    lock = threading.Lock()
+    # Set on the first failure, the other threads stop sending requests once they see it
+    cancelled = threading.Event()
+    errors = []
+
+    def cancel(error: BaseException) -> None:
+        with lock:
+            errors.append(error)
+        cancelled.set()
+
+    def index_existing_rows():
+        return database_client.notion_index_rows(
+            database_client.notion_iter_rows(
+                properties=[column.column_name for column in columns]
+            )
+        )
+
+    def archive(page_ids: "list[str]") -> None:
+        try:
+            for page_id in page_ids:
+                if cancelled.is_set():
+                    return
+                database_client.notion_archive_row(page_id)
+                with lock:
+                    counts["archived"] += 1
+        except BaseException as error:
+            cancel(error)
+            raise
+
+    def upload(existing_rows) -> None:
+        try:
+            # Rows can only be compared against (or added next to) the existing rows once they have been read
+            indexed_rows, _ = existing_rows.result()
+            while True:
+                row = rows_queue.get()
+                if row is END_OF_ROWS:
+                    return
+                if cancelled.is_set():
+                    # Keeps taking rows until its END_OF_ROWS, without sending them
+                    continue
+
+                indexed_row = None
+                if reconcile:
+                    with lock:
+                        indexed_row = indexed_rows.pop(
+                            database_client.notion_row_key(row), None
+                        )
+                outcome = database_client.notion_apply_row(row, indexed_row)
+                with lock:
+                    counts[outcome] += 1
+        except BaseException as error:
+            cancel(error)
+            raise
+
+    # One extra thread reads (and archives) the existing rows
+    with ThreadPoolExecutor(max_workers=upload_workers + 1) as executor:
+        existing_rows = executor.submit(index_existing_rows)
+        workers = [
+            executor.submit(upload, existing_rows) for _ in range(upload_workers)
+        ]
+
+        try:
+            # Rows are built (and the CSV file aggregated) on this thread while the existing rows are read
+            rows = build_rows()
+
+            if not reconcile:
+                # Every page listed before the upload started is archived alongside the upload
+                indexed_rows, duplicate_page_ids = existing_rows.result()
+                archiver = executor.submit(
+                    archive,
+                    duplicate_page_ids
+                    + [page_id for page_id, _ in indexed_rows.values()],
+                )
+
+            for row in rows:
+                if not put_with_backpressure(rows_queue, row, cancelled):
+                    break
+        except BaseException as error:
+            cancel(error)
+
+        if cancelled.is_set():
+            # Rows nobody will send only delay the workers reaching their END_OF_ROWS
+            drain(rows_queue)
+        stop_workers(rows_queue, workers)
+
+        # The first error is raised only once every worker has stopped
+        wait(workers)
+        if errors:
+            raise errors[0]
+
+        if reconcile:
+            # Pages that are not wanted anymore, or duplicates of a row we already matched, get archived
+            indexed_rows, duplicate_page_ids = existing_rows.result()
+            archive(
+                duplicate_page_ids + [page_id for page_id, _ in indexed_rows.values()]
+            )
+        else:
+            archiver.result()
+
+    return counts
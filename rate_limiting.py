@@ -0,0 +1,418 @@
+import asyncio
+import json
+import random
+import threading
+import time
+import weakref
+from contextlib import nullcontext
+
+import httpx
+from notion_client.errors import RequestTimeoutError
+
+from instrumentation import endpoint_name
+
+# Notion allows an average of three requests per second per integration, with some bursts allowed
+NOTION_REQUESTS_PER_SECOND = 3
+
+
+class TokenBucket:
+    """A token bucket rate limiter that can be shared by threads and by coroutines of an event loop"""
+
+    def __init__(self, rate: float = NOTION_REQUESTS_PER_SECOND, capacity=None) -> None:
+        """Creates a full token bucket
+
+        Args:
+            rate (float, optional): Tokens added per second. Defaults to NOTION_REQUESTS_PER_SECOND.
+            capacity (float, optional): Most tokens the bucket holds, which is the largest burst allowed. Defaults to rate.
+        """
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self.__lock = threading.Lock()
+
+    def try_acquire(self) -> float:
+        """Takes a token if one is available
+
+        Returns:
+            float: 0 if a token was taken, otherwise the seconds until one becomes available
+        """
+        with self.__lock:
+            now = time.monotonic()
+            self.tokens = min(
+                self.capacity, self.tokens + (now - self.updated_at) * self.rate
+            )
+            self.updated_at = now
+
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0
+
+            return (1 - self.tokens) / self.rate
+
+    def acquire(self) -> float:
+        """Blocks the current thread until a token is available and takes it
+
+        Returns:
+            float: Seconds spent waiting
+        """
+        waited = 0
+        delay = self.try_acquire()
+        while delay:
+            time.sleep(delay)
+            waited += delay
+            delay = self.try_acquire()
+        return waited
+
+    async def acquire_async(self) -> float:
+        """Waits without blocking the event loop until a token is available and takes it
+
+        Returns:
+            float: Seconds spent waiting
+        """
+        waited = 0
+        delay = self.try_acquire()
+        while delay:
+            await asyncio.sleep(delay)
+            waited += delay
+            delay = self.try_acquire()
+        return waited
+
+
+# Statuses after which Notion did not apply the request, so any request can be sent again
+SAFE_RETRY_STATUSES = {409, 429, 503}
+# Statuses worth retrying, everything else means the request itself is wrong. After a 500, 502 or 504 Notion may
+# still have applied the request, so only idempotent requests are retried on those.
+RETRYABLE_STATUSES = SAFE_RETRY_STATUSES | {500, 502, 504}
+THROTTLED_STATUS = 429
+
+
+class RequestExecutor:
+    """Runs notion client requests with retries and adaptive concurrency. Failed requests are retried with jittered
+    exponential backoff (or after the Retry-After header when Notion sends one). The number of requests allowed in
+    flight grows slowly while requests succeed and is halved whenever we are throttled.
+    """
+
+    def __init__(
+        self,
+        max_retries: int = 5,
+        base_delay: float = 0.5,
+        max_delay: float = 30,
+        max_concurrency: int = 8,
+        min_concurrency: int = 1,
+        rate_limiter=None,
+        instrumentation=None,
+        shared_limit=None,
+    ) -> None:
+        """Creates a request executor
+
+        Args:
+            max_retries (int, optional): Retries before giving up on a request. Defaults to 5.
+            base_delay (float, optional): Seconds of backoff ceiling for the first retry, doubled for every retry after. Defaults to 0.5.
+            max_delay (float, optional): Largest backoff in seconds. Defaults to 30.
+            max_concurrency (int, optional): Most requests allowed in flight. Defaults to 8.
+            min_concurrency (int, optional): Fewest requests allowed in flight after backing off. Defaults to 1.
+            rate_limiter (TokenBucket, optional): Limiter every attempt takes a token from. Defaults to None.
+            instrumentation (Instrumentation, optional): Records the latency, size and outcome of every attempt. Defaults to None.
+            shared_limit (threading.Semaphore, optional): Held by every request sent with call, sharing it between the
+            executors of several databases bounds their requests in flight together. Defaults to None.
+        """
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.rate_limiter = rate_limiter
+        self.instrumentation = instrumentation
+        self.shared_limit = shared_limit
+        self.concurrency_limit = float(max_concurrency)
+        self.in_flight = 0
+
+        self.requests = 0
+        self.retries = 0
+        self.throttled_responses = 0
+        self.throttled_seconds = 0.0
+        self.rate_limited_seconds = 0.0
+
+        # Guards the counters and the concurrency limit for threads and coroutines alike
+        self.__condition = threading.Condition()
+        # Coroutines wait for a free slot on a condition of their own event loop, an asyncio.Condition only works in
+        # the loop it was first used in
+        self.__async_conditions = weakref.WeakKeyDictionary()
+
+    @staticmethod
+    def error_status(error: Exception):
+        """Gets the HTTP status of a failed request
+
+        Args:
+            error (Exception): The error raised by the notion client
+
+        Returns:
+            int: The status, or None if the request never got a response
+        """
+        return getattr(error, "status", None)
+
+    def is_retryable(self, error: Exception, idempotent: bool = True) -> bool:
+        """Decides whether a failed request should be retried
+
+        Args:
+            error (Exception): The error raised by the notion client
+            idempotent (bool, optional): Whether sending the request twice has the same effect as sending it once.
+                Requests that are not are only retried when Notion certainly did not apply them. Defaults to True.
+
+        Returns:
+            bool: Whether the request may succeed if we try again
+        """
+        if isinstance(error, httpx.ConnectError):
+            # The request was never sent
+            return True
+        if not idempotent:
+            return self.error_status(error) in SAFE_RETRY_STATUSES
+
+        if isinstance(error, (RequestTimeoutError, httpx.TransportError)):
+            return True
+        return self.error_status(error) in RETRYABLE_STATUSES
+
+    def retry_delay(self, error: Exception, attempt: int) -> float:
+        """Computes how long to wait before retrying
+
+        Args:
+            error (Exception): The error raised by the notion client
+            attempt (int): Number of the retry, starting at 0
+
+        Returns:
+            float: Seconds to wait
+        """
+        headers = getattr(error, "headers", None)
+        if headers is not None and headers.get("retry-after"):
+            try:
+                return min(float(headers["retry-after"]), self.max_delay)
+            except ValueError:
+                # Retry-After can also be an HTTP date, fall back to backoff
+                pass
+
+        # Full jitter spreads out the retries of requests that failed together
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2**attempt))
+
+    def __record_success(self) -> None:
+        """Additively increases the concurrency limit, by about one for every limit's worth of successes"""
+        self.concurrency_limit = min(
+            self.max_concurrency, self.concurrency_limit + 1 / self.concurrency_limit
+        )
+
+    def __record_failure(self, error: Exception, delay: float) -> None:
+        """Counts a retry and multiplicatively decreases the concurrency limit when we were throttled"""
+        self.retries += 1
+        if self.instrumentation is not None:
+            self.instrumentation.count("notion_retries_total")
+        if self.error_status(error) == THROTTLED_STATUS:
+            self.throttled_responses += 1
+            self.throttled_seconds += delay
+            if self.instrumentation is not None:
+                self.instrumentation.count("notion_throttled_responses_total")
+                self.instrumentation.count("notion_throttled_seconds_total", delay)
+            self.concurrency_limit = max(
+                self.min_concurrency, self.concurrency_limit / 2
+            )
+
+    def __instrument(
+        self, endpoint, kwargs: dict, seconds: float, waited: float, error
+    ) -> None:
+        """Records an attempt in the instrumentation
+
+        Args:
+            endpoint (Callable): The notion client method that was called
+            kwargs (dict): The keyword arguments of the request, which make up its body
+            seconds (float): Seconds from sending the request to getting the response
+            waited (float): Seconds spent waiting for the rate limiter
+            error (Exception): The error of the attempt, None if it succeeded
+        """
+        name = endpoint_name(endpoint)
+        status = 200 if error is None else self.error_status(error)
+        self.instrumentation.count(
+            "notion_requests_total", endpoint=name, status=status or "none"
+        )
+        self.instrumentation.observe("notion_request_seconds", seconds, endpoint=name)
+        self.instrumentation.count(
+            "notion_request_bytes_total",
+            len(json.dumps(kwargs, default=str)),
+            endpoint=name,
+        )
+        if waited:
+            self.instrumentation.count("notion_rate_limited_seconds_total", waited)
+
+    def __try_enter(self) -> bool:
+        """Takes a slot for a request if one is free
+
+        Returns:
+            bool: Whether a slot was taken
+        """
+        with self.__condition:
+            if self.in_flight >= int(self.concurrency_limit):
+                return False
+            self.in_flight += 1
+            self.requests += 1
+            return True
+
+    def __async_condition(self, loop: asyncio.AbstractEventLoop) -> asyncio.Condition:
+        """Gets the condition the coroutines of an event loop wait on for a free slot"""
+        with self.__condition:
+            if loop not in self.__async_conditions:
+                self.__async_conditions[loop] = asyncio.Condition()
+            return self.__async_conditions[loop]
+
+    def __notify_other_loops(self, running_loop) -> None:
+        """Wakes the coroutines waiting for a slot in every event loop but the running one. Called with the lock held.
+
+        Args:
+            running_loop (asyncio.AbstractEventLoop): The loop of the caller, None when called from a thread
+        """
+        for loop, condition in list(self.__async_conditions.items()):
+            if loop is running_loop or loop.is_closed():
+                continue
+            try:
+                loop.call_soon_threadsafe(self.__wake, loop, condition)
+            except RuntimeError:
+                # The loop closed in the meantime
+                pass
+
+    @staticmethod
+    def __wake(loop: asyncio.AbstractEventLoop, condition: asyncio.Condition) -> None:
+        """Notifies the waiters of a condition, from the thread of its event loop"""
+
+        async def notify_all():
+            async with condition:
+                condition.notify_all()
+
+        loop.create_task(notify_all())
+
+    def __finish(self, error, attempt: int, idempotent: bool) -> float:
+        """Updates the counters and the concurrency limit after an attempt. Called with the lock held.
+
+        Args:
+            error (Exception): The error of the attempt, None if it succeeded
+            attempt (int): Number of the retry, starting at 0
+            idempotent (bool): Whether to also retry the failures after which Notion may have applied the request
+
+        Returns:
+            float: Seconds to wait before retrying, None if the attempt should not be retried
+        """
+        self.in_flight -= 1
+        if error is None:
+            self.__record_success()
+            return None
+
+        if not self.is_retryable(error, idempotent) or attempt >= self.max_retries:
+            return None
+
+        delay = self.retry_delay(error, attempt)
+        self.__record_failure(error, delay)
+        return delay
+
+    def call(self, endpoint, *args, idempotent: bool = False, **kwargs):
+        """Sends a request from the current thread, retrying it when it fails in a retryable way
+
+        Args:
+            endpoint (Callable): The notion client method to call
+            idempotent (bool, optional): Also retry after timeouts, transport errors and 500, 502 and 504 responses,
+                which may come after Notion applied the request. Defaults to False.
+
+        Raises:
+            Exception: The last error when the request does not succeed within the retries
+
+        Returns:
+            Object: The response from Notion
+        """
+        attempt = 0
+        while True:
+            with self.__condition:
+                self.__condition.wait_for(
+                    lambda: self.in_flight < int(self.concurrency_limit)
+                )
+                self.in_flight += 1
+                self.requests += 1
+
+            error = None
+            waited = 0
+            start = time.perf_counter()
+            try:
+                if self.rate_limiter is not None:
+                    waited = self.rate_limiter.acquire()
+                with nullcontext() if self.shared_limit is None else self.shared_limit:
+                    start = time.perf_counter()
+                    response = endpoint(*args, **kwargs)
+            except Exception as request_error:
+                error = request_error
+
+            if self.instrumentation is not None:
+                self.__instrument(
+                    endpoint, kwargs, time.perf_counter() - start, waited, error
+                )
+
+            with self.__condition:
+                self.rate_limited_seconds += waited
+                delay = self.__finish(error, attempt, idempotent)
+                self.__condition.notify_all()
+                self.__notify_other_loops(None)
+
+            if error is None:
+                return response
+            if delay is None:
+                raise error
+
+            time.sleep(delay)
+            attempt += 1
+
+    async def call_async(self, endpoint, *args, idempotent: bool = False, **kwargs):
+        """Sends a request from a coroutine, retrying it when it fails in a retryable way
+
+        Args:
+            endpoint (Callable): The async notion client method to call
+            idempotent (bool, optional): Also retry after timeouts, transport errors and 500, 502 and 504 responses,
+                which may come after Notion applied the request. Defaults to False.
+
+        Raises:
+            Exception: The last error when the request does not succeed within the retries
+
+        Returns:
+            Object: The response from Notion
+        """
+        loop = asyncio.get_running_loop()
+        async_condition = self.__async_condition(loop)
+
+        attempt = 0
+        while True:
+            async with async_condition:
+                await async_condition.wait_for(self.__try_enter)
+
+            error = None
+            waited = 0
+            start = time.perf_counter()
+            try:
+                if self.rate_limiter is not None:
+                    waited = await self.rate_limiter.acquire_async()
+                start = time.perf_counter()
+                response = await endpoint(*args, **kwargs)
+            except Exception as request_error:
+                error = request_error
+
+            if self.instrumentation is not None:
+                self.__instrument(
+                    endpoint, kwargs, time.perf_counter() - start, waited, error
+                )
+
+            with self.__condition:
+                self.rate_limited_seconds += waited
+                delay = self.__finish(error, attempt, idempotent)
+                self.__condition.notify_all()
+                self.__notify_other_loops(loop)
+            async with async_condition:
+                async_condition.notify_all()
+
+            if error is None:
+                return response
+            if delay is None:
+                raise error
+
+            await asyncio.sleep(delay)
+            attempt += 1
@@ -0,0 +1,244 @@
+import mmap
+import os
+import struct
+import sys
+from array import array
+
+from notion_types import Sanitizers
+
+SNAPSHOT_MAGIC = b"RSNP"
+SNAPSHOT_VERSION = 1
+# Magic, version, byte order of the arrays, number of books, size and modification time (in nanoseconds) of the CSV
+# file the snapshot was made from. The header is 32 bytes so the arrays after it stay 8 byte aligned.
+SNAPSHOT_HEADER = struct.Struct("<4sHcxQQq")
+BYTE_ORDER = b"l" if sys.byteorder == "little" else b"b"
+
+
+def write_snapshot(snapshot_path: str, source_stat: os.stat_result, book_stats) -> None:
+    """Atomically writes the finalized stats of every book to a snapshot file. After the header come the offsets of
+    every name in the name table, the count, rating sum and favorites of every book as fixed-width arrays, and the
+    name table, the UTF-8 names sorted by their bytes so lookups can binary search them.
+
+    Args:
+        snapshot_path (str): The path to write the snapshot to
+        source_stat (os.stat_result): Stat of the CSV file taken before it was read
+        book_stats (Iterable[BookStats]): The stats of every book
+    """
+    encoded_stats = sorted((stats.name.encode("utf-8"), stats) for stats in book_stats)
+
+    name_offsets = array("q", [0])
+    counts = array("q")
+    rating_sums = array("d")
+    favorites = array("q")
+    for name, stats in encoded_stats:
+        name_offsets.append(name_offsets[-1] + len(name))
+        counts.append(stats.count)
+        rating_sums.append(stats.rating_sum)
+        favorites.append(stats.favorites)
+
+    temporary_path = f"{snapshot_path}.tmp"
+    with open(temporary_path, "wb") as file:
+        file.write(
+            SNAPSHOT_HEADER.pack(
+                SNAPSHOT_MAGIC,
+                SNAPSHOT_VERSION,
+                BYTE_ORDER,
+                len(encoded_stats),
+                source_stat.st_size,
+                source_stat.st_mtime_ns,
+            )
+        )
+        for values in [name_offsets, counts, rating_sums, favorites]:
+            values.tofile(file)
+        file.write(b"".join(name for name, _ in encoded_stats))
+    os.replace(temporary_path, snapshot_path)
+
+
+class RatingSnapshot:
+    """Read-only book stats served from a memory-mapped snapshot file, see write_snapshot for the layout. Opening a
+    snapshot only reads its header, lookups binary search the sorted name table and read one entry of every array,
+    so the time to the first lookup does not depend on the number of books.
+    """
+
+    def __init__(self, snapshot_path: str) -> None:
+        """Memory-maps a snapshot
+
+        Args:
+            snapshot_path (str): The path of the snapshot
+
+        Raises:
+            Exception: The file is not a snapshot, or was written by another version or on a machine of another byte order
+        """
+        self.snapshot_path = snapshot_path
+        with open(snapshot_path, "rb") as file:
+            self.__map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if len(self.__map) < SNAPSHOT_HEADER.size:
+            self.__map.close()
+            raise Exception(f"{snapshot_path} is not a rating snapshot")
+        (
+            magic,
+            version,
+            byte_order,
+            self.book_count,
+            self.source_size,
+            self.source_mtime_ns,
+        ) = SNAPSHOT_HEADER.unpack_from(self.__map)
+        if (
+            magic != SNAPSHOT_MAGIC
+            or version != SNAPSHOT_VERSION
+            or byte_order != BYTE_ORDER
+        ):
+            self.__map.close()
+            raise Exception(
+                f"{snapshot_path} is not a rating snapshot this version can read"
+            )
+
+        # Views into the mapped file, nothing is copied
+        view = memoryview(self.__map)
+        start = SNAPSHOT_HEADER.size
+        self.__name_offsets = view[start : start + 8 * (self.book_count + 1)].cast("q")
+        start += 8 * (self.book_count + 1)
+        self.__counts = view[start : start + 8 * self.book_count].cast("q")
+        start += 8 * self.book_count
+        self.__rating_sums = view[start : start + 8 * self.book_count].cast("d")
+        start += 8 * self.book_count
+        self.__favorites = view[start : start + 8 * self.book_count].cast("q")
+        self.__names_start = start + 8 * self.book_count
+        view.release()
+
+    @staticmethod
+    def load(snapshot_path: str, csv_path: str):
+        """Opens a snapshot if it was made from the current contents of the CSV file
+
+        Args:
+            snapshot_path (str): The path of the snapshot
+            csv_path (str): The path of the CSV file the snapshot was made from
+
+        Returns:
+            RatingSnapshot: The snapshot, None if it is missing, unreadable or stale
+        """
+        if not os.path.exists(snapshot_path):
+            return None
+
+        try:
+            snapshot = RatingSnapshot(snapshot_path)
+        except Exception:
+            return None
+
+        if snapshot.is_stale(csv_path):
+            snapshot.close()
+            return None
+        return snapshot
+
+    def is_stale(self, csv_path: str) -> bool:
+        """Checks whether the CSV file changed since the snapshot was made
+
+        Args:
+            csv_path (str): The path of the CSV file the snapshot was made from
+
+        Returns:
+            bool: Whether the size or modification time of the file differ from when it was read
+        """
+        source_stat = os.stat(csv_path)
+        return (
+            source_stat.st_size != self.source_size
+            or source_stat.st_mtime_ns != self.source_mtime_ns
+        )
+
+    def close(self) -> None:
+        """Unmaps the snapshot file"""
+        for values in [
+            self.__name_offsets,
+            self.__counts,
+            self.__rating_sums,
+            self.__favorites,
+        ]:
+            values.release()
+        self.__map.close()
+
+    def __len__(self) -> int:
+        return self.book_count
+
+    def __name(self, index: int) -> bytes:
+        """Reads the encoded name of a book from the name table"""
+        return self.__map[
+            self.__names_start
+            + self.__name_offsets[index] : self.__names_start
+            + self.__name_offsets[index + 1]
+        ]
+
+    def __find(self, book_name: str) -> int:
+        """Sanitizes the book name and binary searches the name table for it
+
+        Args:
+            book_name (str): Name of the book
+
+        Returns:
+            int: Index of the book in the arrays, -1 if the snapshot has no such book
+        """
+        book_name = Sanitizers.clear_capitalization(book_name)
+        book_name = Sanitizers.clear_white_space(book_name)
+        name = book_name.encode("utf-8")
+
+        low, high = 0, self.book_count
+        while low < high:
+            middle = (low + high) // 2
+            if self.__name(middle) < name:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self.book_count and self.__name(low) == name:
+            return low
+        return -1
+
+    def book_names(self) -> "list[str]":
+        """Gets the sanitized name of every book, in the order of their UTF-8 bytes
+
+        Returns:
+            list[str]: The names of the books
+        """
+        return [self.__name(index).decode("utf-8") for index in range(self.book_count)]
+
+    def get_readers_by_book_name(self, book_name: str) -> int:
+        """Sanitizes the book name and returns the number of distinct users that rated the book
+
+        Args:
+            book_name (str): Name of the book we want to get the readers for
+
+        Returns:
+            int: Number of distinct readers
+        """
+        index = self.__find(book_name)
+        return 0 if index < 0 else self.__counts[index]
+
+    def get_favorites_by_book_name(self, book_name: str) -> int:
+        """Sanitizes the book name and returns the number of people that have favorited the book by name
+
+        Args:
+            book_name (str): Name of the book we want to get the favorite count for
+
+        Returns:
+            int: Number of people who have that book as a favorite
+        """
+        index = self.__find(book_name)
+        return 0 if index < 0 else self.__favorites[index]
+
+    def get_average_rating_by_book_name(self, book_name: str) -> float:
+        """Sanitizes the book name and returns the average rating of a book by name
+
+        Args:
+            book_name (str): Name of the book we want to get the average rating for
+
+        Raises:
+            Exception: Failure to find average rating of book
+
+        Returns:
+            float: The average rating for that book
+        """
+        index = self.__find(book_name)
+        if index < 0:
+            raise Exception(f"Book, {book_name}'s average rating cannot be found")
+
+        # Same division as BookStats, so the snapshot gives exactly the averages of the processor
+        return self.__rating_sums[index] / self.__counts[index]
@@ -0,0 +1,340 @@
+import hashlib
+import json
+import sqlite3
+
+from csv_processor import CSVProcessor, column_aggregators
+from notion_types import DatabaseClient, DatabaseColumn, schema_fingerprint
+from pipeline import iter_rows
+
+# Progress of a journaled operation, an operation is marked started before its request is sent
+PLANNED = "planned"
+STARTED = "started"
+DONE = "done"
+
+
+def journal_value(value):
+    """Converts the row values json cannot write, like dates and numpy numbers"""
+    if hasattr(value, "isoformat"):
+        return value.isoformat()
+    if hasattr(value, "item"):
+        return value.item()
+    raise TypeError(f"Cannot journal a value of type {type(value).__name__}")
+
+
+def file_digest(path: str, block_size: int = 1 << 20) -> str:
+    """Hashes the contents of a file
+
+    Args:
+        path (str): The path of the file
+        block_size (int, optional): Number of bytes read at a time. Defaults to 1 MiB.
+
+    Returns:
+        str: Hex digest of the file
+    """
+    digest = hashlib.sha1()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class SyncJournal:
+    """A write-ahead journal of the requests a sync sends, stored in a SQLite file. A sync first writes down every
+    operation it plans to make, then marks each one as started before its request is sent and as done (with the id of
+    the page it touched) once Notion answered. A sync that stopped partway is continued from the first operation that
+    is not done. Operations are "created", "updated" and "archived", like the counts of a sync.
+    """
+
+    def __init__(self, journal_path: str) -> None:
+        """Opens (or creates) a journal
+
+        Args:
+            journal_path (str): Path of the SQLite file, ":memory:" keeps the journal in memory
+        """
+        self.journal_path = journal_path
+        self.__connection = sqlite3.connect(journal_path)
+        # Every operation is committed twice, the write-ahead log only syncs the file on checkpoints. Commits still
+        # survive the process crashing, only an operating system crash can lose the last ones.
+        self.__connection.execute("PRAGMA journal_mode = WAL")
+        self.__connection.execute("PRAGMA synchronous = NORMAL")
+        with self.__connection:
+            self.__connection.execute(
+                "CREATE TABLE IF NOT EXISTS operations ("
+                "position INTEGER PRIMARY KEY, action TEXT, row_key TEXT, "
+                "page_id TEXT, row TEXT, status TEXT)"
+            )
+            self.__connection.execute(
+                "CREATE INDEX IF NOT EXISTS operations_by_status ON operations (status, position)"
+            )
+            self.__connection.execute(
+                "CREATE TABLE IF NOT EXISTS state (name TEXT PRIMARY KEY, value TEXT)"
+            )
+
+    def close(self) -> None:
+        """Closes the SQLite file"""
+        self.__connection.close()
+
+    def run(self):
+        """Gets the run whose operations are journaled
+
+        Returns:
+            str: The run passed to plan, None if no run is journaled
+        """
+        row = self.__connection.execute(
+            "SELECT value FROM state WHERE name = 'run'"
+        ).fetchone()
+        return None if row is None else row[0]
+
+    def plan(self, run: str, operations, unchanged: int = 0) -> None:
+        """Replaces the journaled run with a new one. The operations are written in one transaction, so a run is
+        either fully planned or not journaled at all.
+
+        Args:
+            run (str): Identifies the sync, a later sync only continues the run if it passes the same value
+            operations (Iterable[tuple[str, Any, str, dict]]): (action, primary value, page id, row information) of
+                every operation in the order they are sent, page id is None for rows that are created
+            unchanged (int, optional): Number of rows that need no request. Defaults to 0.
+        """
+        with self.__connection:
+            self.__connection.execute("DELETE FROM operations")
+            self.__connection.execute("DELETE FROM state")
+            self.__connection.executemany(
+                "INSERT INTO operations (action, row_key, page_id, row, status) VALUES (?, ?, ?, ?, ?)",
+                (
+                    (
+                        action,
+                        row_key,
+                        page_id,
+                        None if row is None else json.dumps(row, default=journal_value),
+                        PLANNED,
+                    )
+                    for action, row_key, page_id, row in operations
+                ),
+            )
+            self.__connection.executemany(
+                "INSERT INTO state VALUES (?, ?)",
+                [("run", run), ("unchanged", str(unchanged))],
+            )
+
+    def pending(self):
+        """Gets the operations that are not done, in the order they were planned
+
+        Returns:
+            list[tuple[int, str, Any, str, dict, bool]]: (position, action, primary value, page id, row information,
+            whether the request might have been sent) of every operation left
+        """
+        return [
+            (
+                position,
+                action,
+                row_key,
+                page_id,
+                None if row is None else json.loads(row),
+                status == STARTED,
+            )
+            for position, action, row_key, page_id, row, status in self.__connection.execute(
+                "SELECT position, action, row_key, page_id, row, status FROM operations "
+                "WHERE status IN (?, ?) ORDER BY position",
+                (PLANNED, STARTED),
+            )
+        ]
+
+    def start(self, position: int) -> None:
+        """Marks an operation as started, right before its request is sent
+
+        Args:
+            position (int): Position of the operation
+        """
+        with self.__connection:
+            self.__connection.execute(
+                "UPDATE operations SET status = ? WHERE position = ?",
+                (STARTED, position),
+            )
+
+    def finish(self, position: int, page_id: str) -> None:
+        """Marks an operation as done
+
+        Args:
+            position (int): Position of the operation
+            page_id (str): Id of the page the operation created, updated or archived
+        """
+        with self.__connection:
+            self.__connection.execute(
+                "UPDATE operations SET status = ?, page_id = ? WHERE position = ?",
+                (DONE, page_id, position),
+            )
+
+    def counts(self) -> "dict[str, int]":
+        """Counts the operations that are done
+
+        Returns:
+            dict[str, int]: Number of rows "created", "updated", "archived" and left "unchanged"
+        """
+        counts = {"created": 0, "updated": 0, "archived": 0}
+        for action, count in self.__connection.execute(
+            "SELECT action, COUNT(*) FROM operations WHERE status = ? GROUP BY action",
+            (DONE,),
+        ):
+            counts[action] = count
+
+        row = self.__connection.execute(
+            "SELECT value FROM state WHERE name = 'unchanged'"
+        ).fetchone()
+        counts["unchanged"] = 0 if row is None else int(row[0])
+        return counts
+
+    def clear(self) -> None:
+        """Forgets the journaled run, once it is done"""
+        with self.__connection:
+            self.__connection.execute("DELETE FROM operations")
+            self.__connection.execute("DELETE FROM state")
+
+
+def sync_run(
+    database_client: DatabaseClient,
+    csv_path: str,
+    columns: "list[DatabaseColumn]",
+    reconcile: bool = False,
+) -> str:
+    """Identifies a sync, a journaled run is only continued by a sync of the same file into the same database
+
+    Args:
+        database_client (DatabaseClient): Client of the database to sync into
+        csv_path (str): The path of the ratings CSV file
+        columns (list[DatabaseColumn]): The columns we want to fill in for every book
+        reconcile (bool, optional): Only create, update and archive the rows that differ. Defaults to False.
+
+    Returns:
+        str: JSON object of the mode, schema and CSV contents of the sync
+    """
+    return json.dumps(
+        {
+            "mode": "reconcile" if reconcile else "clear",
+            "schema": schema_fingerprint(database_client.database_id, columns),
+            "csv": file_digest(csv_path),
+        }
+    )
+
+
+def plan_sync(
+    database_client: DatabaseClient,
+    csv_path: str,
+    columns: "list[DatabaseColumn]",
+    reconcile: bool = False,
+    quarantine_path=None,
+) -> "tuple[list[tuple], int]":
+    """Works out every request a sync sends, without sending any request that changes the database
+
+    Args:
+        database_client (DatabaseClient): Client of the database to sync into
+        csv_path (str): The path of the ratings CSV file
+        columns (list[DatabaseColumn]): The columns we want to fill in for every book
+        reconcile (bool, optional): Only create, update and archive the rows that differ. Defaults to False.
+        quarantine_path (str, optional): CSV file to write the malformed rows of the ratings to. Defaults to None.
+
+    Returns:
+        tuple[list[tuple], int]: The operations in the format SyncJournal.plan takes, and the number of rows left
+        unchanged
+    """
+    csv_processor = CSVProcessor(
+        csv_path,
+        aggregators=column_aggregators(columns),
+        instrumentation=database_client.instrumentation,
+        quarantine_path=quarantine_path,
+    )
+
+    if not reconcile:
+        # Every existing page is archived before the rows are created, like the sequential sync does
+        operations = [
+            ("archived", None, page["id"], None)
+            for page in database_client.notion_iter_rows(properties=[])
+        ]
+        operations.extend(
+            ("created", database_client.notion_row_key(row), None, row)
+            for row in iter_rows(csv_processor, columns)
+        )
+        return operations, 0
+
+    # Same decisions as DatabaseClient.notion_reconcile_rows
+    desired_rows = {
+        database_client.notion_row_key(row): row
+        for row in iter_rows(csv_processor, columns)
+    }
+    indexed_rows, duplicate_page_ids = database_client.notion_index_rows(
+        database_client.notion_iter_rows(
+            properties=[column.column_name for column in columns]
+        )
+    )
+
+    operations = []
+    unchanged = 0
+    for key, row in desired_rows.items():
+        indexed_row = indexed_rows.pop(key, None)
+        action = database_client.notion_plan_row(row, indexed_row)
+        if action == "unchanged":
+            unchanged += 1
+        else:
+            page_id = None if indexed_row is None else indexed_row[0]
+            operations.append((action, key, page_id, row))
+
+    operations.extend(
+        ("archived", None, page_id, None)
+        for page_id in duplicate_page_ids
+        + [page_id for page_id, _ in indexed_rows.values()]
+    )
+    return operations, unchanged
+
+
+def journaled_sync(
+    database_client: DatabaseClient,
+    csv_path: str,
+    columns: "list[DatabaseColumn]",
+    journal: SyncJournal,
+    reconcile: bool = False,
+    quarantine_path=None,
+) -> "dict[str, int]":
+    """Syncs the ratings of a CSV file into a database through a journal. When the journal holds an unfinished run of
+    the same sync, the CSV file is not processed again and the database is not read again, only the operations that
+    are not done are sent.
+
+    Args:
+        database_client (DatabaseClient): Client of the database to sync into
+        csv_path (str): The path of the ratings CSV file
+        columns (list[DatabaseColumn]): The columns we want to fill in for every book
+        journal (SyncJournal): The journal of the sync
+        reconcile (bool, optional): Only create, update and archive the rows that differ. Defaults to False.
+        quarantine_path (str, optional): CSV file to write the malformed rows of the ratings to. Defaults to None.
+
+    Returns:
+        dict[str, int]: Number of rows "created", "updated", "archived" and left "unchanged"
+    """
+    run = sync_run(database_client, csv_path, columns, reconcile)
+    if journal.run() != run:
+        # Whatever an unfinished run of another sync did is cleaned up by the new plan, which reads the database again
+        operations, unchanged = plan_sync(
+            database_client, csv_path, columns, reconcile, quarantine_path
+        )
+        journal.plan(run, operations, unchanged)
+
+    for position, action, row_key, page_id, row, started in journal.pending():
+        if action == "created" and started:
+            # The page may have been created without us hearing back. Every page with the same primary value was
+            # archived or did not exist when the run was planned, so a page with that value is the one we created.
+            page = database_client.notion_find_row(row_key)
+            if page is not None:
+                journal.finish(position, page["id"])
+                continue
+
+        journal.start(position)
+        if action == "created":
+            page_id = database_client.notion_add_row(row)
+        elif action == "updated":
+            database_client.notion_update_row(page_id, row)
+        else:
+            # Archiving a page twice leaves it archived, so these are safe to send again
+            database_client.notion_archive_row(page_id)
+        journal.finish(position, page_id)
+
+    counts = journal.counts()
+    journal.clear()
+    return counts
@@ -1,6 +1,21 @@
-import pytest
-from csv_processor import CSVProcessor
+import csv
+import os
+import statistics
 
+import pytest
+from aggregators import Aggregator
+from csv_processor import (
+    AggregationBackend,
+    CSVProcessor,
+    BookUsers,
+    SeenPairs,
+    column_aggregators,
+    iter_line_chunks_reversed,
+    parse_rating_chunk,
+    read_lines_reversed,
+)
+from config import DATABASE_COLUMNS, STATISTICS_COLUMNS
+from rating_snapshot import RatingSnapshot
 
 TEST_DATA = "../data/sample.csv"
 
@@ -27,3 +42,473 @@ def test_replaced_average_rating():
     """Tests whether we get the correct average rating after a replacement further down the CSV file"""
     average_rating = pytest.csv_processor.get_average_rating_by_book_name("Book 2")
     assert average_rating == 4
+
+
+def test_batch_rows_match():
+    """Tests whether the batch accessor builds the same rows as calling every column's processor function"""
+    book_names = sorted(pytest.csv_processor.book_stats)
+    assert pytest.csv_processor.get_rows(DATABASE_COLUMNS, book_names) == [
+        {
+            column.column_name: column.csv_processor_function(
+                pytest.csv_processor, book_name
+            )
+            for column in DATABASE_COLUMNS
+        }
+        for book_name in book_names
+    ]
+
+    # Looking up a book that was never rated does not add it
+    assert pytest.csv_processor.get_favorites_by_book_name("Book 404") == 0
+    assert "book 404" not in pytest.csv_processor.book_stats
+    with pytest.raises(Exception):
+        pytest.csv_processor.get_rows(DATABASE_COLUMNS, ["book 404"])
+
+
+def test_read_lines_reversed():
+    """Tests whether streaming the file backwards, by line or by chunk, yields the same lines as reading it forwards"""
+    with open(TEST_DATA, "r") as file:
+        expected = file.read().split("\n")[::-1]
+
+    for block_size in [1, 3, 16, 1 << 16]:
+        assert list(read_lines_reversed(TEST_DATA, block_size)) == expected
+        lines = [
+            line
+            for _, chunk in iter_line_chunks_reversed(TEST_DATA, block_size)
+            for line in reversed(chunk.split("\n"))
+        ]
+        assert [line for line in lines if line] == [line for line in expected if line]
+
+
+def test_small_block_size_matches():
+    """Tests whether the metrics do not depend on the block size used to stream the file"""
+    csv_processor = CSVProcessor(TEST_DATA, block_size=5)
+    assert csv_processor.get_average_rating_by_book_name("Book 1") == 4.8
+    assert csv_processor.get_average_rating_by_book_name("Book 2") == 4
+    assert csv_processor.get_favorites_by_book_name("Book 1") == 4
+
+
+def test_numpy_backend_matches():
+    """Tests whether the columnar NumPy backend gives exactly the same metrics as the Python backend"""
+    pytest.importorskip("numpy")
+    for csv_path in [TEST_DATA, "../data/ratings.csv"]:
+        python_processor = CSVProcessor(csv_path)
+        numpy_processor = CSVProcessor(csv_path, backend=AggregationBackend.NUMPY)
+        assert numpy_processor.name_to_count == python_processor.name_to_count
+        assert numpy_processor.name_to_favorites == python_processor.name_to_favorites
+        assert (
+            numpy_processor.name_to_average_rating
+            == python_processor.name_to_average_rating
+        )
+
+
+def test_sharded_backend_matches():
+    """Tests whether merging sharded results keeps the most recent rating of every (book, user) pair"""
+    python_processor = CSVProcessor("../data/ratings.csv")
+    for workers in [1, 2, 4]:
+        sharded_processor = CSVProcessor(
+            "../data/ratings.csv", backend=AggregationBackend.SHARDED, workers=workers
+        )
+        assert sharded_processor.name_to_count == python_processor.name_to_count
+        assert sharded_processor.name_to_favorites == python_processor.name_to_favorites
+        assert (
+            sharded_processor.name_to_average_rating
+            == python_processor.name_to_average_rating
+        )
+
+    sharded_processor = CSVProcessor(
+        TEST_DATA, block_size=4, backend=AggregationBackend.SHARDED, workers=3
+    )
+    assert sharded_processor.get_average_rating_by_book_name("Book 2") == 4
+
+
+def test_backends_match_non_dyadic_ratings(tmp_path):
+    """Tests whether every backend agrees up to rounding on ratings that are not exact binary fractions"""
+    csv_path = str(tmp_path / "ratings.csv")
+    with open(csv_path, "w") as file:
+        for user in range(300):
+            for book in range(3):
+                rating = [0.1, 0.2, 0.7, 3.3, 4.9][(user + book) % 5]
+                file.write(f"Book {book},User {user},{rating}\n")
+
+    python_processor = CSVProcessor(csv_path)
+    backends = [
+        {"backend": AggregationBackend.SHARDED, "workers": 3},
+        {"backend": AggregationBackend.EXTERNAL, "memory_budget": 0},
+    ]
+    try:
+        import numpy  # noqa: F401
+
+        backends.append({"backend": AggregationBackend.NUMPY})
+    except ImportError:
+        pass
+
+    for options in backends:
+        csv_processor = CSVProcessor(csv_path, block_size=256, **options)
+        assert csv_processor.name_to_count == python_processor.name_to_count
+        assert csv_processor.name_to_average_rating == pytest.approx(
+            python_processor.name_to_average_rating
+        )
+
+
+def test_external_backend_matches():
+    """Tests whether spilling pairs to disk keeps the most recent rating of every (book, user) pair"""
+    python_processor = CSVProcessor("../data/ratings.csv")
+    # A budget of 0 spills the pairs of every chunk, later chunks replace the ratings of earlier ones
+    for options in [{}, {"memory_budget": 0}, {"memory_budget": 0, "block_size": 256}]:
+        external_processor = CSVProcessor(
+            "../data/ratings.csv", backend=AggregationBackend.EXTERNAL, **options
+        )
+        assert external_processor.name_to_count == python_processor.name_to_count
+        assert (
+            external_processor.name_to_favorites == python_processor.name_to_favorites
+        )
+        assert (
+            external_processor.name_to_average_rating
+            == python_processor.name_to_average_rating
+        )
+
+    external_processor = CSVProcessor(
+        TEST_DATA, block_size=4, backend=AggregationBackend.EXTERNAL, memory_budget=0
+    )
+    assert external_processor.get_average_rating_by_book_name("Book 2") == 4
+
+
+def test_snapshot_matches_until_stale(tmp_path):
+    """Tests whether a snapshot answers lookups like the processor it was written from until the CSV file changes"""
+    csv_path = str(tmp_path / "ratings.csv")
+    snapshot_path = str(tmp_path / "ratings.snapshot")
+    with open("../data/ratings.csv", "r") as file:
+        contents = file.read()
+    with open(csv_path, "w") as file:
+        file.write(contents)
+
+    assert RatingSnapshot.load(snapshot_path, csv_path) is None
+    csv_processor = CSVProcessor(csv_path)
+    csv_processor.write_snapshot(snapshot_path)
+
+    snapshot = RatingSnapshot.load(snapshot_path, csv_path)
+    assert len(snapshot) == len(csv_processor.book_stats)
+    assert snapshot.book_names() == sorted(
+        csv_processor.book_stats, key=lambda name: name.encode("utf-8")
+    )
+    for book_name in csv_processor.book_stats:
+        for name in [book_name, f" {book_name.upper()} "]:
+            assert snapshot.get_average_rating_by_book_name(
+                name
+            ) == csv_processor.get_average_rating_by_book_name(name)
+            assert snapshot.get_favorites_by_book_name(
+                name
+            ) == csv_processor.get_favorites_by_book_name(name)
+            assert snapshot.get_readers_by_book_name(
+                name
+            ) == csv_processor.get_readers_by_book_name(name)
+    assert snapshot.get_favorites_by_book_name("missing book") == 0
+    with pytest.raises(Exception):
+        snapshot.get_average_rating_by_book_name("missing book")
+    snapshot.close()
+
+    # Appending changes the size, a file rewritten to the same size only has another modification time
+    with open(csv_path, "a") as file:
+        file.write("Refactoring,Alex M,1\n")
+    assert RatingSnapshot.load(snapshot_path, csv_path) is None
+    CSVProcessor(csv_path).write_snapshot(snapshot_path)
+    stat = os.stat(csv_path)
+    os.utime(csv_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+    assert RatingSnapshot.load(snapshot_path, csv_path) is None
+
+    with open(snapshot_path, "wb") as file:
+        file.write(b"not a snapshot")
+    assert RatingSnapshot.load(snapshot_path, csv_path) is None
+
+
+def test_seen_pairs():
+    """Tests whether both pair sets behave like a set while they grow"""
+    for seen_pairs in [SeenPairs(capacity_bits=1), BookUsers()]:
+        expected = set()
+        for index in range(2000):
+            pair = (f"book {index % 37}", f"user {index % 101}")
+            assert seen_pairs.add(*pair) == (pair not in expected)
+            expected.add(pair)
+
+        assert len(seen_pairs) == len(expected)
+        assert all(pair in seen_pairs for pair in expected)
+        assert ("book 0", "user 1") not in seen_pairs
+        assert ("missing book", "user 0") not in seen_pairs
+
+    csv_processor = CSVProcessor("../data/ratings.csv")
+    compact_processor = CSVProcessor("../data/ratings.csv", compact_pairs=True)
+    assert isinstance(compact_processor.seen_pairs, SeenPairs)
+    assert len(compact_processor.seen_pairs) == len(csv_processor.seen_pairs)
+    assert (
+        compact_processor.name_to_average_rating == csv_processor.name_to_average_rating
+    )
+
+
+def test_incremental_checkpoint(tmp_path):
+    """Tests whether appended rows, including changed ratings, are applied on top of a checkpoint"""
+    csv_path = str(tmp_path / "ratings.csv")
+    checkpoint_path = str(tmp_path / "ratings.checkpoint")
+    with open(TEST_DATA, "r") as file:
+        initial_rows = file.read()
+
+    with open(csv_path, "w") as file:
+        file.write(initial_rows + "\n")
+    csv_processor = CSVProcessor(csv_path, checkpoint_path=checkpoint_path)
+    assert csv_processor.changed_books == {"book 1", "book 2"}
+    assert not csv_processor.resumed_checkpoint
+
+    # Lauren O changes her rating and the last line has no newline yet
+    with open(csv_path, "a") as file:
+        file.write("Book 1,Lauren O,1\nBook 3,Jordan S,5\nBook 3,Lauren O,2")
+    csv_processor = CSVProcessor(csv_path, checkpoint_path=checkpoint_path)
+    assert csv_processor.changed_books == {"book 1", "book 3"}
+    assert csv_processor.resumed_checkpoint
+    assert csv_processor.get_average_rating_by_book_name("Book 1") == 4
+    assert csv_processor.get_favorites_by_book_name("Book 1") == 3
+
+    with open(csv_path, "a") as file:
+        file.write("\nBook 3,Alex M,4\n")
+    csv_processor = CSVProcessor(csv_path, checkpoint_path=checkpoint_path)
+    full_processor = CSVProcessor(csv_path)
+    assert csv_processor.changed_books == {"book 3"}
+    assert csv_processor.name_to_count == full_processor.name_to_count
+    assert csv_processor.name_to_favorites == full_processor.name_to_favorites
+    assert csv_processor.name_to_average_rating == full_processor.name_to_average_rating
+
+    # A rewritten file does not match the checkpoint and is read from the start
+    with open(csv_path, "w") as file:
+        file.write("Book 4,Alex M,3\n")
+    csv_processor = CSVProcessor(csv_path, checkpoint_path=checkpoint_path)
+    assert csv_processor.changed_books == {"book 4"}
+    assert not csv_processor.resumed_checkpoint
+    assert list(csv_processor.name_to_count) == ["book 4"]
+
+
+def test_deferred_checkpoint(tmp_path):
+    """Tests whether a deferred checkpoint is only saved once it is committed"""
+    csv_path = str(tmp_path / "ratings.csv")
+    checkpoint_path = str(tmp_path / "ratings.checkpoint")
+    # A checkpoint from before the SQLite format is started over
+    with open(checkpoint_path, "wb") as file:
+        file.write(b"not a checkpoint")
+    with open(TEST_DATA, "r") as file:
+        initial_rows = file.read()
+    with open(csv_path, "w") as file:
+        file.write(initial_rows + "\n")
+    CSVProcessor(csv_path, checkpoint_path=checkpoint_path)
+
+    with open(csv_path, "a") as file:
+        file.write("Book 1,Lauren O,1\nBook 3,Jordan S,5\n")
+    csv_processor = CSVProcessor(
+        csv_path, checkpoint_path=checkpoint_path, defer_checkpoint=True
+    )
+    assert csv_processor.changed_books == {"book 1", "book 3"}
+    csv_processor.discard_checkpoint()
+
+    # The discarded run is read again, and committing it saves it
+    csv_processor = CSVProcessor(
+        csv_path, checkpoint_path=checkpoint_path, defer_checkpoint=True
+    )
+    assert csv_processor.changed_books == {"book 1", "book 3"}
+    assert csv_processor.get_average_rating_by_book_name("Book 1") == 4
+    csv_processor.commit_checkpoint()
+    with pytest.raises(Exception):
+        csv_processor.commit_checkpoint()
+
+    csv_processor = CSVProcessor(csv_path, checkpoint_path=checkpoint_path)
+    assert csv_processor.changed_books == set()
+    assert csv_processor.get_average_rating_by_book_name("Book 1") == 4
+
+
+def test_aggregators_match_every_backend(tmp_path):
+    """Tests whether the declared aggregators give the exact statistics of the latest ratings with every backend"""
+    latest_ratings = {}
+    with open("../data/ratings.csv", "r") as file:
+        for row in file.read().split("\n"):
+            if row:
+                book_name, user, rating = row.split(",")
+                key = (book_name.lower().strip(), user.lower().strip())
+                latest_ratings[key] = float(rating)
+    book_to_ratings = {}
+    for (book_name, _), rating in latest_ratings.items():
+        book_to_ratings.setdefault(book_name, []).append(rating)
+
+    aggregators = column_aggregators(DATABASE_COLUMNS + STATISTICS_COLUMNS)
+    assert [aggregator.name for aggregator in aggregators] == [
+        "median",
+        "standard deviation",
+        "histogram",
+    ]
+
+    processors = [
+        CSVProcessor("../data/ratings.csv", aggregators=aggregators),
+        CSVProcessor(
+            "../data/ratings.csv",
+            backend=AggregationBackend.SHARDED,
+            workers=2,
+            aggregators=aggregators,
+        ),
+        CSVProcessor(
+            "../data/ratings.csv",
+            checkpoint_path=str(tmp_path / "ratings.checkpoint"),
+            aggregators=aggregators,
+        ),
+        CSVProcessor(
+            "../data/ratings.csv",
+            backend=AggregationBackend.EXTERNAL,
+            memory_budget=0,
+            aggregators=aggregators,
+        ),
+    ]
+    try:
+        import numpy  # noqa: F401
+
+        processors.append(
+            CSVProcessor(
+                "../data/ratings.csv",
+                backend=AggregationBackend.NUMPY,
+                aggregators=aggregators,
+            )
+        )
+    except ImportError:
+        pass
+
+    for csv_processor in processors:
+        for book_name, ratings in book_to_ratings.items():
+            aggregates = csv_processor.book_stats[book_name].aggregates
+            assert aggregates["median"] == statistics.median(ratings)
+            assert aggregates["standard deviation"] == pytest.approx(
+                statistics.pstdev(ratings)
+            )
+            assert sum(
+                int(step.split(": ")[1]) for step in aggregates["histogram"].split(", ")
+            ) == len(ratings)
+            assert csv_processor.get_readers_by_book_name(book_name) == len(ratings)
+
+    # Without aggregators the processor keeps no aggregate state
+    assert pytest.csv_processor.book_stats["book 1"].aggregates is None
+
+
+def test_incomplete_aggregator_cannot_be_created():
+    """Tests whether an aggregator missing one of its methods fails when it is created instead of mid-aggregation"""
+
+    class RatingCount(Aggregator):
+        name = "count"
+
+        def create(self):
+            return [0]
+
+        def add(self, state, rating: float) -> None:
+            state[0] += 1
+
+        def result(self, state) -> int:
+            return state[0]
+
+    with pytest.raises(TypeError):
+        RatingCount()
+
+
+def test_malformed_rows_are_quarantined(tmp_path):
+    """Tests whether quoted fields are read and malformed rows are skipped and quarantined by every backend"""
+    csv_path = str(tmp_path / "ratings.csv")
+    with open(csv_path, "w") as file:
+        file.write(
+            "\n".join(
+                [
+                    '"Dune, Messiah",Alex M,4',
+                    "Book 1,Alex M,5",
+                    "Book 1,Alex M",
+                    "Book 1,Jordan S,great",
+                    "",
+                    "Book 1,Jordan S,nan",
+                    "Book 2,Alex M,3,extra",
+                    "Book 2,Jordan S,7",
+                    "Book 2,Jordan S,2.5",
+                ]
+            )
+            + "\n"
+        )
+
+    backends = [
+        {},
+        {"block_size": 16},
+        {"backend": AggregationBackend.SHARDED, "workers": 2},
+        {"checkpoint_path": str(tmp_path / "ratings.checkpoint")},
+        {"backend": AggregationBackend.EXTERNAL, "memory_budget": 0},
+    ]
+    try:
+        import numpy  # noqa: F401
+
+        backends.append({"backend": AggregationBackend.NUMPY})
+    except ImportError:
+        pass
+
+    for options in backends:
+        quarantine_path = tmp_path / "quarantine.csv"
+        csv_processor = CSVProcessor(
+            csv_path, quarantine_path=str(quarantine_path), **options
+        )
+        assert csv_processor.name_to_average_rating == {
+            "dune, messiah": 4,
+            "book 1": 5,
+            "book 2": 2.5,
+        }
+        assert [line for line, _, _ in csv_processor.quarantined_rows] == [
+            3,
+            4,
+            6,
+            7,
+            8,
+        ]
+
+        with open(quarantine_path, newline="") as file:
+            quarantined_rows = list(csv.reader(file))
+        assert quarantined_rows[0] == ["line_number", "reason", "row"]
+        assert quarantined_rows[1] == [
+            "3",
+            "Expected 3 fields but found 2",
+            "Book 1,Alex M",
+        ]
+        assert quarantined_rows[5][2] == "Book 2,Jordan S,7"
+
+
+def test_unclosed_quote_only_quarantines_its_line(tmp_path):
+    """Tests whether a quote that is never closed quarantines its own line and not the rows after it"""
+    csv_path = str(tmp_path / "ratings.csv")
+    lines = [f"Book {index},User {index},4" for index in range(20)]
+    lines.insert(3, '"Broken,uX,5')
+    with open(csv_path, "w") as file:
+        file.write("\n".join(lines) + "\n")
+
+    backends = [
+        {},
+        {"backend": AggregationBackend.SHARDED, "workers": 2},
+        {"checkpoint_path": str(tmp_path / "ratings.checkpoint")},
+        {"backend": AggregationBackend.EXTERNAL, "memory_budget": 0},
+    ]
+    try:
+        import numpy  # noqa: F401
+
+        backends.append({"backend": AggregationBackend.NUMPY})
+    except ImportError:
+        pass
+
+    for options in backends:
+        csv_processor = CSVProcessor(csv_path, **options)
+        assert len(csv_processor.book_stats) == 20
+        assert csv_processor.quarantined_rows == [
+            (4, "Expected 3 fields but found 1", '"Broken,uX,5')
+        ]
+
+
+def test_shifted_fields_are_quarantined():
+    """Tests whether a row with a field too few next to one with a field too many is quarantined, instead of
+    shifting the fields in between into the wrong columns"""
+    columns, malformed = parse_rating_chunk(
+        "Dune,Alex M\n4,Sam K,Steel,5\nEmma,Bo T,2\n"
+    )
+    assert columns == (["Emma"], ["Bo T"], [2.0])
+    assert [(index, reason) for index, reason, _ in malformed] == [
+        (0, "Expected 3 fields but found 2"),
+        (1, "Expected 3 fields but found 4"),
+    ]
@@ -71,3 +71,28 @@ def test_database_clear_rows():
     assert len(pytest.database_client.notion_get_rows()) == 1
     pytest.database_client.notion_clear_database()
     assert len(pytest.database_client.notion_get_rows()) == 0
+
+
+def test_database_reconcile_rows():
+    """Tests whether reconciling only creates, updates and archives the rows that differ"""
+    assert isinstance(pytest.database_client, DatabaseClient)
+    title, rating, favorites = [column.column_name for column in DATABASE_COLUMNS]
+    pytest.database_client.notion_add_row({title: "Kept", rating: 1, favorites: 0})
+    pytest.database_client.notion_add_row({title: "Changed", rating: 2, favorites: 0})
+    pytest.database_client.notion_add_row({title: "Removed", rating: 3, favorites: 0})
+
+    counts = pytest.database_client.notion_reconcile_rows(
+        [
+            {title: "Kept", rating: 1, favorites: 0},
+            {title: "Changed", rating: 4.5, favorites: 1},
+            {title: "Added", rating: 5, favorites: 1},
+        ]
+    )
+    assert counts == {"created": 1, "updated": 1, "archived": 1, "unchanged": 1}
+
+    rows = [
+        pytest.database_client.notion_read_row(page)
+        for page in pytest.database_client.notion_get_rows()
+    ]
+    assert sorted(row[title] for row in rows) == ["added", "changed", "kept"]
+    assert {title: "changed", rating: 4.5, favorites: 1} in rows
@@ -0,0 +1,706 @@
+import asyncio
+import datetime
+import json
+import threading
+import time
+
+import pytest
+from notion_client.errors import APIErrorCode, APIResponseError
+
+from async_database_client import AsyncDatabaseClient
+from config import DATABASE_COLUMNS
+from fake_notion import FakeNotion
+from instrumentation import Instrumentation
+from job_runner import SyncJob, load_manifest, run_jobs
+from main import sync
+from notion_mirror import NotionMirror
+from notion_types import (
+    DatabaseActions,
+    DatabaseClient,
+    DatabaseColumn,
+    NotionType,
+    RowEncoder,
+    Sanitizers,
+    construct_action_payload,
+)
+from pipeline import pipelined_sync
+from rate_limiting import RequestExecutor, TokenBucket
+from sync_journal import SyncJournal, journaled_sync
+
+TITLE, RATING, FAVORITES = [column.column_name for column in DATABASE_COLUMNS]
+
+
+@pytest.fixture(autouse=True)
+def pytest_configure():
+    """Creates a fake Notion workspace and a database client connected to it"""
+    pytest.fake_notion = FakeNotion()
+    pytest.database_id = pytest.fake_notion.create_database(title_name=TITLE)
+    pytest.database_client = DatabaseClient(
+        pytest.database_id,
+        DATABASE_COLUMNS,
+        executor=RequestExecutor(base_delay=0.001),
+        client=pytest.fake_notion.client(),
+    )
+
+
+def test_fake_schema():
+    """Tests whether the client adds the missing columns to the fake database"""
+    assert pytest.database_client.notion_get_all_column_keys() == {
+        TITLE,
+        RATING,
+        FAVORITES,
+    }
+
+
+def test_fake_schema_in_one_request(tmp_path):
+    """Tests whether the whole schema diff is sent in one update and a cached schema skips Notion entirely"""
+    database_id = pytest.fake_notion.create_database()
+    fake_client = pytest.fake_notion.client()
+    fake_client.databases.update(
+        database_id, properties={"Stale": {"name": "Stale", "rich_text": {}}}
+    )
+    schema_cache_path = str(tmp_path / "schema.json")
+
+    def connect():
+        return DatabaseClient(
+            database_id,
+            DATABASE_COLUMNS,
+            executor=RequestExecutor(base_delay=0.001),
+            client=pytest.fake_notion.client(),
+            schema_cache_path=schema_cache_path,
+        )
+
+    requests = pytest.fake_notion.requests()
+    updates = pytest.fake_notion.requests("databases.update")
+    database_client = connect()
+    assert pytest.fake_notion.requests("databases.update") == updates + 1
+    assert pytest.fake_notion.requests() == requests + 2
+    assert database_client.notion_get_all_column_keys() == {TITLE, RATING, FAVORITES}
+
+    requests = pytest.fake_notion.requests()
+    connect()
+    assert pytest.fake_notion.requests() == requests
+
+
+def test_fake_row_encoder():
+    """Tests whether the compiled encoder builds the same payload as construct_action_payload for every column type"""
+    columns = [
+        DatabaseColumn(
+            "Name",
+            NotionType.TITLE,
+            sanitizers=[Sanitizers.clear_white_space],
+            is_primary=True,
+        ),
+        DatabaseColumn("Notes", NotionType.TEXT),
+        DatabaseColumn("Rating", NotionType.NUMBER),
+        DatabaseColumn("Genre", NotionType.SELECT),
+        DatabaseColumn("Tags", NotionType.MULTI_SELECT),
+        DatabaseColumn("Read", NotionType.CHECKBOX),
+        DatabaseColumn("Finished", NotionType.DATE),
+        DatabaseColumn("Link", NotionType.URL),
+    ]
+    row = {
+        "Name": ' "Dune" ',
+        "Notes": "Spice\nmust flow",
+        "Rating": 4.5,
+        "Genre": "Sci-Fi",
+        "Tags": ["classic", "désert"],
+        "Read": True,
+        "Finished": datetime.date(2022, 10, 1),
+        "Link": None,
+    }
+    row_encoder = RowEncoder(columns)
+    payload = row_encoder.encode(row)
+    assert payload == construct_action_payload(columns, DatabaseActions.INSERT_ROW, row)
+    assert json.loads(row_encoder.encode_json(row)) == payload
+
+    database_id = pytest.fake_notion.create_database(title_name="Name")
+    database_client = DatabaseClient(
+        database_id,
+        columns,
+        executor=RequestExecutor(base_delay=0.001),
+        client=pytest.fake_notion.client(),
+    )
+    database_client.notion_add_row(row)
+    assert database_client.notion_read_row(database_client.notion_get_rows()[0]) == {
+        **row,
+        "Name": '"Dune"',
+        "Finished": "2022-10-01",
+    }
+
+
+def test_fake_plan_row_with_dates():
+    """Tests whether a row whose dates are stored in Notion is planned as unchanged, also with Notion's datetime format"""
+    columns = [
+        DatabaseColumn("Name", NotionType.TITLE, is_primary=True),
+        DatabaseColumn("Finished", NotionType.DATE),
+    ]
+    database_id = pytest.fake_notion.create_database(title_name="Name")
+    database_client = DatabaseClient(
+        database_id,
+        columns,
+        executor=RequestExecutor(base_delay=0.001),
+        client=pytest.fake_notion.client(),
+    )
+    row = {"Name": "Dune", "Finished": datetime.date(2022, 10, 1)}
+    database_client.notion_add_row(row)
+    indexed_rows, _ = database_client.notion_index_rows(
+        database_client.notion_get_rows()
+    )
+    assert database_client.notion_plan_row(row, indexed_rows["Dune"]) == "unchanged"
+    assert (
+        database_client.notion_plan_row(
+            {**row, "Finished": datetime.date(2022, 10, 2)}, indexed_rows["Dune"]
+        )
+        == "updated"
+    )
+
+    finished = datetime.datetime(2022, 10, 1, 18, 30)
+    read_row = ("page", {"Name": "Dune", "Finished": "2022-10-01T18:30:00.000+00:00"})
+    assert (
+        database_client.notion_plan_row({**row, "Finished": finished}, read_row)
+        == "unchanged"
+    )
+
+
+def test_fake_pagination():
+    """Tests whether all rows are read back across pages of results"""
+    for index in range(250):
+        pytest.database_client.notion_add_row(
+            {TITLE: f"Book {index}", RATING: index, FAVORITES: 0}
+        )
+
+    rows = pytest.database_client.notion_get_rows()
+    assert len(rows) == 250
+    assert pytest.fake_notion.requests("databases.query") == 3
+    assert pytest.database_client.notion_clear_database() == 250
+    assert pytest.database_client.notion_get_rows() == []
+
+
+def test_fake_streaming_rows():
+    """Tests whether rows are projected to the asked properties and archiving starts before pagination ends"""
+    for index in range(250):
+        pytest.database_client.notion_add_row(
+            {TITLE: f"Book {index}", RATING: index, FAVORITES: 0}
+        )
+
+    rows = pytest.database_client.notion_iter_rows(properties=[TITLE])
+    page = next(rows)
+    assert set(page["properties"]) == {TITLE}
+    assert "parent" not in page
+    assert len(list(rows)) == 249
+
+    pytest.fake_notion.request_log.clear()
+    assert pytest.database_client.notion_clear_database() == 250
+    endpoints = [endpoint for endpoint, _, _ in pytest.fake_notion.request_log]
+    assert endpoints.count("databases.query") == 3
+    last_query = max(
+        position
+        for position, endpoint in enumerate(endpoints)
+        if endpoint == "databases.query"
+    )
+    assert endpoints.index("pages.update") < last_query
+
+
+def test_fake_sync_and_reconcile():
+    """Tests whether the main flow fills the database and a second reconcile changes nothing"""
+    counts = sync(pytest.database_client, "../data/ratings.csv", DATABASE_COLUMNS)
+    assert counts["created"] == 20
+
+    requests = pytest.fake_notion.requests()
+    counts = sync(
+        pytest.database_client, "../data/ratings.csv", DATABASE_COLUMNS, reconcile=True
+    )
+    assert counts == {"created": 0, "updated": 0, "archived": 0, "unchanged": 20}
+    assert pytest.fake_notion.requests() == requests + 1
+
+
+def test_fake_checkpointed_reconcile(tmp_path):
+    """Tests whether a reconcile with a checkpoint only updates the books of the appended rows, once they synced"""
+    csv_path = str(tmp_path / "ratings.csv")
+    checkpoint_path = str(tmp_path / "ratings.checkpoint")
+    with open("../data/ratings.csv", "r") as file:
+        initial_rows = file.read()
+    with open(csv_path, "w") as file:
+        file.write(initial_rows)
+
+    counts = sync(
+        pytest.database_client,
+        csv_path,
+        DATABASE_COLUMNS,
+        reconcile=True,
+        checkpoint_path=checkpoint_path,
+    )
+    assert counts == {"created": 20, "updated": 0, "archived": 0, "unchanged": 0}
+
+    # Pages of books without appended rows are left alone
+    pytest.database_client.notion_add_row({TITLE: "Stale", RATING: 1, FAVORITES: 0})
+    with open(csv_path, "a") as file:
+        file.write("Primed to Perform,Casey R,5\n")
+
+    pytest.fake_notion.fail_next(400, APIErrorCode.ValidationError)
+    with pytest.raises(APIResponseError):
+        sync(
+            pytest.database_client,
+            csv_path,
+            DATABASE_COLUMNS,
+            reconcile=True,
+            checkpoint_path=checkpoint_path,
+        )
+
+    # The failed sync did not save the checkpoint, so its rows are synced again
+    counts = sync(
+        pytest.database_client,
+        csv_path,
+        DATABASE_COLUMNS,
+        reconcile=True,
+        checkpoint_path=checkpoint_path,
+    )
+    assert counts == {"created": 0, "updated": 1, "archived": 0, "unchanged": 0}
+
+    counts = sync(
+        pytest.database_client,
+        csv_path,
+        DATABASE_COLUMNS,
+        reconcile=True,
+        checkpoint_path=checkpoint_path,
+    )
+    assert counts == {"created": 0, "updated": 0, "archived": 0, "unchanged": 0}
+
+    # Without the checkpoint every page is reconciled again
+    counts = sync(pytest.database_client, csv_path, DATABASE_COLUMNS, reconcile=True)
+    assert counts == {"created": 0, "updated": 0, "archived": 1, "unchanged": 20}
+
+
+def test_fake_pipelined_sync():
+    """Tests whether the pipelined sync sends the same rows in the same order as the sequential sync"""
+    sync(pytest.database_client, "../data/ratings.csv", DATABASE_COLUMNS)
+    expected = [
+        pytest.database_client.notion_read_row(page)
+        for page in pytest.database_client.notion_get_rows()
+    ]
+
+    counts = pipelined_sync(
+        pytest.database_client,
+        "../data/ratings.csv",
+        DATABASE_COLUMNS,
+        upload_workers=1,
+    )
+    assert counts == {"created": 20, "updated": 0, "archived": 20, "unchanged": 0}
+    assert [
+        pytest.database_client.notion_read_row(page)
+        for page in pytest.database_client.notion_get_rows()
+    ] == expected
+
+    pytest.database_client.notion_add_row({TITLE: "Stale", RATING: 1, FAVORITES: 0})
+    counts = pipelined_sync(
+        pytest.database_client, "../data/ratings.csv", DATABASE_COLUMNS, reconcile=True
+    )
+    assert counts == {"created": 0, "updated": 0, "archived": 1, "unchanged": 20}
+
+
+def test_fake_pipelined_sync_stops_on_error():
+    """Tests whether a request that cannot succeed stops every upload worker and fails the sync instead of hanging"""
+    fake_notion = FakeNotion(latency=0.05)
+    database_client = DatabaseClient(
+        fake_notion.create_database(title_name=TITLE),
+        DATABASE_COLUMNS,
+        executor=RequestExecutor(base_delay=0.001),
+        client=fake_notion.client(),
+    )
+
+    def fail_mid_upload():
+        while fake_notion.requests("pages.create") < 2:
+            time.sleep(0.001)
+        fake_notion.fail_next(400, APIErrorCode.ValidationError)
+
+    errors = []
+
+    def run():
+        try:
+            pipelined_sync(
+                database_client,
+                "../data/ratings.csv",
+                DATABASE_COLUMNS,
+                reconcile=True,
+                upload_workers=2,
+                queue_size=1,
+            )
+        except Exception as error:
+            errors.append(error)
+
+    threading.Thread(target=fail_mid_upload, daemon=True).start()
+    sync_thread = threading.Thread(target=run, daemon=True)
+    sync_thread.start()
+    sync_thread.join(timeout=10)
+
+    assert not sync_thread.is_alive()
+    assert len(errors) == 1 and isinstance(errors[0], APIResponseError)
+    assert errors[0].status == 400
+    # The other worker stops after the request it was sending, the rest of the rows are never sent
+    created = fake_notion.requests("pages.create")
+    assert created < 20
+    time.sleep(0.2)
+    assert fake_notion.requests("pages.create") == created
+
+
+def test_fake_job_runner(tmp_path):
+    """Tests whether every job syncs its own CSV file into its own database over one client within the global limit"""
+    fake_notion = FakeNotion(latency=0.002)
+    jobs = []
+    for index in range(3):
+        csv_path = tmp_path / f"ratings_{index}.csv"
+        csv_path.write_text(
+            "".join(
+                f"Book {book},Alex M,{(book + index) % 5 + 1}\n"
+                for book in range(5 + index)
+            )
+        )
+        jobs.append(
+            SyncJob(
+                f"job {index}",
+                str(csv_path),
+                fake_notion.create_database(title_name=TITLE),
+                reconcile=index == 2,
+            )
+        )
+    manifest_path = tmp_path / "manifest.json"
+    manifest_path.write_text(
+        json.dumps(
+            {
+                "jobs": [
+                    {
+                        "name": job.name,
+                        "csv_path": job.csv_path,
+                        "database_id": job.database_id,
+                        "reconcile": job.reconcile,
+                    }
+                    for job in jobs
+                ]
+                + [
+                    {
+                        "name": "missing",
+                        "csv_path": str(tmp_path / "missing.csv"),
+                        "database_id": fake_notion.create_database(title_name=TITLE),
+                        "columns": ["database", "statistics"],
+                    }
+                ]
+            }
+        )
+    )
+
+    summaries = run_jobs(
+        load_manifest(str(manifest_path)),
+        client=fake_notion.client(),
+        global_limit=2,
+        database_limit=2,
+        aggregation_workers=2,
+        rate_limiter=TokenBucket(10000),
+    )
+    assert fake_notion.max_in_flight <= 2
+    assert [summary.name for summary in summaries] == [
+        "job 0",
+        "job 1",
+        "job 2",
+        "missing",
+    ]
+
+    for index, (job, summary) in enumerate(zip(jobs, summaries)):
+        assert summary.error is None
+        assert summary.books == 5 + index
+        assert summary.counts == {
+            "created": 5 + index,
+            "updated": 0,
+            "archived": 0,
+            "unchanged": 0,
+        }
+        # Reading the schema, adding the columns, reading the rows and creating every row
+        assert summary.requests == 3 + summary.books
+        assert "rows/sec" in summary.describe()
+
+        database_client = DatabaseClient(
+            job.database_id, DATABASE_COLUMNS, client=fake_notion.client()
+        )
+        assert {
+            row[TITLE]: row[RATING]
+            for row in map(
+                database_client.notion_read_row, database_client.notion_get_rows()
+            )
+        } == {f"book {book}": (book + index) % 5 + 1 for book in range(5 + index)}
+
+    # A failing job does not stop the others
+    assert "FileNotFoundError" in summaries[-1].error
+    assert "failed" in summaries[-1].describe()
+
+    with pytest.raises(Exception):
+        SyncJob("unknown columns", "ratings.csv", "database", column_sets=["missing"])
+
+
+def test_fake_job_runner_upload_fails(tmp_path):
+    """Tests whether a job whose upload fails mid-stream stops, while the other jobs finish and get their summaries"""
+    fake_notion = FakeNotion(latency=0.01)
+    jobs = []
+    # Job 2 has more rows than its upload queue holds, so the queue is full when its request fails
+    for index, books in enumerate([5, 5, 1000]):
+        csv_path = tmp_path / f"ratings_{index}.csv"
+        csv_path.write_text(
+            "".join(f"Book {book},Alex M,{book % 5 + 1}\n" for book in range(books))
+        )
+        jobs.append(
+            SyncJob(
+                f"job {index}",
+                str(csv_path),
+                fake_notion.create_database(title_name=TITLE),
+            )
+        )
+    page_ids = [fake_notion.database_page_ids[job.database_id] for job in jobs]
+
+    def fail_mid_upload():
+        # Once the other jobs created their rows, the next request is one of job 2
+        while len(page_ids[0]) < 5 or len(page_ids[1]) < 5 or len(page_ids[2]) < 3:
+            time.sleep(0.001)
+        fake_notion.fail_next(400, APIErrorCode.ValidationError)
+
+    summaries = []
+    threading.Thread(target=fail_mid_upload, daemon=True).start()
+    runner = threading.Thread(
+        target=lambda: summaries.extend(
+            run_jobs(
+                jobs,
+                client=fake_notion.client(),
+                global_limit=4,
+                database_limit=2,
+                aggregation_workers=1,
+                rate_limiter=TokenBucket(10000),
+            )
+        ),
+        daemon=True,
+    )
+    runner.start()
+    runner.join(timeout=20)
+
+    assert not runner.is_alive()
+    assert [summary.error is None for summary in summaries] == [True, True, False]
+    assert "APIResponseError" in summaries[2].error
+    assert summaries[0].counts["created"] == summaries[1].counts["created"] == 5
+
+    # The other upload worker of job 2 stopped after the request it was sending, instead of sending every row
+    created = len(page_ids[2])
+    assert created < 50
+    time.sleep(0.1)
+    assert len(page_ids[2]) == created
+
+
+def test_fake_mirror(tmp_path):
+    """Tests whether a mirrored client only reads the rows edited since its last refresh"""
+    mirror_path = str(tmp_path / "mirror.sqlite")
+    database_client = DatabaseClient(
+        pytest.database_id,
+        DATABASE_COLUMNS,
+        executor=RequestExecutor(base_delay=0.001),
+        client=pytest.fake_notion.client(),
+        mirror=NotionMirror(mirror_path, pytest.database_id),
+    )
+    for index in range(250):
+        pytest.database_client.notion_add_row(
+            {TITLE: f"Book {index}", RATING: index, FAVORITES: 0}
+        )
+    assert database_client.notion_refresh_mirror() == 250
+
+    # Pretend the rows were written long ago, then edit one of them through a client without the mirror
+    for page in pytest.fake_notion.pages.values():
+        page["last_edited_time"] = "2020-01-01T00:00:00.000+00:00"
+    page_id = pytest.database_client.notion_find_row("Book 7")["id"]
+    pytest.database_client.notion_update_row(
+        page_id, {TITLE: "Book 7", RATING: 70, FAVORITES: 1}
+    )
+
+    mirror = NotionMirror(mirror_path, pytest.database_id)
+    database_client.mirror = mirror
+    assert database_client.notion_refresh_mirror() == 1
+    assert len(mirror) == 250
+    # Lookups go through the same sanitizers as the stored titles
+    page = database_client.notion_find_row("BOOK 7 ")
+    assert database_client.notion_read_row(page)[RATING] == 70
+    assert "book 300" not in mirror
+
+    # Once refreshed, lookups and reads are answered by the mirror without a request
+    requests = pytest.fake_notion.requests()
+    for index in range(10):
+        assert database_client.notion_find_row(f"Book {index}") is not None
+    assert "book 9" in mirror
+    assert len(database_client.notion_get_rows()) == 250
+    assert pytest.fake_notion.requests() == requests
+
+    # Rows archived through the mirrored client leave the mirror right away
+    requests = pytest.fake_notion.requests("databases.query")
+    assert database_client.notion_clear_database() == 250
+    assert database_client.notion_get_rows() == []
+    assert pytest.fake_notion.requests("databases.query") == requests
+
+
+def test_fake_mirror_refreshes_once(tmp_path):
+    """Tests whether a mirrored client refreshes the mirror on its first read only, until it is asked to refresh"""
+    for index in range(10):
+        pytest.database_client.notion_add_row(
+            {TITLE: f"Book {index}", RATING: index, FAVORITES: 0}
+        )
+    database_client = DatabaseClient(
+        pytest.database_id,
+        DATABASE_COLUMNS,
+        executor=RequestExecutor(base_delay=0.001),
+        client=pytest.fake_notion.client(),
+        mirror=NotionMirror(str(tmp_path / "mirror.sqlite"), pytest.database_id),
+    )
+
+    requests = pytest.fake_notion.requests()
+    for index in range(10):
+        assert database_client.notion_find_row(f"Book {index}") is not None
+    assert pytest.fake_notion.requests() == requests + 1
+
+    # Rows added elsewhere are only seen after an explicit refresh
+    pytest.database_client.notion_add_row({TITLE: "Book 10", RATING: 1, FAVORITES: 0})
+    assert database_client.notion_find_row("Book 10") is None
+    assert database_client.notion_refresh_mirror() >= 1
+    assert database_client.notion_find_row("Book 10") is not None
+
+
+def test_fake_journaled_sync(tmp_path, monkeypatch):
+    """Tests whether a journaled sync that crashed partway only sends the requests it had not finished"""
+    sync(pytest.database_client, "../data/ratings.csv", DATABASE_COLUMNS)
+    journal_path = str(tmp_path / "journal.sqlite")
+
+    # The fifth page gets created but the run dies before hearing back
+    add_row = pytest.database_client.notion_add_row
+    added_rows = []
+
+    def crashing_add_row(data):
+        added_rows.append(data)
+        page_id = add_row(data)
+        if len(added_rows) == 5:
+            raise Exception("Connection lost")
+        return page_id
+
+    monkeypatch.setattr(pytest.database_client, "notion_add_row", crashing_add_row)
+    with pytest.raises(Exception, match="Connection lost"):
+        journaled_sync(
+            pytest.database_client,
+            "../data/ratings.csv",
+            DATABASE_COLUMNS,
+            SyncJournal(journal_path),
+        )
+    monkeypatch.undo()
+
+    # Only the lookup of the fifth row and the 15 rows left are sent, the database is neither read nor cleared again
+    requests = pytest.fake_notion.requests()
+    queries = pytest.fake_notion.requests("databases.query")
+    creates = pytest.fake_notion.requests("pages.create")
+    journal = SyncJournal(journal_path)
+    counts = journaled_sync(
+        pytest.database_client, "../data/ratings.csv", DATABASE_COLUMNS, journal
+    )
+    assert counts == {"created": 20, "updated": 0, "archived": 20, "unchanged": 0}
+    assert pytest.fake_notion.requests() == requests + 16
+    assert pytest.fake_notion.requests("databases.query") == queries + 1
+    assert pytest.fake_notion.requests("pages.create") == creates + 15
+    assert journal.run() is None
+
+    titles = [
+        pytest.database_client.notion_read_row(page)[TITLE]
+        for page in pytest.database_client.notion_get_rows()
+    ]
+    assert len(titles) == 20
+    assert len(set(titles)) == 20
+
+    counts = journaled_sync(
+        pytest.database_client,
+        "../data/ratings.csv",
+        DATABASE_COLUMNS,
+        journal,
+        reconcile=True,
+    )
+    assert counts == {"created": 0, "updated": 0, "archived": 0, "unchanged": 20}
+
+
+def test_fake_instrumentation(tmp_path):
+    """Tests whether an instrumented sync counts every request and times the CSV phases and client methods"""
+    instrumentation = Instrumentation(parse_profile_path=str(tmp_path / "parse.prof"))
+    database_client = DatabaseClient(
+        pytest.database_id,
+        DATABASE_COLUMNS,
+        executor=RequestExecutor(base_delay=0.001, instrumentation=instrumentation),
+        client=pytest.fake_notion.client(),
+        instrumentation=instrumentation,
+    )
+    pytest.fake_notion.fail_next(502, APIErrorCode.ServiceUnavailable)
+    sync(database_client, "../data/ratings.csv", DATABASE_COLUMNS)
+
+    summary = instrumentation.summary()
+    counters = summary["counters"]
+    timers = summary["timers"]
+    assert counters['notion_requests_total{endpoint="pages.create",status="200"}'] == 20
+    assert (
+        counters['notion_requests_total{endpoint="databases.query",status="502"}'] == 1
+    )
+    assert counters["notion_retries_total"] == 1
+    assert counters['notion_request_bytes_total{endpoint="pages.create"}'] > 0
+    assert counters["csv_books_total"] == 20
+    assert timers['notion_request_seconds{endpoint="databases.query"}']["count"] == 2
+    assert timers['notion_method_seconds{method="notion_add_row"}']["count"] == 20
+    assert timers["notion_encode_seconds"]["count"] == 20
+    assert timers['csv_parse_seconds{backend="python"}']["count"] == 1
+    assert (tmp_path / "parse.prof").stat().st_size > 0
+
+    prometheus_path = tmp_path / "metrics.prom"
+    instrumentation.write_prometheus(str(prometheus_path))
+    lines = prometheus_path.read_text().splitlines()
+    assert "# TYPE notion_request_seconds histogram" in lines
+    assert (
+        'notion_request_seconds_bucket{endpoint="pages.create",le="+Inf"} 20' in lines
+    )
+
+
+def test_fake_errors_are_retried():
+    """Tests whether throttled and failed requests are retried by the client"""
+    pytest.fake_notion.fail_next(
+        429, APIErrorCode.RateLimited, headers={"Retry-After": "0.01"}
+    )
+    pytest.fake_notion.fail_next(503, APIErrorCode.ServiceUnavailable)
+    pytest.database_client.notion_add_row({TITLE: "Book", RATING: 1, FAVORITES: 0})
+
+    assert len(pytest.database_client.notion_get_rows()) == 1
+    assert pytest.database_client.executor.retries == 2
+    assert pytest.database_client.executor.throttled_responses == 1
+
+    # Notion may have created the page before a 502, so the create is not sent again, while a read is
+    pytest.fake_notion.fail_next(502, APIErrorCode.ServiceUnavailable)
+    with pytest.raises(APIResponseError):
+        pytest.database_client.notion_add_row(
+            {TITLE: "Book 2", RATING: 1, FAVORITES: 0}
+        )
+    pytest.fake_notion.fail_next(502, APIErrorCode.ServiceUnavailable)
+    assert len(pytest.database_client.notion_get_rows()) == 1
+    assert pytest.database_client.executor.retries == 3
+
+
+def test_fake_async_bulk_insert():
+    """Tests whether the async client inserts many rows concurrently under a rate limit"""
+    fake_notion = FakeNotion(latency=0.01, requests_per_second=500)
+    database_id = fake_notion.create_database(title_name=TITLE)
+    DatabaseClient(
+        database_id,
+        DATABASE_COLUMNS,
+        executor=RequestExecutor(),
+        client=fake_notion.client(),
+    )
+    async_database_client = AsyncDatabaseClient(
+        database_id,
+        DATABASE_COLUMNS,
+        rate_limiter=TokenBucket(400),
+        client=fake_notion.async_client(),
+    )
+    rows = [{TITLE: f"Book {index}", RATING: 1, FAVORITES: 0} for index in range(100)]
+
+    asyncio.run(async_database_client.notion_add_rows(rows))
+    assert fake_notion.requests("pages.create") == 100
+    assert len(asyncio.run(async_database_client.notion_get_rows())) == 100
@@ -0,0 +1,190 @@
+import asyncio
+import threading
+import time
+
+import httpx
+import pytest
+from notion_client.errors import APIErrorCode, APIResponseError, RequestTimeoutError
+
+from rate_limiting import RequestExecutor, TokenBucket
+
+
+def notion_error(status: int, code: APIErrorCode, headers=None) -> APIResponseError:
+    """Builds the error the notion client raises for a failed response"""
+    return APIResponseError(httpx.Response(status, headers=headers), "Error", code)
+
+
+class FlakyEndpoint:
+    """An endpoint that raises the given errors before succeeding"""
+
+    def __init__(self, errors) -> None:
+        self.errors = list(errors)
+        self.calls = 0
+
+    def __call__(self, *args, **kwargs):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return {"object": "page", "args": args, "kwargs": kwargs}
+
+
+def test_token_bucket_burst_then_rate():
+    """Tests whether the bucket allows a full burst and then spaces requests out at its rate"""
+    token_bucket = TokenBucket(rate=50, capacity=5)
+    start = time.monotonic()
+    for _ in range(5):
+        assert token_bucket.acquire() == 0
+
+    for _ in range(10):
+        token_bucket.acquire()
+    assert time.monotonic() - start >= 10 / 50 * 0.9
+
+
+def test_token_bucket_async():
+    """Tests whether coroutines sharing a bucket are limited together"""
+    token_bucket = TokenBucket(rate=100, capacity=1)
+
+    async def acquire_many():
+        await asyncio.gather(*[token_bucket.acquire_async() for _ in range(21)])
+
+    start = time.monotonic()
+    asyncio.run(acquire_many())
+    assert time.monotonic() - start >= 20 / 100 * 0.9
+
+
+def test_executor_retries_and_honors_retry_after():
+    """Tests whether throttled and failing requests are retried and counted"""
+    request_executor = RequestExecutor(base_delay=0.001, max_concurrency=4)
+    endpoint = FlakyEndpoint(
+        [
+            notion_error(429, APIErrorCode.RateLimited, {"Retry-After": "0.05"}),
+            notion_error(502, APIErrorCode.ServiceUnavailable),
+        ]
+    )
+
+    start = time.monotonic()
+    response = request_executor.call(
+        endpoint, "page id", archived=True, idempotent=True
+    )
+    assert time.monotonic() - start >= 0.05
+    assert response["args"] == ("page id",)
+    assert response["kwargs"] == {"archived": True}
+    assert endpoint.calls == 3
+    assert request_executor.retries == 2
+    assert request_executor.throttled_responses == 1
+    assert request_executor.throttled_seconds == pytest.approx(0.05)
+    # Halved once for the throttle, then grown slightly by the success
+    assert 2 < request_executor.concurrency_limit < 3
+
+
+def test_executor_gives_up():
+    """Tests whether errors that cannot succeed and exhausted retries are raised"""
+    request_executor = RequestExecutor(max_retries=1, base_delay=0.001)
+    endpoint = FlakyEndpoint([notion_error(400, APIErrorCode.ValidationError)])
+    with pytest.raises(APIResponseError):
+        request_executor.call(endpoint)
+    assert endpoint.calls == 1
+
+    endpoint = FlakyEndpoint([notion_error(503, APIErrorCode.ServiceUnavailable)] * 2)
+    with pytest.raises(APIResponseError):
+        request_executor.call(endpoint)
+    assert endpoint.calls == 2
+    assert request_executor.in_flight == 0
+
+
+def test_executor_only_retries_ambiguous_failures_when_idempotent():
+    """Tests whether requests that are not idempotent are only retried when Notion certainly did not apply them"""
+    request_executor = RequestExecutor(base_delay=0.001)
+    ambiguous_errors = [
+        notion_error(502, APIErrorCode.ServiceUnavailable),
+        notion_error(500, APIErrorCode.InternalServerError),
+        RequestTimeoutError(),
+        httpx.ReadError("Connection reset"),
+    ]
+    for error in ambiguous_errors:
+        endpoint = FlakyEndpoint([error])
+        with pytest.raises(type(error)):
+            request_executor.call(endpoint)
+        assert endpoint.calls == 1
+
+        endpoint = FlakyEndpoint([error])
+        request_executor.call(endpoint, idempotent=True)
+        assert endpoint.calls == 2
+
+    endpoint = FlakyEndpoint(
+        [
+            notion_error(429, APIErrorCode.RateLimited),
+            notion_error(409, APIErrorCode.ConflictError),
+            notion_error(503, APIErrorCode.ServiceUnavailable),
+            httpx.ConnectError("Connection refused"),
+        ]
+    )
+    assert request_executor.call(endpoint)["object"] == "page"
+    assert endpoint.calls == 5
+
+
+def test_executor_async():
+    """Tests whether coroutines are retried the same way"""
+    request_executor = RequestExecutor(base_delay=0.001)
+    endpoint = FlakyEndpoint([notion_error(429, APIErrorCode.RateLimited)])
+
+    async def async_endpoint():
+        return endpoint()
+
+    response = asyncio.run(request_executor.call_async(async_endpoint))
+    assert response["object"] == "page"
+    assert request_executor.retries == 1
+
+
+def test_executor_shared_by_event_loops_and_threads():
+    """Tests whether an executor works across event loops and keeps one concurrency limit for threads and coroutines"""
+    request_executor = RequestExecutor(max_concurrency=2)
+    lock = threading.Lock()
+    in_flight = [0, 0]
+
+    def enter():
+        with lock:
+            in_flight[0] += 1
+            in_flight[1] = max(in_flight[1], in_flight[0])
+
+    def leave():
+        with lock:
+            in_flight[0] -= 1
+
+    def endpoint():
+        enter()
+        time.sleep(0.005)
+        leave()
+        return {"object": "page"}
+
+    async def async_endpoint():
+        enter()
+        await asyncio.sleep(0.005)
+        leave()
+        return {"object": "page"}
+
+    async def call_many():
+        return await asyncio.gather(
+            *[request_executor.call_async(async_endpoint) for _ in range(10)]
+        )
+
+    # Every asyncio.run has its own event loop
+    assert len(asyncio.run(call_many())) == 10
+    assert len(asyncio.run(call_many())) == 10
+
+    threads = [
+        threading.Thread(
+            target=lambda: [request_executor.call(endpoint) for _ in range(10)]
+        )
+        for _ in range(2)
+    ]
+    for thread in threads:
+        thread.start()
+    assert len(asyncio.run(call_many())) == 10
+    for thread in threads:
+        thread.join(timeout=10)
+
+    assert not any(thread.is_alive() for thread in threads)
+    assert in_flight[1] <= 2
+    assert request_executor.in_flight == 0
+    assert request_executor.requests == 50